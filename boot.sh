@@ -2,8 +2,28 @@
 set -e
 
 whoami
-python /home/docker/repo/src/manage.py migrate --noinput
-python /home/docker/repo/src/manage.py collectstatic --noinput
-python /home/docker/repo/src/manage.py createcachetable
+
+# Start the metrics of the new deploy from zero, see app/metrics.py
+rm -rf "${METRICS_DIR:-/tmp/image_gallery_metrics}"
+
+if [ "$FAST_BOOT" = "False" ]; then
+    python /home/docker/repo/src/manage.py migrate --noinput
+    python /home/docker/repo/src/manage.py collectstatic --noinput
+    python /home/docker/repo/src/manage.py createcachetable
+    if [ "$IMAGE_SOURCE" = "library" ]; then
+        # Index the image library once, instead of in every worker
+        python /home/docker/repo/src/manage.py index_image_library
+    fi
+else
+    # The same steps in one process, skipping those with nothing to do, and timed.
+    # The workers warm up by themselves before they accept requests, see app/startup.py.
+    python /home/docker/repo/src/manage.py prepare_deploy
+fi
+
+if [ "$APP_SERVER" = "asgi" ]; then
+    # Serve the async views under uvicorn, see ASYNC_VIEWS in settings.py
+    cd /home/docker/repo/src
+    ASYNC_VIEWS=True exec uvicorn image_gallery.asgi:application --host 0.0.0.0 --port 8080 --workers 2
+fi
 
 uwsgi --ini /home/docker/repo/uwsgi.ini
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import AppInstallation, OneTimeToken
+from .models import AppInstallation, ImageBlob, ImageReference, OneTimeToken
 
 admin.site.register(OneTimeToken)
 admin.site.register(AppInstallation)
+admin.site.register(ImageBlob)
+admin.site.register(ImageReference)
@@ -0,0 +1,127 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+
+from .blob_urls import get_response_mode
+from .deltas import compute_delta
+from .image_store import StoredImage, aload_pointer, uses_blob_files
+from .installations import aget_installation_settings
+from .render import aget_bitmap, aget_encoded, aget_image
+from .views import (
+    RenderRequest,
+    authenticate_jwt,
+    generate_login_token,
+    get_blob_url_response,
+    get_delta_base,
+    get_delta_response,
+    get_not_modified_response,
+    get_pointer_response,
+    get_render_response,
+)
+
+# Async variants of the device facing API views, for running under an ASGI server.
+# app/urls.py serves these instead of the DRF views when settings.ASYNC_VIEWS is set.
+# DRF views cannot be async, so these are plain Django views that render DRF errors themselves.
+
+
+def get_api_exception_response(exception: APIException) -> JsonResponse:
+    return JsonResponse({"detail": exception.detail}, status=exception.status_code)
+
+
+class AsyncGetLoginToken(View):
+    async def get(self, request):
+        try:
+            decoded_jwt = authenticate_jwt(request)
+        except APIException as exception:
+            return get_api_exception_response(exception)
+        one_time_token = await sync_to_async(generate_login_token)(
+            installation_id=decoded_jwt.installation_id,
+        )
+        return JsonResponse({"login_token": one_time_token})
+
+
+class AsyncGetRender(View):
+    async def get(self, request):
+        # Like DRF, answers API exceptions raised while rendering, such as an unavailable upstream, with their status.
+        try:
+            return await self.render(request)
+        except APIException as exception:
+            return get_api_exception_response(exception)
+
+    async def render(self, request):
+        decoded_jwt = authenticate_jwt(request)
+        installation_id = decoded_jwt.installation_id
+        installation_settings = await aget_installation_settings(installation_id)
+
+        render_request = RenderRequest.from_request(
+            request, installation_id, installation_settings.is_vertically_oriented
+        )
+        response_mode = get_response_mode(request.GET.get("response-mode"))
+        pointer = await aload_pointer(render_request.cache_key)
+        not_modified = get_not_modified_response(request, pointer, render_request)
+        if not_modified:
+            return not_modified
+        if response_mode != "content" or uses_blob_files():
+            # Looking for the blob may query the database tier of the render cache.
+            pointer_response = await sync_to_async(get_pointer_response)(
+                request, pointer, response_mode, render_request
+            )
+            if pointer_response:
+                return pointer_response
+        if response_mode != "content":
+            return get_blob_url_response(
+                request,
+                await aget_stored_render(render_request),
+                response_mode,
+                render_request,
+            )
+
+        stored_image = await aget_stored_render(render_request)
+        if render_request.algorithm:
+            return await aget_bitmap_response(request, stored_image, render_request)
+        return get_render_response(stored_image, render_request)
+
+
+async def aget_bitmap_response(
+    request, stored_bitmap: StoredImage, render_request: RenderRequest
+):
+    # Like get_bitmap_response in app/views.py. The last frame is kept in the render cache, whose database
+    # tier is only used from the thread sensitive executor, where Django closes the connections it opens.
+    delta_base = None
+    if settings.RENDER_DELTA_FRAMES:
+        delta_base = await sync_to_async(get_delta_base)(
+            request, stored_bitmap, render_request
+        )
+    delta = None
+    if delta_base:
+        # Computing a delta is CPU bound, so it runs in a thread pool instead of the event loop.
+        delta = await sync_to_async(compute_delta, thread_sensitive=False)(
+            delta_base[1],
+            stored_bitmap.content,
+            render_request.width,
+            render_request.height,
+        )
+    return get_delta_response(stored_bitmap, render_request, delta_base, delta)
+
+
+async def aget_stored_render(render_request: RenderRequest) -> StoredImage:
+    # Like get_stored_render in app/views.py.
+    if render_request.algorithm:
+        return await aget_bitmap(
+            render_request.installation_id,
+            render_request.width,
+            render_request.height,
+            render_request.algorithm,
+        )
+    if render_request.encoding:
+        return await aget_encoded(
+            render_request.installation_id,
+            render_request.width,
+            render_request.height,
+            render_request.encoding,
+        )
+    return await aget_image(
+        render_request.installation_id, render_request.width, render_request.height
+    )
@@ -0,0 +1,20 @@
+import secrets
+
+# Batch render responses are multipart/mixed, with one part per target in request order.
+# Every part has its own headers, like the response of a single render request,
+# plus X-Render-Index and X-Render-Status, so a failed target does not fail the whole batch.
+
+
+def encode_multipart(parts: list[tuple[dict[str, str], bytes]]) -> tuple[bytes, str]:
+    # Returns the body and the content type with its boundary.
+    boundary = secrets.token_hex(16)
+    chunks = []
+    for headers, content in parts:
+        chunks.append(f"--{boundary}\r\n".encode())
+        for name, value in headers.items():
+            chunks.append(f"{name}: {value}\r\n".encode())
+        chunks.append(b"\r\n")
+        chunks.append(content)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks), f"multipart/mixed; boundary={boundary}"
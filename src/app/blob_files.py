@@ -0,0 +1,149 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Image blobs as files, see settings.RENDER_BLOB_STORE.
+# Render cache hits are served straight from these files with FileResponse, which uWSGI sends with sendfile()
+# (or its offload threads), so the image never passes through Python. See get_file_render_response in app/views.py.
+#
+# A blob is stored under the SHA-256 digest of its content, sharded into directories by the first two pairs of
+# hex digits, like ab/cd/abcd1234...., so that no directory grows too large.
+# A blob is written to a temporary file in its directory first and then renamed, so readers,
+# which may be in other workers, never see a partly written file.
+# Blobs are evicted least recently used first once all blobs together take more than settings.RENDER_BLOB_MAX_BYTES.
+# Reading a blob marks it as used by updating its modification time, at most once per TOUCH_INTERVAL.
+
+TOUCH_INTERVAL = 60
+# Eviction removes blobs until they take up no more than this share of the maximum,
+# so that it does not have to run again right away.
+EVICTION_LOW_WATER_MARK = 0.9
+TEMPORARY_PREFIX = ".tmp-"
+
+
+class BlobFileStore:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Eviction scans the whole store, so each process only runs it after writing a tenth of the maximum.
+        self._written_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    def write(self, digest: str, content: bytes):
+        path = self.get_path(digest)
+        if os.path.exists(path):
+            # The content is the same, only mark it as used.
+            self._touch(path)
+            return
+        shard = os.path.dirname(path)
+        os.makedirs(shard, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=shard, prefix=TEMPORARY_PREFIX
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(content)
+            os.chmod(temporary_path, 0o644)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        with self._lock:
+            self._written_bytes += len(content)
+            should_evict = self._written_bytes > self.max_bytes / 10
+            if should_evict:
+                self._written_bytes = 0
+        if should_evict:
+            self.evict()
+
+    def open(self, digest: str):
+        # Returns the open blob file, or None if it does not exist.
+        try:
+            file = open(self.get_path(digest), "rb")
+        except FileNotFoundError:
+            return None
+        if os.fstat(file.fileno()).st_mtime < time.time() - TOUCH_INTERVAL:
+            self._touch(file.name)
+        return file
+
+    def read(self, digest: str) -> bytes | None:
+        file = self.open(digest)
+        if file is None:
+            return None
+        with file:
+            return file.read()
+
+    def delete(self, digest: str):
+        try:
+            os.unlink(self.get_path(digest))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _touch(path: str):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted in the meantime.
+            pass
+
+    def evict(self) -> int:
+        # Returns the number of evicted blobs.
+        blobs = []  # (mtime, size, path)
+        total_bytes = 0
+        for shard, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(shard, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(TEMPORARY_PREFIX):
+                    # Left behind by a worker that was killed while writing.
+                    if stat.st_mtime < time.time() - 60 * 60:
+                        self._unlink(path)
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+        if total_bytes <= self.max_bytes:
+            return 0
+        evicted = 0
+        target_bytes = self.max_bytes * EVICTION_LOW_WATER_MARK
+        for _, size, path in sorted(blobs):
+            if total_bytes <= target_bytes:
+                break
+            self._unlink(path)
+            total_bytes -= size
+            evicted += 1
+        logger.info("Evicted %s image blobs", evicted)
+        return evicted
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_blob_file_store() -> BlobFileStore:
+    key = (settings.RENDER_BLOB_DIR, settings.RENDER_BLOB_MAX_BYTES)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = BlobFileStore(*key)
+    return store
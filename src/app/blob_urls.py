@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+
+# Immutable urls of stored images, named after the SHA-256 digest of their content, see GetRenderBlob in app/views.py.
+# Once a device knows the url of its current image, downloading it again does not need the app: the response is
+# cacheable forever, by the device and by any caching proxy or CDN in front of the app.
+# GetRender answers with the url instead of the image with settings.RENDER_RESPONSE_MODE, or `?response-mode=`:
+#   "content": The image itself.
+#   "redirect": A redirect to the url of the image.
+#   "pointer": The url of the image in a small JSON object.
+# The urls are not authenticated, the digest of an image can only be known by someone who was sent its url.
+
+RESPONSE_MODES = ("content", "redirect", "pointer")
+
+# The extension of a blob url tells the content type, which the blob itself does not store.
+BLOB_CONTENT_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+    "bin": "application/octet-stream",
+}
+BLOB_EXTENSIONS = {
+    content_type: extension for extension, content_type in BLOB_CONTENT_TYPES.items()
+}
+
+# Like the hashed static files of whitenoise.
+IMMUTABLE_MAX_AGE = 10 * 365 * 24 * 60 * 60
+
+
+def get_blob_url(digest: str, content_type: str) -> str:
+    name = f"{digest}.{BLOB_EXTENSIONS[content_type]}"
+    if settings.RENDER_BLOB_URL:
+        return settings.RENDER_BLOB_URL + name
+    return reverse("render-blob", args=[name])
+
+
+def get_default_response_mode() -> str:
+    if settings.RENDER_RESPONSE_MODE not in RESPONSE_MODES:
+        raise ImproperlyConfigured(
+            f"Invalid render response mode {settings.RENDER_RESPONSE_MODE}"
+        )
+    return settings.RENDER_RESPONSE_MODE
+
+
+def get_response_mode(requested: str | None) -> str:
+    if requested is None:
+        return get_default_response_mode()
+    if requested not in RESPONSE_MODES:
+        raise ValidationError(f"Invalid response mode {requested}")
+    return requested
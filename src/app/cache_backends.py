@@ -0,0 +1,250 @@
+import collections
+import pickle
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Like LocMemCache, the in-memory tier is shared by all threads of a process, keyed by LOCATION.
+_memory_tiers = {}
+_memory_tiers_lock = threading.Lock()
+
+
+class MemoryTier:
+    # A least recently used cache with a byte budget.
+
+    def __init__(self, max_bytes: int, max_item_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        # key -> (expires_at, size, is_pickled, value)
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, _, is_pickled, stored = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._delete(key)
+                return None
+            self.entries.move_to_end(key)
+        return pickle.loads(stored) if is_pickled else stored
+
+    def set(self, key, value, expires_at):
+        # Images are stored as they are, anything else is pickled like in LocMemCache.
+        is_pickled = not isinstance(value, bytes)
+        stored = pickle.dumps(value) if is_pickled else value
+        size = len(stored)
+        with self.lock:
+            self._delete(key)
+            if size > self.max_item_bytes:
+                return
+            self.entries[key] = (expires_at, size, is_pickled, stored)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def delete(self, key):
+        with self.lock:
+            return self._delete(key)
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        return entry is not None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def count(self, tier, counter):
+        with self.lock:
+            counters = self.counters.setdefault(tier, {"hits": 0, "misses": 0})
+            counters[counter] += 1
+
+
+class TieredCache(BaseCache):
+    # A cache backend that checks a per-process in-memory LRU first, then a list of other cache aliases in order.
+    # For the render cache, that is a file-based cache shared by all uWSGI workers, and then the database cache.
+    #
+    # OPTIONS:
+    #   TIERS: The cache aliases behind the in-memory tier, fastest first.
+    #   MEMORY_MAX_BYTES: Byte budget of the in-memory tier. Least recently used entries are evicted beyond it.
+    #   MEMORY_MAX_ITEM_BYTES: Larger values skip the in-memory tier.
+    #   PROMOTE_ON_HIT: Copy a value found in a slower tier into all faster tiers.
+    #   WRITE_THROUGH: Write to all tiers on set. Otherwise, only the in-memory tier and the first tier are written.
+    #
+    # The slower tiers store (expiry time, value), so a promoted value expires at the same time in every tier.
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._tier_aliases = options.get("TIERS", [])
+        self._promote_on_hit = options.get("PROMOTE_ON_HIT", True)
+        self._write_through = options.get("WRITE_THROUGH", True)
+        with _memory_tiers_lock:
+            self._memory = _memory_tiers.setdefault(
+                location,
+                MemoryTier(
+                    max_bytes=options.get("MEMORY_MAX_BYTES", 32 * 1024 * 1024),
+                    max_item_bytes=options.get(
+                        "MEMORY_MAX_ITEM_BYTES", 2 * 1024 * 1024
+                    ),
+                ),
+            )
+
+    @property
+    def _tiers(self):
+        return [(alias, caches[alias]) for alias in self._tier_aliases]
+
+    def _write_tiers(self):
+        return self._tiers if self._write_through else self._tiers[:1]
+
+    @staticmethod
+    def _remaining_timeout(expires_at):
+        if expires_at is None:
+            return None
+        return max(expires_at - time.time(), 0.001)
+
+    # The cache API
+
+    def _promote(self, key, memory_key, stored, missed_tiers, version):
+        if not self._promote_on_hit:
+            return
+        expires_at, value = stored
+        self._memory.set(memory_key, value, expires_at)
+        for missed_tier in missed_tiers:
+            missed_tier.set(
+                key,
+                stored,
+                timeout=self._remaining_timeout(expires_at),
+                version=version,
+            )
+
+    def get(self, key, default=None, version=None):
+        memory_key = self.make_and_validate_key(key, version=version)
+        value = self._memory.get(memory_key)
+        if value is not None:
+            self._memory.count("memory", "hits")
+            return value
+        self._memory.count("memory", "misses")
+
+        missed_tiers = []
+        for alias, tier in self._tiers:
+            stored = tier.get(key, version=version)
+            if not isinstance(stored, tuple):
+                # A miss, or a value that was not written through this backend.
+                self._memory.count(alias, "misses")
+                missed_tiers.append(tier)
+                continue
+            self._memory.count(alias, "hits")
+            self._promote(key, memory_key, stored, missed_tiers, version)
+            return stored[1]
+        return default
+
+    def get_from_tiers(self, key, default=None, version=None):
+        # Like get, but skips the in-memory tier, for a value that another process may have replaced since.
+        # The value found is promoted into the in-memory tier again.
+        self._memory.delete(self.make_and_validate_key(key, version=version))
+        return self.get(key, default=default, version=version)
+
+    def get_many(self, keys, version=None):
+        # Asks every slower tier once for all keys it is still missing, instead of once per key.
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._memory.get(self.make_and_validate_key(key, version=version))
+            if value is not None:
+                self._memory.count("memory", "hits")
+                found[key] = value
+            else:
+                self._memory.count("memory", "misses")
+                missing.append(key)
+
+        missed_tiers = []
+        for alias, tier in self._tiers:
+            if not missing:
+                break
+            stored_values = tier.get_many(missing, version=version)
+            still_missing = []
+            for key in missing:
+                stored = stored_values.get(key)
+                if not isinstance(stored, tuple):
+                    self._memory.count(alias, "misses")
+                    still_missing.append(key)
+                    continue
+                self._memory.count(alias, "hits")
+                memory_key = self.make_and_validate_key(key, version=version)
+                self._promote(key, memory_key, stored, missed_tiers, version)
+                found[key] = stored[1]
+            missed_tiers.append(tier)
+            missing = still_missing
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        memory_key = self.make_and_validate_key(key, version=version)
+        expires_at = self.get_backend_timeout(timeout)
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key, version=version)
+            return
+        self._memory.set(memory_key, value, expires_at)
+        for _, tier in self._write_tiers():
+            tier.set(
+                key,
+                (expires_at, value),
+                timeout=self._remaining_timeout(expires_at),
+                version=version,
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.has_key(key, version=version):
+            return False
+        self.set(key, value, timeout=timeout, version=version)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, version=version)
+        if value is None:
+            return False
+        self.set(key, value, timeout=timeout, version=version)
+        return True
+
+    def delete(self, key, version=None):
+        memory_key = self.make_and_validate_key(key, version=version)
+        deleted = self._memory.delete(memory_key)
+        for _, tier in self._tiers:
+            deleted = tier.delete(key, version=version) or deleted
+        return deleted
+
+    def has_key(self, key, version=None):
+        memory_key = self.make_and_validate_key(key, version=version)
+        if self._memory.get(memory_key) is not None:
+            return True
+        return any(tier.has_key(key, version=version) for _, tier in self._tiers)
+
+    def clear(self):
+        self._memory.clear()
+        for _, tier in self._tiers:
+            tier.clear()
+
+    def stats(self) -> dict:
+        # Hit and miss counters are per process.
+        with self._memory.lock:
+            return {
+                "memory_bytes": self._memory.bytes,
+                "memory_entries": len(self._memory.entries),
+                "tiers": {
+                    tier: dict(
+                        self._memory.counters.get(tier, {"hits": 0, "misses": 0})
+                    )
+                    for tier in ["memory", *self._tier_aliases]
+                },
+            }
@@ -0,0 +1,111 @@
+import struct
+
+import numpy as np
+
+# Deltas between two packed 1bpp frames of the same size (see app/dithering.py for the bitmap layout),
+# so that an e-ink device which still shows the previous frame only needs the changed part of the next one.
+# Two delta encodings, the smaller of which is sent:
+#   "region": The rectangle around all changed pixels, as the header <x, y, width, height> (little-endian uint16,
+#             in pixels, x and width are multiples of 8), followed by the rows of the new frame within the rectangle,
+#             packed like the full frame. The device can redraw just that rectangle with a partial refresh.
+#   "xor-rle": The bytes in which the two frames differ, XORed with the previous frame, as runs.
+#              The header is the number of runs n (little-endian uint32), followed by n uint32 byte offsets
+#              into the frame, n uint32 run lengths, and the XOR bytes of all runs, concatenated.
+#              The device XORs every run into its frame buffer at its offset.
+# All operations work on whole numpy arrays, there are no per-pixel or per-run Python loops.
+# Deltas only pay off with dithering that keeps changes local, like "ordered" or "threshold". Floyd-Steinberg
+# diffuses the error of every changed pixel into the pixels after it, so a small change alters most of the frame.
+# See benchmarks/bench_deltas.py.
+
+REGION_HEADER = struct.Struct("<HHHH")
+RUN_COUNT = struct.Struct("<I")
+# Changed bytes separated by fewer unchanged bytes than the 8 bytes of a run header are merged into one run.
+RUN_MERGE_GAP = 8
+
+
+def get_row_bytes(width: int) -> int:
+    return (width + 7) // 8
+
+
+def to_rows(frame: bytes, width: int, height: int) -> np.ndarray:
+    return np.frombuffer(frame, dtype=np.uint8).reshape(height, get_row_bytes(width))
+
+
+def encode_region(previous: np.ndarray, frame: np.ndarray) -> bytes:
+    changed = previous != frame
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not len(rows):
+        return REGION_HEADER.pack(0, 0, 0, 0)
+    columns = np.flatnonzero(changed.any(axis=0))
+    top, bottom = rows[0], rows[-1] + 1
+    left, right = columns[0], columns[-1] + 1
+    return (
+        REGION_HEADER.pack(left * 8, top, (right - left) * 8, bottom - top)
+        + frame[top:bottom, left:right].tobytes()
+    )
+
+
+def encode_xor_runs(previous: np.ndarray, frame: np.ndarray) -> bytes:
+    xor = np.bitwise_xor(previous, frame).ravel()
+    changed = np.flatnonzero(xor)
+    if not len(changed):
+        return RUN_COUNT.pack(0)
+    breaks = np.flatnonzero(np.diff(changed) > RUN_MERGE_GAP)
+    starts = changed[np.concatenate(([0], breaks + 1))]
+    ends = changed[np.concatenate((breaks, [len(changed) - 1]))] + 1
+    # Marks the bytes inside runs: +1 where a run starts, -1 where it ends.
+    boundaries = np.zeros(len(xor) + 1, dtype=np.int32)
+    np.add.at(boundaries, starts, 1)
+    np.add.at(boundaries, ends, -1)
+    in_run = np.cumsum(boundaries[:-1]) > 0
+    return b"".join(
+        [
+            RUN_COUNT.pack(len(starts)),
+            starts.astype("<u4").tobytes(),
+            (ends - starts).astype("<u4").tobytes(),
+            xor[in_run].tobytes(),
+        ]
+    )
+
+
+def compute_delta(
+    previous: bytes, frame: bytes, width: int, height: int
+) -> tuple[str, bytes] | None:
+    # Returns (delta encoding, delta), or None if no delta is smaller than the frame itself.
+    previous_rows = to_rows(previous, width, height)
+    rows = to_rows(frame, width, height)
+    deltas = [
+        ("region", encode_region(previous_rows, rows)),
+        ("xor-rle", encode_xor_runs(previous_rows, rows)),
+    ]
+    encoding, delta = min(deltas, key=lambda item: len(item[1]))
+    if len(delta) >= len(frame):
+        return None
+    return encoding, delta
+
+
+def apply_delta(
+    previous: bytes, encoding: str, delta: bytes, width: int, height: int
+) -> bytes:
+    # What a device does with a delta, returns the new frame.
+    rows = to_rows(previous, width, height).copy()
+    if encoding == "region":
+        x, y, region_width, region_height = REGION_HEADER.unpack_from(delta)
+        region = np.frombuffer(delta, dtype=np.uint8, offset=REGION_HEADER.size)
+        rows[y : y + region_height, x // 8 : (x + region_width) // 8] = region.reshape(
+            region_height, region_width // 8
+        )
+    elif encoding == "xor-rle":
+        (count,) = RUN_COUNT.unpack_from(delta)
+        offset = RUN_COUNT.size
+        starts = np.frombuffer(delta, dtype="<u4", count=count, offset=offset)
+        lengths = np.frombuffer(
+            delta, dtype="<u4", count=count, offset=offset + 4 * count
+        ).astype(np.int64)
+        xor = np.frombuffer(delta, dtype=np.uint8, offset=offset + 8 * count)
+        # The frame offset of every XOR byte: its run's start, plus its position within the run.
+        run_offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        rows.ravel()[run_offsets + np.arange(len(xor))] ^= xor
+    else:
+        raise ValueError(f"Invalid delta encoding {encoding}")
+    return rows.tobytes()
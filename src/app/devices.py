@@ -0,0 +1,37 @@
+from .metrics import invalid_device_types
+
+# Resolutions of the supported device types, in landscape orientation (width, height).
+# See the "Device types" section of HowToBuildAnApp.md.
+DEVICE_RESOLUTIONS = {
+    "BLACK_AND_WHITE_SCREEN_960X640": (960, 640),
+    "BLACK_AND_WHITE_SCREEN_800X480": (800, 480),
+}
+
+
+def get_render_size(device_type: str, is_vertically_oriented: bool) -> tuple[int, int]:
+    try:
+        width, height = DEVICE_RESOLUTIONS[device_type]
+    except KeyError:
+        invalid_device_types.inc()
+        raise ValueError(f"Invalid device type{device_type}")
+    if is_vertically_oriented:
+        return height, width
+    return width, height
+
+
+def get_all_render_sizes() -> list[tuple[int, int]]:
+    # Every (width, height) that GetRender may ask for, across device types and orientations.
+    sizes = []
+    for device_type in DEVICE_RESOLUTIONS:
+        for is_vertically_oriented in (False, True):
+            size = get_render_size(device_type, is_vertically_oriented)
+            if size not in sizes:
+                sizes.append(size)
+    return sizes
+
+
+def get_master_size() -> tuple[int, int]:
+    # A square as large as the largest render dimension, so that every render size,
+    # in either orientation, is a center crop of it that only ever needs to be scaled down.
+    largest = max(max(size) for size in get_all_render_sizes())
+    return largest, largest
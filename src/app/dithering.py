@@ -0,0 +1,91 @@
+import functools
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# The black and white devices convert every image to 1 bit per pixel anyway.
+# Doing the conversion here lets us send a packed bitmap of width * height / 8 bytes instead of a JPEG.
+# In the packed bitmap, a set bit is a white pixel, the most significant bit is the leftmost pixel,
+# and every row is padded to a whole number of bytes.
+
+
+def to_grayscale(image: bytes, width: int, height: int) -> np.ndarray:
+    # Scale and center-crop to exactly (width, height), then return luminance as floats in [0, 255].
+    with Image.open(io.BytesIO(image)) as decoded:
+        grayscale = ImageOps.fit(decoded.convert("L"), (width, height))
+    return np.asarray(grayscale, dtype=np.float32)
+
+
+def threshold(grayscale: np.ndarray) -> np.ndarray:
+    return grayscale >= 128
+
+
+BAYER_8X8 = np.array(
+    [
+        [0, 32, 8, 40, 2, 34, 10, 42],
+        [48, 16, 56, 24, 50, 18, 58, 26],
+        [12, 44, 4, 36, 14, 46, 6, 38],
+        [60, 28, 52, 20, 62, 30, 54, 22],
+        [3, 35, 11, 43, 1, 33, 9, 41],
+        [51, 19, 59, 27, 49, 17, 57, 25],
+        [15, 47, 7, 39, 13, 45, 5, 37],
+        [63, 31, 55, 23, 61, 29, 53, 21],
+    ],
+    dtype=np.float32,
+)
+
+
+def ordered(grayscale: np.ndarray) -> np.ndarray:
+    height, width = grayscale.shape
+    thresholds = (BAYER_8X8 + 0.5) * (255 / 64)
+    tiled = np.tile(thresholds, (height // 8 + 1, width // 8 + 1))[:height, :width]
+    return grayscale >= tiled
+
+
+@functools.lru_cache(maxsize=8)
+def _wavefronts(height: int, width: int) -> list[np.ndarray]:
+    # Floyd-Steinberg pushes the error of pixel (y, x) to (y, x+1), (y+1, x-1), (y+1, x) and (y+1, x+1).
+    # So all pixels on the line x + 2y = t only depend on pixels with a smaller t,
+    # and each such line can be quantized in one vectorized step.
+    # Returns the flat indices of each line into a buffer padded by one column on both sides and one row at the bottom.
+    padded_width = width + 2
+    wavefronts = []
+    for t in range(width + 2 * (height - 1)):
+        ys = np.arange(max(0, (t - width + 2) // 2), min(height - 1, t // 2) + 1)
+        xs = t - 2 * ys
+        wavefronts.append(ys * padded_width + xs + 1)
+    return wavefronts
+
+
+def floyd_steinberg(grayscale: np.ndarray) -> np.ndarray:
+    height, width = grayscale.shape
+    padded_width = width + 2
+    buffer = np.zeros((height + 1, padded_width), dtype=np.float32)
+    buffer[:height, 1 : width + 1] = grayscale
+    flat = buffer.ravel()
+    for indices in _wavefronts(height, width):
+        white = flat[indices] >= 128
+        error = flat[indices] - white * np.float32(255)
+        flat[indices] = white
+        flat[indices + 1] += error * (7 / 16)
+        flat[indices + padded_width - 1] += error * (3 / 16)
+        flat[indices + padded_width] += error * (5 / 16)
+        flat[indices + padded_width + 1] += error * (1 / 16)
+    return buffer[:height, 1 : width + 1] == 1
+
+
+DITHERING_ALGORITHMS = {
+    "floyd-steinberg": floyd_steinberg,
+    "ordered": ordered,
+    "threshold": threshold,
+}
+
+
+def render_bitmap(image: bytes, width: int, height: int, algorithm: str) -> bytes:
+    try:
+        dither = DITHERING_ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError(f"Invalid dithering algorithm {algorithm}")
+    bits = dither(to_grayscale(image, width, height))
+    return np.packbits(bits, axis=1).tobytes()
@@ -0,0 +1,125 @@
+import dataclasses
+import io
+from typing import Callable
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from PIL import Image, ImageOps
+
+from .dithering import DITHERING_ALGORITHMS, to_grayscale
+
+# Encodings of a render, for trading image quality against payload size per device.
+# Without an encoding, GetRender sends the image as the image source returned it.
+# An encoding is chosen by the device (see get_render_encoding in app/views.py):
+#   1. With the image-format query parameter, e.g. `?image-format=webp`.
+#   2. With the Accept header, e.g. `Accept: image/webp`.
+#   3. By the default encoding of the device type, see settings.RENDER_DEVICE_ENCODINGS.
+# Every encoding is cached separately from the image it was encoded from, see get_encoded in app/render.py.
+# To add an encoding, add it to ENCODERS.
+
+
+@dataclasses.dataclass(frozen=True)
+class Encoder:
+    content_type: str
+    encode: Callable[
+        [bytes, int, int], bytes
+    ]  # (image, width, height) -> encoded image
+
+
+def fit_rgb(image: bytes, width: int, height: int) -> Image.Image:
+    with Image.open(io.BytesIO(image)) as decoded:
+        return ImageOps.fit(
+            ImageOps.exif_transpose(decoded).convert("RGB"), (width, height)
+        )
+
+
+def save(image: Image.Image, format: str, **options) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format=format, **options)
+    return output.getvalue()
+
+
+def encode_png_1bit(image: bytes, width: int, height: int) -> bytes:
+    # Dithered like the 1bpp bitmap, but as a PNG, which compresses the flat areas of a dithered image well.
+    dither = DITHERING_ALGORITHMS[settings.RENDER_DITHERING_ALGORITHM]
+    bits = dither(to_grayscale(image, width, height))
+    return save(Image.fromarray(bits.astype(np.uint8) * 255).convert("1"), "PNG")
+
+
+def encode_png_gray(image: bytes, width: int, height: int) -> bytes:
+    grayscale = to_grayscale(image, width, height)
+    return save(Image.fromarray(grayscale.round().astype(np.uint8)), "PNG")
+
+
+def encode_jpeg(image: bytes, width: int, height: int) -> bytes:
+    # Progressive, so devices that show the image while it downloads get a full preview early.
+    return save(
+        fit_rgb(image, width, height),
+        "JPEG",
+        quality=settings.RENDER_JPEG_QUALITY,
+        progressive=True,
+        optimize=True,
+    )
+
+
+def encode_webp(image: bytes, width: int, height: int) -> bytes:
+    return save(
+        fit_rgb(image, width, height), "WEBP", quality=settings.RENDER_WEBP_QUALITY
+    )
+
+
+ENCODERS = {
+    "png-1bit": Encoder("image/png", encode_png_1bit),
+    "png-gray": Encoder("image/png", encode_png_gray),
+    "jpeg": Encoder("image/jpeg", encode_jpeg),
+    "webp": Encoder("image/webp", encode_webp),
+}
+
+
+def encode(image: bytes, width: int, height: int, encoding: str) -> bytes:
+    try:
+        encoder = ENCODERS[encoding]
+    except KeyError:
+        raise ValueError(f"Invalid image format {encoding}")
+    return encoder.encode(image, width, height)
+
+
+def get_device_encoding(device_type: str) -> str | None:
+    encoding = settings.RENDER_DEVICE_ENCODINGS.get(device_type)
+    if encoding is not None and encoding not in ENCODERS:
+        raise ImproperlyConfigured(
+            f"Invalid encoding {encoding} for device type {device_type}"
+        )
+    return encoding
+
+
+def get_accepted_encoding(accept: str, device_encoding: str | None) -> str | None:
+    # The encoding for the media type with the highest q-value in an Accept header,
+    # or None if that media type is not an encoded one.
+    # image/png means the device's own PNG encoding if it has one, and grayscale otherwise.
+    media_types = []
+    for index, entry in enumerate(accept.split(",")):
+        media_type, *parameters = [part.strip() for part in entry.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            media_types.append((-quality, index, media_type.lower()))
+    for _, _, media_type in sorted(media_types):
+        if media_type in ("*/*", "image/*", "application/octet-stream"):
+            # The device takes the image as it is, or in its default encoding.
+            return None
+        if media_type == "image/png":
+            if device_encoding and ENCODERS[device_encoding].content_type == media_type:
+                return device_encoding
+            return "png-gray"
+        for encoding, encoder in ENCODERS.items():
+            if encoder.content_type == media_type:
+                return encoding
+    return None
@@ -0,0 +1,69 @@
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .devices import get_all_render_sizes
+from .library import ImageLibrary
+from .upstream import get_upstream_client
+
+# Where render cache misses get their images from, chosen with settings.IMAGE_SOURCE:
+#   "upstream": The upstream image server, see app/upstream.py.
+#   "library": A local directory of images, see app/library.py.
+# A source has fetch(width, height, fallback), afetch(width, height, fallback) and stats().
+# Only remote sources are worth prefetching from and streaming from.
+
+
+class UpstreamSource:
+    is_remote = True
+
+    def fetch(self, width: int, height: int, fallback: bool = True) -> bytes:
+        return get_upstream_client().fetch(width, height, fallback)
+
+    async def afetch(self, width: int, height: int, fallback: bool = True) -> bytes:
+        return await get_upstream_client().afetch(width, height, fallback)
+
+    def stats(self) -> dict:
+        return {"source": "upstream", **get_upstream_client().stats()}
+
+
+_image_sources = {}
+_image_sources_lock = threading.Lock()
+
+
+def get_image_source() -> UpstreamSource | ImageLibrary:
+    # One source per process and configuration.
+    key = (settings.IMAGE_SOURCE, settings.IMAGE_LIBRARY_DIR)
+    source = _image_sources.get(key)
+    if source is None:
+        with _image_sources_lock:
+            source = _image_sources.get(key)
+            if source is None:
+                source = _image_sources[key] = create_image_source()
+    return source
+
+
+def create_image_source() -> UpstreamSource | ImageLibrary:
+    if settings.IMAGE_SOURCE == "upstream":
+        return UpstreamSource()
+    if settings.IMAGE_SOURCE == "library":
+        return ImageLibrary(
+            directory=settings.IMAGE_LIBRARY_DIR,
+            index_path=settings.IMAGE_LIBRARY_INDEX,
+            sizes=get_all_render_sizes(),
+            rescan_interval=settings.IMAGE_LIBRARY_RESCAN_INTERVAL,
+        )
+    raise ImproperlyConfigured(f"Invalid image source {settings.IMAGE_SOURCE}")
+
+
+def fetch_image(width: int, height: int) -> bytes:
+    return get_image_source().fetch(width, height)
+
+
+def fetch_fresh_image(width: int, height: int) -> bytes:
+    # Never falls back to the last good image, for callers that keep the images around.
+    return get_image_source().fetch(width, height, fallback=False)
+
+
+async def afetch_image(width: int, height: int) -> bytes:
+    return await get_image_source().afetch(width, height)
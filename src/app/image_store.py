@@ -0,0 +1,262 @@
+import dataclasses
+import datetime
+import hashlib
+import os
+import time
+from uuid import UUID
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils.timezone import now
+
+from .blob_files import get_blob_file_store
+from .models import ImageBlob, ImageReference
+
+# A content-addressed image store.
+# Every image is stored once in the render cache, under the SHA-256 digest of its bytes.
+# The render cache keys of the installations only hold the digest, so installations that show
+# the same image share a single copy.
+# The ImageBlob and ImageReference tables keep track of which installation keys point to which blob,
+# so that blobs which are no longer referenced can be garbage collected.
+# With settings.RENDER_BLOB_STORE = "files", the blobs are files instead, see app/blob_files.py.
+# The pointers stay in the render cache either way.
+
+
+def get_image_digest(image: bytes) -> str:
+    return hashlib.sha256(image).hexdigest()
+
+
+def get_blob_cache_key(digest: str) -> str:
+    return f"image_gallery_blob_{digest}"
+
+
+def uses_blob_files() -> bool:
+    if settings.RENDER_BLOB_STORE == "files":
+        return True
+    if settings.RENDER_BLOB_STORE == "cache":
+        return False
+    raise ImproperlyConfigured(
+        f"Invalid render blob store {settings.RENDER_BLOB_STORE}"
+    )
+
+
+def read_blob(digest: str) -> bytes | None:
+    if uses_blob_files():
+        return get_blob_file_store().read(digest)
+    return caches["render"].get(key=get_blob_cache_key(digest))
+
+
+def read_blobs(digests: list[str]) -> dict[str, bytes]:
+    if uses_blob_files():
+        blobs = {digest: get_blob_file_store().read(digest) for digest in digests}
+        return {digest: blob for digest, blob in blobs.items() if blob is not None}
+    blobs = caches["render"].get_many(
+        [get_blob_cache_key(digest) for digest in digests]
+    )
+    return {
+        digest: blobs[get_blob_cache_key(digest)]
+        for digest in digests
+        if get_blob_cache_key(digest) in blobs
+    }
+
+
+def write_blob(digest: str, image: bytes):
+    if uses_blob_files():
+        get_blob_file_store().write(digest, image)
+    else:
+        # Blobs do not expire on their own, they are deleted by collect_garbage once nothing references them.
+        caches["render"].set(key=get_blob_cache_key(digest), value=image, timeout=None)
+
+
+def delete_blob(digest: str):
+    if uses_blob_files():
+        get_blob_file_store().delete(digest)
+    else:
+        caches["render"].delete(key=get_blob_cache_key(digest))
+
+
+def has_blob(digest: str) -> bool:
+    if uses_blob_files():
+        return os.path.exists(get_blob_file_store().get_path(digest))
+    return caches["render"].has_key(get_blob_cache_key(digest))
+
+
+def open_blob_file(digest: str):
+    # The open file of a blob, for serving it without reading it into memory,
+    # or None if the blob is not stored as a file.
+    if not uses_blob_files():
+        return None
+    return get_blob_file_store().open(digest)
+
+
+@dataclasses.dataclass(frozen=True)
+class ImagePointer:
+    digest: str
+    expires_at: float  # Unix time
+
+    def is_stale(self) -> bool:
+        return self.expires_at <= time.time()
+
+
+@dataclasses.dataclass(frozen=True)
+class StoredImage:
+    digest: str
+    expires_at: float
+    content: bytes
+
+    def is_stale(self) -> bool:
+        return self.expires_at <= time.time()
+
+
+def load_pointer(key: str) -> ImagePointer | None:
+    pointer = caches["render"].get(key=key)
+    if pointer and pointer[1] <= time.time():
+        # The in-memory tier keeps a pointer for its stale timeout, while another worker may have refreshed it.
+        pointer = caches["render"].get_from_tiers(key=key)
+    if not pointer:
+        return None
+    digest, expires_at = pointer
+    return ImagePointer(digest=digest, expires_at=expires_at)
+
+
+def load_image(key: str) -> StoredImage | None:
+    pointer = load_pointer(key)
+    if not pointer:
+        return None
+    content = read_blob(pointer.digest)
+    if content is None:
+        return None
+    return StoredImage(
+        digest=pointer.digest, expires_at=pointer.expires_at, content=content
+    )
+
+
+def load_images(keys: list[str]) -> dict[str, StoredImage]:
+    # Like load_image for many keys, with one cache lookup for the pointers and one for the blobs.
+    pointers = caches["render"].get_many(keys)
+    for key, (_, expires_at) in list(pointers.items()):
+        if expires_at <= time.time():
+            # Like in load_pointer.
+            pointers[key] = caches["render"].get_from_tiers(key=key)
+            if pointers[key] is None:
+                del pointers[key]
+    contents = read_blobs(list({digest for digest, _ in pointers.values()}))
+    stored_images = {}
+    for key, (digest, expires_at) in pointers.items():
+        if digest in contents:
+            stored_images[key] = StoredImage(
+                digest=digest, expires_at=expires_at, content=contents[digest]
+            )
+    return stored_images
+
+
+def save_image(
+    key: str, installation_id: UUID, image: bytes, timeout: int
+) -> StoredImage:
+    digest = get_image_digest(image)
+    expires_at = time.time() + timeout
+    # After it expires, the image stays in the store for settings.RENDER_STALE_TIMEOUT seconds,
+    # so that it can be served while it is refreshed, see app/revalidation.py.
+    stale_timeout = settings.RENDER_STALE_TIMEOUT
+    with transaction.atomic():
+        # Locks the blob, so that collect_garbage cannot delete it while the reference to it is saved.
+        ImageBlob.objects.select_for_update().get_or_create(
+            digest=digest, defaults={"size": len(image)}
+        )
+        ImageReference.objects.update_or_create(
+            key=key,
+            defaults={
+                "installation_id": installation_id,
+                "blob_id": digest,
+                "expiration_time": datetime.datetime.fromtimestamp(
+                    expires_at + stale_timeout, tz=datetime.timezone.utc
+                ),
+            },
+        )
+    write_blob(digest, image)
+    # The pointer also remembers when it expires, so responses can tell clients how long the image stays current.
+    caches["render"].set(
+        key=key, value=(digest, expires_at), timeout=timeout + stale_timeout
+    )
+    return StoredImage(digest=digest, expires_at=expires_at, content=image)
+
+
+# Async variants for the async views. Saving stays synchronous, because it needs a transaction.
+
+
+async def aload_pointer(key: str) -> ImagePointer | None:
+    pointer = await caches["render"].aget(key=key)
+    if pointer and pointer[1] <= time.time():
+        # Like in load_pointer.
+        pointer = await sync_to_async(caches["render"].get_from_tiers)(key=key)
+    if not pointer:
+        return None
+    digest, expires_at = pointer
+    return ImagePointer(digest=digest, expires_at=expires_at)
+
+
+async def aload_image(key: str) -> StoredImage | None:
+    pointer = await aload_pointer(key)
+    if not pointer:
+        return None
+    if uses_blob_files():
+        # Reading a file from the local disk does not wait on the network.
+        content = get_blob_file_store().read(pointer.digest)
+    else:
+        content = await caches["render"].aget(key=get_blob_cache_key(pointer.digest))
+    if content is None:
+        return None
+    return StoredImage(
+        digest=pointer.digest, expires_at=pointer.expires_at, content=content
+    )
+
+
+asave_image = sync_to_async(save_image)
+
+
+def collect_garbage() -> tuple[int, int]:
+    # Returns the number of deleted references and blobs.
+    deleted_references, _ = ImageReference.objects.filter(
+        expiration_time__lt=now()
+    ).delete()
+    unreferenced_digests = list(
+        ImageBlob.objects.filter(references__isnull=True).values_list(
+            "digest", flat=True
+        )
+    )
+    deleted_blobs = 0
+    for digest in unreferenced_digests:
+        with transaction.atomic():
+            # A save_image since the query above may reference the blob again, so check again with the blob locked.
+            locked_blob = ImageBlob.objects.select_for_update().filter(digest=digest)
+            if (
+                not locked_blob
+                or ImageReference.objects.filter(blob_id=digest).exists()
+            ):
+                continue
+            delete_blob(digest)
+            locked_blob.delete()
+            deleted_blobs += 1
+    return deleted_references, deleted_blobs
+
+
+def get_stats() -> dict:
+    # The dedup ratio is the number of bytes the installations reference,
+    # divided by the number of bytes that are actually stored.
+    blobs = ImageBlob.objects.aggregate(count=Count("digest"), size=Sum("size"))
+    references = ImageReference.objects.aggregate(
+        count=Count("key"), size=Sum("blob__size")
+    )
+    stored_bytes = blobs["size"] or 0
+    referenced_bytes = references["size"] or 0
+    return {
+        "blobs": blobs["count"],
+        "references": references["count"],
+        "stored_bytes": stored_bytes,
+        "referenced_bytes": referenced_bytes,
+        "dedup_ratio": referenced_bytes / stored_bytes if stored_bytes else None,
+    }
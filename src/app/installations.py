@@ -0,0 +1,119 @@
+import dataclasses
+from uuid import UUID
+
+from django.core.cache import caches
+
+from .metrics import installation_settings_lookups
+from .models import AppInstallation
+
+# The settings of an installation are read on every render, but only change when the user saves the settings page.
+# So they are read through the installations cache, and saved settings are written through to it.
+# Installations that were never configured are cached with the default settings as well,
+# so devices that never open the settings page do not query the database either.
+# Changes made elsewhere, like in the admin, show up once the cached settings expire.
+
+
+@dataclasses.dataclass(frozen=True)
+class InstallationSettings:
+    is_vertically_oriented: bool = False
+
+    @staticmethod
+    def from_installation(
+        installation: AppInstallation | None,
+    ) -> "InstallationSettings":
+        if installation is None:
+            return InstallationSettings()
+        return InstallationSettings(
+            is_vertically_oriented=installation.is_vertically_oriented
+        )
+
+
+def get_installation_cache_key(installation_id: UUID) -> str:
+    return f"installation_settings_{installation_id}"
+
+
+def get_installation_settings(installation_id: UUID) -> InstallationSettings:
+    key = get_installation_cache_key(installation_id)
+    installation_settings = caches["installations"].get(key)
+    installation_settings_lookups.inc(
+        "miss" if installation_settings is None else "hit"
+    )
+    if installation_settings is None:
+        installation = AppInstallation.objects.filter(
+            installation_id=installation_id
+        ).first()
+        installation_settings = InstallationSettings.from_installation(installation)
+        caches["installations"].set(key, installation_settings)
+    return installation_settings
+
+
+async def aget_installation_settings(installation_id: UUID) -> InstallationSettings:
+    key = get_installation_cache_key(installation_id)
+    installation_settings = await caches["installations"].aget(key)
+    installation_settings_lookups.inc(
+        "miss" if installation_settings is None else "hit"
+    )
+    if installation_settings is None:
+        installation = await AppInstallation.objects.filter(
+            installation_id=installation_id
+        ).afirst()
+        installation_settings = InstallationSettings.from_installation(installation)
+        await caches["installations"].aset(key, installation_settings)
+    return installation_settings
+
+
+def get_many_installation_settings(
+    installation_ids: list[UUID],
+) -> dict[UUID, InstallationSettings]:
+    # Like get_installation_settings for many installations, with at most one query for the uncached ones.
+    keys = {
+        get_installation_cache_key(installation_id): installation_id
+        for installation_id in installation_ids
+    }
+    cached = caches["installations"].get_many(list(keys))
+    found = {
+        keys[key]: installation_settings
+        for key, installation_settings in cached.items()
+    }
+    missing = [
+        installation_id
+        for installation_id in keys.values()
+        if installation_id not in found
+    ]
+    if missing:
+        installations = {
+            installation.installation_id: installation
+            for installation in AppInstallation.objects.filter(
+                installation_id__in=missing
+            )
+        }
+        fetched = {
+            installation_id: InstallationSettings.from_installation(
+                installations.get(installation_id)
+            )
+            for installation_id in missing
+        }
+        caches["installations"].set_many(
+            {
+                get_installation_cache_key(installation_id): installation_settings
+                for installation_id, installation_settings in fetched.items()
+            }
+        )
+        found.update(fetched)
+    return found
+
+
+def save_installation_settings(
+    installation_id: UUID, installation_settings: InstallationSettings
+):
+    # One INSERT ... ON CONFLICT DO UPDATE query, whether or not the installation was saved before.
+    fields = dataclasses.asdict(installation_settings)
+    AppInstallation.objects.bulk_create(
+        [AppInstallation(installation_id=installation_id, **fields)],
+        update_conflicts=True,
+        unique_fields=["installation_id"],
+        update_fields=list(fields),
+    )
+    caches["installations"].set(
+        get_installation_cache_key(installation_id), installation_settings
+    )
@@ -0,0 +1,248 @@
+import dataclasses
+import functools
+import hashlib
+import json
+import logging
+import mmap
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from PIL import Image
+from rest_framework.exceptions import APIException
+
+from .variants import EXIF_ORIENTATION, fit_image, is_exact_jpeg
+
+logger = logging.getLogger(__name__)
+
+# An image source that serves images from a local directory, instead of the upstream image server.
+#
+# The directory is scanned into an index of the dimensions and digests of its images. The index is kept
+# in a JSON file, so after a restart, only files that were added or changed since need to be opened.
+# The directory is scanned again when its modification time changes, which it does when files are
+# added or removed, and at least every `rescan_interval` seconds.
+# For every render size, the images whose aspect ratio fits are bucketed up front,
+# so picking an image is a random choice from a list.
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+
+class NoImageAvailable(APIException):
+    status_code = 503
+    default_detail = "No image is available for this device."
+    default_code = "no_image_available"
+
+
+@dataclasses.dataclass(frozen=True)
+class LibraryImage:
+    name: str  # The file name in the library directory
+    size: int
+    mtime_ns: int
+    width: int  # After applying the EXIF orientation
+    height: int
+    digest: str
+
+    @property
+    def aspect_ratio(self) -> float:
+        return self.width / self.height
+
+
+def read_image_info(path: str) -> tuple[int, int, str]:
+    # Returns the width, height and SHA-256 digest of an image file. Only the image header is decoded.
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        digest = hashlib.sha256(mapped).hexdigest()
+        with Image.open(mapped) as image:
+            width, height = image.size
+            if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                width, height = height, width
+    return width, height, digest
+
+
+@functools.lru_cache(maxsize=64)
+def render_library_image(path: str, mtime_ns: int, width: int, height: int) -> bytes:
+    # Returns the image as a JPEG of exactly (width, height), like the upstream server does.
+    # mtime_ns is only part of the cache key, so that a changed file is rendered again.
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        with Image.open(mapped) as image:
+            if is_exact_jpeg(image, width, height):
+                return mapped[:]
+            return fit_image(image, width, height)
+
+
+class ImageLibrary:
+    is_remote = False
+
+    def __init__(
+        self,
+        directory: str,
+        index_path: str,
+        sizes: list[tuple[int, int]],
+        rescan_interval: float = 60,
+        max_aspect_ratio_difference: float = 1.25,
+    ):
+        self.directory = directory
+        self.index_path = index_path
+        self.sizes = sizes
+        self.rescan_interval = rescan_interval
+        # An image fits a size if the larger of their aspect ratios is at most this much larger than the smaller one.
+        self.max_aspect_ratio_difference = max_aspect_ratio_difference
+        self._images = {}  # name -> LibraryImage
+        self._unreadable_files = (
+            {}
+        )  # name -> [size, mtime_ns], so they are not read again until they change
+        self._buckets = {}  # (width, height) -> [LibraryImage]
+        self._directory_mtime_ns = None
+        self._scanned_at = None
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        self._images = {
+            image["name"]: LibraryImage(**image) for image in index.get("images", [])
+        }
+        self._unreadable_files = index.get("unreadable_files", {})
+
+    def _save_index(self):
+        # Write and rename, so that other processes never read a partially written index.
+        temporary_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(
+                {
+                    "images": [
+                        dataclasses.asdict(image) for image in self._images.values()
+                    ],
+                    "unreadable_files": self._unreadable_files,
+                },
+                file,
+            )
+        os.replace(temporary_path, self.index_path)
+
+    def scan(self) -> tuple[int, int]:
+        # Returns the number of added or changed images, and the number of removed images.
+        with self._lock:
+            images = {}
+            unreadable_files = {}
+            changed = 0
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    extension = os.path.splitext(entry.name)[1].lower()
+                    if extension not in IMAGE_EXTENSIONS or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    if self._unreadable_files.get(entry.name) == [
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    ]:
+                        unreadable_files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+                        continue
+                    image = self._images.get(entry.name)
+                    if (
+                        image is None
+                        or image.size != stat.st_size
+                        or image.mtime_ns != stat.st_mtime_ns
+                    ):
+                        try:
+                            width, height, digest = read_image_info(entry.path)
+                        except (OSError, ValueError):
+                            logger.warning(
+                                "Skipping %s, it is not an image", entry.path
+                            )
+                            unreadable_files[entry.name] = [
+                                stat.st_size,
+                                stat.st_mtime_ns,
+                            ]
+                            changed += 1
+                            continue
+                        image = LibraryImage(
+                            name=entry.name,
+                            size=stat.st_size,
+                            mtime_ns=stat.st_mtime_ns,
+                            width=width,
+                            height=height,
+                            digest=digest,
+                        )
+                        changed += 1
+                    images[entry.name] = image
+
+            removed = len(self._images.keys() - images.keys()) + len(
+                self._unreadable_files.keys() - unreadable_files.keys()
+            )
+            self._images = images
+            self._unreadable_files = unreadable_files
+            self._buckets = {}
+            for size in self.sizes:
+                self._buckets[size] = self._get_fitting_images(*size)
+            if changed or removed:
+                self._save_index()
+            self._directory_mtime_ns = os.stat(self.directory).st_mtime_ns
+            self._scanned_at = time.monotonic()
+            return changed, removed
+
+    def _get_fitting_images(self, width: int, height: int) -> list[LibraryImage]:
+        # Copies of the same image are only picked as often as any other image.
+        distinct_images = {
+            image.digest: image
+            for image in sorted(self._images.values(), key=lambda image: image.name)
+        }.values()
+        aspect_ratio = width / height
+        fitting_images = [
+            image
+            for image in distinct_images
+            if max(image.aspect_ratio, aspect_ratio)
+            / min(image.aspect_ratio, aspect_ratio)
+            <= self.max_aspect_ratio_difference
+        ]
+        # Without a fitting image, any image is cropped to fit.
+        return fitting_images or list(distinct_images)
+
+    def _scan_if_changed(self):
+        if (
+            self._scanned_at is None
+            or time.monotonic() - self._scanned_at > self.rescan_interval
+            or os.stat(self.directory).st_mtime_ns != self._directory_mtime_ns
+        ):
+            self.scan()
+
+    def pick(self, width: int, height: int) -> LibraryImage:
+        self._scan_if_changed()
+        images = self._buckets.get((width, height))
+        if images is None:
+            images = self._buckets[(width, height)] = self._get_fitting_images(
+                width, height
+            )
+        if not images:
+            raise NoImageAvailable()
+        return random.choice(images)
+
+    def fetch(self, width: int, height: int, fallback: bool = True) -> bytes:
+        image = self.pick(width, height)
+        return render_library_image(
+            os.path.join(self.directory, image.name), image.mtime_ns, width, height
+        )
+
+    async def afetch(self, width: int, height: int, fallback: bool = True) -> bytes:
+        return await sync_to_async(self.fetch, thread_sensitive=False)(
+            width, height, fallback
+        )
+
+    def stats(self) -> dict:
+        return {
+            "source": "library",
+            "images": len(self._images),
+            "distinct_images": len({image.digest for image in self._images.values()}),
+            "buckets": {
+                f"{width}x{height}": len(images)
+                for (width, height), images in self._buckets.items()
+            },
+        }
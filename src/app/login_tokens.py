@@ -0,0 +1,130 @@
+import datetime
+import hashlib
+import secrets
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils.timezone import now
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import OneTimeToken
+
+# One-time login tokens, which the mobile app passes to the settings page instead of the device JWT,
+# see GetLoginToken in app/views.py. Chosen with settings.LOGIN_TOKEN_STORE:
+#   "database": The OneTimeToken table.
+#   "cache": The login_tokens cache, without any database queries.
+# Only the SHA-256 digest of a token is stored, so a leaked table or cache does not contain usable tokens.
+# An installation has at most one token, creating a new one replaces the previous one.
+
+LOGIN_TOKEN_LIFETIME = datetime.timedelta(minutes=10)
+
+
+def get_token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_token() -> str:
+    return secrets.token_urlsafe(50)[:50]
+
+
+class DatabaseLoginTokenStore:
+    def create(self, installation_id: UUID) -> str:
+        token = create_token()
+        # One INSERT ... ON CONFLICT DO UPDATE query, replacing the previous token of the installation.
+        OneTimeToken.objects.bulk_create(
+            [
+                OneTimeToken(
+                    installation_id=installation_id,
+                    token_digest=get_token_digest(token),
+                    expiration_time=now() + LOGIN_TOKEN_LIFETIME,
+                )
+            ],
+            update_conflicts=True,
+            unique_fields=["installation_id"],
+            update_fields=["token_digest", "expiration_time"],
+        )
+        return token
+
+    def consume(self, token: str) -> UUID:
+        # Deletes and returns the token in one query, so a token can only ever be used once,
+        # even when two requests race for it. DELETE ... RETURNING needs PostgreSQL or SQLite 3.35+.
+        digest = get_token_digest(token)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {OneTimeToken._meta.db_table}"
+                " WHERE token_digest = %s AND expiration_time >= %s"
+                " RETURNING installation_id",
+                [digest, connection.ops.adapt_datetimefield_value(now())],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            # Only failed logins need a second query, which also deletes the token if it expired.
+            deleted, _ = OneTimeToken.objects.filter(token_digest=digest).delete()
+            raise AuthenticationFailed(
+                "Token expired" if deleted else "Token does not exist"
+            )
+        return OneTimeToken._meta.get_field("installation_id").to_python(row[0])
+
+    def prune(self) -> int:
+        deleted, _ = OneTimeToken.objects.filter(expiration_time__lt=now()).delete()
+        return deleted
+
+
+class CacheLoginTokenStore:
+    # The cache expires tokens by itself, so there is nothing to prune.
+    # It must be shared by all workers, like the login_tokens file cache in settings.py.
+
+    def __init__(self, cache_alias: str):
+        self.cache_alias = cache_alias
+
+    @staticmethod
+    def get_token_cache_key(digest: str) -> str:
+        return f"login_token_{digest}"
+
+    @staticmethod
+    def get_installation_cache_key(installation_id: UUID) -> str:
+        return f"login_token_installation_{installation_id}"
+
+    def create(self, installation_id: UUID) -> str:
+        cache = caches[self.cache_alias]
+        token = create_token()
+        digest = get_token_digest(token)
+        timeout = LOGIN_TOKEN_LIFETIME.total_seconds()
+        installation_key = self.get_installation_cache_key(installation_id)
+        previous_digest = cache.get(installation_key)
+        if previous_digest:
+            cache.delete(self.get_token_cache_key(previous_digest))
+        cache.set_many(
+            {
+                self.get_token_cache_key(digest): installation_id,
+                installation_key: digest,
+            },
+            timeout=timeout,
+        )
+        return token
+
+    def consume(self, token: str) -> UUID:
+        cache = caches[self.cache_alias]
+        key = self.get_token_cache_key(get_token_digest(token))
+        installation_id = cache.get(key)
+        # delete() only succeeds once, so of two requests racing for a token, only one gets to use it.
+        if installation_id is None or not cache.delete(key):
+            raise AuthenticationFailed("Token does not exist")
+        cache.delete(self.get_installation_cache_key(installation_id))
+        return installation_id
+
+    def prune(self) -> int:
+        return 0
+
+
+def get_login_token_store() -> DatabaseLoginTokenStore | CacheLoginTokenStore:
+    if settings.LOGIN_TOKEN_STORE == "database":
+        return DatabaseLoginTokenStore()
+    if settings.LOGIN_TOKEN_STORE == "cache":
+        return CacheLoginTokenStore(settings.LOGIN_TOKEN_CACHE)
+    raise ImproperlyConfigured(
+        f"Invalid login token store {settings.LOGIN_TOKEN_STORE}"
+    )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.image_store import collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired image references and the images that are no longer referenced."
+    )
+
+    def handle(self, *args, **options):
+        deleted_references, deleted_blobs = collect_garbage()
+        self.stdout.write(
+            f"Deleted {deleted_references} expired references and {deleted_blobs} unreferenced images."
+        )
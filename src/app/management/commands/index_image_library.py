@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.devices import get_all_render_sizes
+from app.library import ImageLibrary
+
+
+class Command(BaseCommand):
+    help = "Indexes the images in IMAGE_LIBRARY_DIR, so that workers start with an up-to-date index."
+
+    def handle(self, *args, **options):
+        library = ImageLibrary(
+            directory=settings.IMAGE_LIBRARY_DIR,
+            index_path=settings.IMAGE_LIBRARY_INDEX,
+            sizes=get_all_render_sizes(),
+        )
+        changed, removed = library.scan()
+        self.stdout.write(
+            f"Indexed {changed} new or changed images and removed {removed} images,"
+            f" {library.stats()['images']} images in total."
+        )
@@ -0,0 +1,120 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.cache import caches
+from django.core.cache.backends.db import BaseDatabaseCache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, router
+from django.db.migrations.executor import MigrationExecutor
+
+from app.devices import get_all_render_sizes
+from app.library import ImageLibrary
+from app.startup import StartupPhases
+
+# The file in STATIC_ROOT that remembers the static files of the last collectstatic.
+STATIC_FINGERPRINT_FILE = ".collectstatic-fingerprint"
+
+
+def has_unapplied_migrations(database: str) -> bool:
+    executor = MigrationExecutor(connections[database])
+    return bool(executor.migration_plan(executor.loader.graph.leaf_nodes()))
+
+
+def get_missing_cache_tables() -> list[str]:
+    # Like createcachetable, which creates the table of every database cache in every database it may migrate.
+    missing = []
+    for alias in settings.CACHES:
+        cache = caches[alias]
+        if not isinstance(cache, BaseDatabaseCache):
+            continue
+        for database in connections:
+            if (
+                router.allow_migrate_model(database, cache.cache_model_class)
+                and cache._table
+                not in connections[database].introspection.table_names()
+            ):
+                missing.append(f"{database}.{cache._table}")
+    return missing
+
+
+def get_static_fingerprint() -> str:
+    # Changes whenever a static file is added, removed or modified.
+    digest = hashlib.sha256()
+    for finder in get_finders():
+        for path, storage in finder.list([]):
+            stat = os.stat(storage.path(path))
+            digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def read_static_fingerprint() -> str | None:
+    try:
+        with open(os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE)) as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_static_fingerprint(fingerprint: str):
+    with open(os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE), "w") as file:
+        file.write(fingerprint)
+
+
+class Command(BaseCommand):
+    help = (
+        "Prepares a container start in one process: migrates, collects static files, creates the cache tables"
+        " and indexes the image library, skipping every step that has nothing to do. Reports the time of each step."
+    )
+
+    def handle(self, *args, **options):
+        phases = StartupPhases("prepare deploy")
+        steps = [
+            ("migrate", self.migrate),
+            ("collectstatic", self.collect_static),
+            ("createcachetable", self.create_cache_tables),
+        ]
+        if settings.IMAGE_SOURCE == "library":
+            steps.append(("index_image_library", self.index_image_library))
+        for name, step in steps:
+            with phases.phase(name):
+                outcome = step()
+            self.stdout.write(f"{name}: {outcome}")
+        self.stdout.write(phases.report())
+
+    def migrate(self) -> str:
+        databases = [
+            database for database in connections if has_unapplied_migrations(database)
+        ]
+        if not databases:
+            return "skipped, no unapplied migrations"
+        for database in databases:
+            call_command("migrate", database=database, interactive=False, verbosity=0)
+        return f"migrated {', '.join(databases)}"
+
+    def collect_static(self) -> str:
+        fingerprint = get_static_fingerprint()
+        if fingerprint == read_static_fingerprint():
+            return "skipped, static files unchanged"
+        call_command("collectstatic", interactive=False, verbosity=0)
+        write_static_fingerprint(fingerprint)
+        return "collected"
+
+    def create_cache_tables(self) -> str:
+        missing = get_missing_cache_tables()
+        if not missing:
+            return "skipped, all cache tables exist"
+        call_command("createcachetable", verbosity=0)
+        return f"created {', '.join(missing)}"
+
+    def index_image_library(self) -> str:
+        # Only images that are new or changed since the last index are read.
+        library = ImageLibrary(
+            directory=settings.IMAGE_LIBRARY_DIR,
+            index_path=settings.IMAGE_LIBRARY_INDEX,
+            sizes=get_all_render_sizes(),
+        )
+        changed, removed = library.scan()
+        return f"indexed {changed} new or changed images, removed {removed}"
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.login_tokens import get_login_token_store
+
+
+class Command(BaseCommand):
+    help = "Deletes expired one-time login tokens."
+
+    def handle(self, *args, **options):
+        deleted = get_login_token_store().prune()
+        self.stdout.write(f"Deleted {deleted} expired login tokens.")
@@ -0,0 +1,319 @@
+import bisect
+import contextlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator
+
+from django.conf import settings
+
+# Counters and histograms in the Prometheus text format, aggregated across the uWSGI workers.
+#
+# Every process adds to its own values in a memory-mapped file in settings.METRICS_DIR, so recording a value
+# is an in-memory write without locks shared between processes or system calls. The metrics endpoint
+# reads and sums the files of all processes, including the files of workers that have since been
+# recycled, so counters keep growing across worker restarts. boot.sh clears the directory on deploy.
+#
+# A file holds the number of bytes in use, followed by entries of
+#   4-byte key length, UTF-8 JSON key, padding to 8 bytes, 8-byte float value.
+# A new entry is written before the number of bytes in use is updated, so readers never see half an entry.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+INITIAL_FILE_SIZE = 64 * 1024
+
+HEADER = struct.Struct("<Q")
+KEY_LENGTH = struct.Struct("<I")
+VALUE = struct.Struct("<d")
+
+
+def get_value_offset(offset: int, key_length: int) -> int:
+    end = offset + KEY_LENGTH.size + key_length
+    return end + -end % 8
+
+
+def read_entries(buffer, used: int) -> Iterator[tuple[str, float, int]]:
+    # Yields (key, value, value offset) for the entries in the first `used` bytes of a metrics file.
+    offset = HEADER.size
+    used = min(used, len(buffer))
+    while offset + KEY_LENGTH.size <= used:
+        (key_length,) = KEY_LENGTH.unpack_from(buffer, offset)
+        value_offset = get_value_offset(offset, key_length)
+        if value_offset + VALUE.size > used:
+            break
+        key = bytes(
+            buffer[offset + KEY_LENGTH.size : offset + KEY_LENGTH.size + key_length]
+        )
+        (value,) = VALUE.unpack_from(buffer, value_offset)
+        yield key.decode(), value, value_offset
+        offset = value_offset + VALUE.size
+
+
+class MetricsFile:
+    # The values of one process.
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "a+b")
+        if os.fstat(self._file.fileno()).st_size < INITIAL_FILE_SIZE:
+            self._file.truncate(INITIAL_FILE_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        (self._used,) = HEADER.unpack_from(self._map, 0)
+        self._used = self._used or HEADER.size
+        # A restarted process with the same pid continues with the values in the file.
+        self._offsets = {
+            key: offset for key, _, offset in read_entries(self._map, self._used)
+        }
+
+    def _append(self, key: str) -> int:
+        encoded = key.encode()
+        value_offset = get_value_offset(self._used, len(encoded))
+        end = value_offset + VALUE.size
+        if end > len(self._map):
+            self._map.resize(max(end, 2 * len(self._map)))
+        KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[
+            self._used + KEY_LENGTH.size : self._used + KEY_LENGTH.size + len(encoded)
+        ] = encoded
+        VALUE.pack_into(self._map, value_offset, 0)
+        self._used = end
+        HEADER.pack_into(self._map, 0, self._used)
+        self._offsets[key] = value_offset
+        return value_offset
+
+    def add(self, increments: list[tuple[str, float]]):
+        with self._lock:
+            for key, amount in increments:
+                offset = self._offsets.get(key)
+                if offset is None:
+                    offset = self._append(key)
+                (value,) = VALUE.unpack_from(self._map, offset)
+                VALUE.pack_into(self._map, offset, value + amount)
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def get_metrics_file() -> MetricsFile | None:
+    if not settings.METRICS_ENABLED:
+        return None
+    # Keyed by pid as well, in case the app is loaded before the workers are forked.
+    key = (settings.METRICS_DIR, os.getpid())
+    metrics_file = _files.get(key)
+    if metrics_file is None:
+        with _files_lock:
+            metrics_file = _files.get(key)
+            if metrics_file is None:
+                os.makedirs(settings.METRICS_DIR, exist_ok=True)
+                metrics_file = _files[key] = MetricsFile(
+                    os.path.join(settings.METRICS_DIR, f"{os.getpid()}.metrics")
+                )
+    return metrics_file
+
+
+def collect(directory: str) -> dict[str, float]:
+    # Sums the values of all processes.
+    totals = {}
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return totals
+    for name in names:
+        if not name.endswith(".metrics"):
+            continue
+        with open(os.path.join(directory, name), "rb") as file:
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                # The process has only just created the file.
+                continue
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                (used,) = HEADER.unpack_from(buffer, 0)
+                for key, value, _ in read_entries(buffer, used):
+                    totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+registry = {}  # name -> Counter | Histogram
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{escape_label_value(value)}"' for name, value in labels.items()
+        )
+        + "}"
+    )
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._keys = {}  # label values -> key, so keys are only encoded once
+        registry[name] = self
+
+    def get_key(self, label_values: tuple) -> str:
+        key = self._keys.get(label_values)
+        if key is None:
+            key = self._keys[label_values] = json.dumps(
+                [self.name, "", list(label_values)]
+            )
+        return key
+
+    def inc(self, *label_values: str, amount: float = 1):
+        metrics_file = get_metrics_file()
+        if metrics_file:
+            metrics_file.add([(self.get_key(label_values), amount)])
+
+    def render(self, values: dict[tuple, dict]) -> list[str]:
+        return [
+            f"{self.name}{format_labels(dict(zip(self.labelnames, label_values)))} {samples['']}"
+            for label_values, samples in sorted(values.items())
+        ]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._keys = {}  # (label values, bucket) -> keys, so keys are only encoded once
+        registry[name] = self
+
+    def get_keys(self, label_values: tuple, bucket: int) -> tuple[str, str, str]:
+        keys = self._keys.get((label_values, bucket))
+        if keys is None:
+            keys = self._keys[(label_values, bucket)] = (
+                json.dumps([self.name, f"bucket_{bucket}", list(label_values)]),
+                json.dumps([self.name, "sum", list(label_values)]),
+                json.dumps([self.name, "count", list(label_values)]),
+            )
+        return keys
+
+    def observe(self, value: float, *label_values: str):
+        metrics_file = get_metrics_file()
+        if metrics_file:
+            # Buckets are counted individually, and made cumulative when they are rendered.
+            bucket_key, sum_key, count_key = self.get_keys(
+                label_values, bisect.bisect_left(self.buckets, value)
+            )
+            metrics_file.add([(bucket_key, 1), (sum_key, value), (count_key, 1)])
+
+    @contextlib.contextmanager
+    def time(self, *label_values: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self, values: dict[tuple, dict]) -> list[str]:
+        lines = []
+        for label_values, samples in sorted(values.items()):
+            labels = dict(zip(self.labelnames, label_values))
+            cumulative = 0
+            for index, upper_bound in enumerate([*self.buckets, "+Inf"]):
+                cumulative += samples.get(f"bucket_{index}", 0)
+                bucket_labels = format_labels({**labels, "le": str(upper_bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{format_labels(labels)} {samples.get('sum', 0)}"
+            )
+            lines.append(
+                f"{self.name}_count{format_labels(labels)} {samples.get('count', 0)}"
+            )
+        return lines
+
+
+def render_metrics(directory: str) -> str:
+    values = {}  # name -> label values -> sample -> value
+    for key, value in collect(directory).items():
+        name, sample, label_values = json.loads(key)
+        values.setdefault(name, {}).setdefault(tuple(label_values), {})[sample] = value
+    lines = []
+    for name, metric in registry.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        lines.extend(metric.render(values.get(name, {})))
+    return "\n".join(lines) + "\n"
+
+
+# The metrics of the app.
+
+request_duration = Histogram(
+    "image_gallery_request_duration_seconds",
+    "Time until the response of a view started, by url route.",
+    ("route",),
+)
+requests_total = Counter(
+    "image_gallery_requests_total",
+    "Responses by url route and status code.",
+    ("route", "status"),
+)
+render_cache_lookups = Counter(
+    "image_gallery_render_cache_lookups_total",
+    "Render cache lookups by kind (image, bitmap or encoded) and result (hit, stale or miss).",
+    ("kind", "result"),
+)
+render_refresh_duration = Histogram(
+    "image_gallery_render_refresh_duration_seconds",
+    "Time to refresh a stale render in the background, by outcome (ok or error).",
+    ("outcome",),
+)
+render_deltas = Counter(
+    "image_gallery_render_deltas_total",
+    "1bpp frames served as a delta, by delta encoding, or in full when no delta was smaller.",
+    ("encoding",),
+)
+installation_settings_lookups = Counter(
+    "image_gallery_installation_settings_lookups_total",
+    "Installation settings cache lookups by result (hit or miss).",
+    ("result",),
+)
+upstream_request_duration = Histogram(
+    "image_gallery_upstream_request_duration_seconds",
+    "Duration of requests to the upstream image server, by outcome (ok or error).",
+    ("outcome",),
+)
+upstream_events = Counter(
+    "image_gallery_upstream_events_total",
+    "Upstream retries, requests rejected by the open circuit breaker, and fallbacks to the last good image.",
+    ("event",),
+)
+jwt_verify_duration = Histogram(
+    "image_gallery_jwt_verify_duration_seconds",
+    "Time to verify a valid device JWT, by whether it was in the verified token cache.",
+    ("cached",),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+)
+startup_phase_duration = Histogram(
+    "image_gallery_startup_phase_duration_seconds",
+    "Duration of the phases of a container start and of the warmup of workers, by process and phase.",
+    ("process", "phase"),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+invalid_device_types = Counter(
+    "image_gallery_invalid_device_types_total",
+    "Requests for an unknown device type.",
+)
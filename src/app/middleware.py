@@ -0,0 +1,44 @@
+import time
+
+from django.db import connection
+
+from .metrics import request_duration, requests_total
+
+# Adds the number of database queries a request made as an X-Query-Count response header,
+# so that load tests against a running server can report them. Enabled with settings.REQUEST_STATS_HEADERS.
+# Only queries on the default database connection of the thread that handles the request are counted.
+# Under ASGI, that includes the queries of the async views, which run in that thread via sync_to_async.
+
+
+class RequestStatsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        response["X-Query-Count"] = str(queries)
+        return response
+
+
+class MetricsMiddleware:
+    # Counts the responses and records the latency of every view, by url route, see app/metrics.py.
+    # For streamed responses, the latency is the time until the response started.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        route = request.resolver_match.route if request.resolver_match else "unmatched"
+        request_duration.observe(time.perf_counter() - start, route)
+        requests_total.inc(route, str(response.status_code))
+        return response
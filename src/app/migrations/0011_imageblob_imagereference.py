@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0010_remove_appinstallation_device_type"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageBlob",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("size", models.PositiveIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ImageReference",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=200, primary_key=True, serialize=False),
+                ),
+                ("installation_id", models.UUIDField(db_index=True)),
+                ("expiration_time", models.DateTimeField(db_index=True)),
+                (
+                    "blob",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="references",
+                        to="app.imageblob",
+                    ),
+                ),
+            ],
+        ),
+    ]
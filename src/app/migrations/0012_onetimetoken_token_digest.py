@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+def delete_one_time_tokens(apps, schema_editor):
+    # Outstanding tokens were stored in plain text, and cannot be looked up by digest.
+    # They expire after 10 minutes anyway, so the affected users just open the settings page again.
+    apps.get_model("app", "OneTimeToken").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0011_imageblob_imagereference"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_one_time_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="onetimetoken",
+            name="token",
+        ),
+        migrations.AddField(
+            model_name="onetimetoken",
+            name="token_digest",
+            field=models.CharField(default="", max_length=64, unique=True),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name="onetimetoken",
+            name="expiration_time",
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
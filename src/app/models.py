@@ -2,12 +2,30 @@ from django.db import models
 
 
 class OneTimeToken(models.Model):
-
+    # A login token of an installation, see app/login_tokens.py.
     installation_id = models.UUIDField(unique=True)
-    expiration_time = models.DateTimeField()
-    token = models.CharField(max_length=100)
+    expiration_time = models.DateTimeField(db_index=True)
+    token_digest = models.CharField(max_length=64, unique=True)
 
 
 class AppInstallation(models.Model):
     installation_id = models.UUIDField(unique=True, primary_key=True)
     is_vertically_oriented = models.BooleanField(default=False)
+
+
+class ImageBlob(models.Model):
+    # An image in the content-addressed image store, see app/image_store.py.
+    # The image bytes themselves live in the render cache under the digest.
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ImageReference(models.Model):
+    # Points a render cache key of an installation to the image it currently shows.
+    key = models.CharField(max_length=200, primary_key=True)
+    installation_id = models.UUIDField(db_index=True)
+    blob = models.ForeignKey(
+        ImageBlob, on_delete=models.PROTECT, related_name="references"
+    )
+    expiration_time = models.DateTimeField(db_index=True)
@@ -0,0 +1,134 @@
+import collections
+import logging
+import threading
+import time
+from typing import Callable
+
+from django.conf import settings
+
+from .devices import get_all_render_sizes, get_master_size
+from .image_sources import fetch_fresh_image, get_image_source
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePool:
+    # Keeps a bounded pool of ready-to-serve images per (width, height), so that a render cache miss
+    # can be answered without waiting for the upstream image server.
+    # A background thread refills a pool as soon as it drops below the low-water mark.
+
+    def __init__(
+        self,
+        sizes: list[tuple[int, int]],
+        capacity: int,
+        low_water_mark: int,
+        fetch: Callable[[int, int], bytes] = fetch_fresh_image,
+        refill_interval: float = 60,
+    ):
+        self.capacity = capacity
+        self.low_water_mark = low_water_mark
+        self.refill_interval = refill_interval
+        self._fetch = fetch
+        self._pools = {size: collections.deque() for size in sizes}
+        self._refill_latencies = {size: collections.deque(maxlen=100) for size in sizes}
+        self._hits = 0
+        self._misses = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def take(self, width: int, height: int) -> bytes | None:
+        pool = self._pools.get((width, height))
+        if pool is None:
+            self._misses += 1
+            return None
+        try:
+            image = pool.popleft()
+        except IndexError:
+            image = None
+        if len(pool) < self.low_water_mark:
+            self._wakeup.set()
+        if image is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return image
+
+    def refill(self) -> int:
+        fetched = 0
+        for size, pool in self._pools.items():
+            while len(pool) < self.capacity and not self._stopped.is_set():
+                start = time.monotonic()
+                try:
+                    image = self._fetch(*size)
+                except Exception:
+                    logger.exception("Prefetching a %sx%s image failed", *size)
+                    break
+                self._refill_latencies[size].append(time.monotonic() - start)
+                pool.append(image)
+                fetched += 1
+        return fetched
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="image-prefetch", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self.refill():
+                logger.info("Image pool refilled: %s", self.stats()["pools"])
+            self._wakeup.wait(timeout=self.refill_interval)
+            self._wakeup.clear()
+
+    def stats(self) -> dict:
+        pools = {}
+        for size, pool in self._pools.items():
+            latencies = list(self._refill_latencies[size])
+            pools[f"{size[0]}x{size[1]}"] = {
+                "depth": len(pool),
+                "capacity": self.capacity,
+                "last_refill_latency": latencies[-1] if latencies else None,
+                "mean_refill_latency": (
+                    sum(latencies) / len(latencies) if latencies else None
+                ),
+            }
+        return {"hits": self._hits, "misses": self._misses, "pools": pools}
+
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+
+def get_image_pool() -> ImagePool | None:
+    # The pool is created and started lazily, once per process.
+    # With `lazy-apps = true`, every uWSGI worker gets its own pool and thread.
+    global _image_pool
+    if not settings.IMAGE_PREFETCH_ENABLED or not get_image_source().is_remote:
+        return None
+    if _image_pool is None:
+        with _image_pool_lock:
+            if _image_pool is None:
+                # Derived variants only ever fetch master images.
+                pool = ImagePool(
+                    sizes=(
+                        [get_master_size()]
+                        if settings.RENDER_DERIVE_VARIANTS
+                        else get_all_render_sizes()
+                    ),
+                    capacity=settings.IMAGE_PREFETCH_POOL_SIZE,
+                    low_water_mark=settings.IMAGE_PREFETCH_LOW_WATER_MARK,
+                )
+                pool.start()
+                _image_pool = pool
+    return _image_pool
@@ -0,0 +1,57 @@
+import functools
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Per-view limits on database queries, so that a change which adds queries to a hot view does not go unnoticed.
+# A view over its budget logs a warning, or raises QueryBudgetExceeded with settings.QUERY_BUDGETS_STRICT,
+# which is on in local development.
+
+# Session engines that load the session from the database, with one query.
+DATABASE_SESSION_ENGINES = (
+    "django.contrib.sessions.backends.db",
+    "django.contrib.sessions.backends.cached_db",
+)
+
+# Statements that control transactions, like the BEGIN of an atomic block on SQLite, are not counted.
+TRANSACTION_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit: int, uses_session: bool = False):
+    # Decorates a view method, like `def get(self, request)`.
+    # Views that use the session may also make the query that loads it, unless sessions are signed cookies.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            budget = limit
+            if uses_session and settings.SESSION_ENGINE in DATABASE_SESSION_ENGINES:
+                budget += 1
+            queries = []
+
+            def record_query(execute, sql, params, many, context):
+                if not sql.lstrip().upper().startswith(TRANSACTION_STATEMENTS):
+                    queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(record_query):
+                response = method(self, request, *args, **kwargs)
+            if len(queries) > budget:
+                message = (
+                    f"{type(self).__name__}.{method.__name__} made {len(queries)}"
+                    f" queries, its budget is {budget}: {queries}"
+                )
+                if settings.QUERY_BUDGETS_STRICT:
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return response
+
+        return wrapper
+
+    return decorator
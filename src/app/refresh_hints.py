@@ -0,0 +1,33 @@
+import hashlib
+import math
+import time
+from uuid import UUID
+
+from django.conf import settings
+from django.utils.http import http_date
+
+# Tells a polling device when its render will next change, so it does not poll before then.
+# The hint is the time the cached render expires, which the image pointer already knows (see app/image_store.py),
+# plus a jitter of up to settings.RENDER_REFRESH_JITTER seconds. The jitter is fixed per installation,
+# so a device gets the same hint on every poll, but devices whose renders expire at the same time
+# are spread over the jitter window instead of all missing the cache at once.
+#   X-Refresh-After: Seconds until the device should poll again, for devices without a reliable clock.
+#   X-Next-Refresh: The same time as an HTTP date.
+
+
+def get_refresh_jitter(installation_id: UUID) -> float:
+    digest = hashlib.sha256(installation_id.bytes).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 * settings.RENDER_REFRESH_JITTER
+
+
+def get_next_refresh(installation_id: UUID, expires_at: float) -> float:
+    # An image that has already expired, like the last good image served while the upstream server is down,
+    # is refreshed after the jitter alone.
+    return max(expires_at, time.time()) + get_refresh_jitter(installation_id)
+
+
+def add_refresh_hint(response, installation_id: UUID, expires_at: float):
+    next_refresh = get_next_refresh(installation_id, expires_at)
+    response["X-Refresh-After"] = max(1, math.ceil(next_refresh - time.time()))
+    response["X-Next-Refresh"] = http_date(next_refresh)
+    return response
@@ -0,0 +1,591 @@
+import concurrent.futures
+import functools
+import logging
+import time
+from typing import Callable, Iterator
+from uuid import UUID
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from .devices import get_master_size
+from .dithering import render_bitmap
+from .encoders import encode
+from .image_sources import afetch_image, fetch_image, get_image_source
+from .image_store import (
+    ImagePointer,
+    StoredImage,
+    aload_image,
+    asave_image,
+    load_image,
+    load_images,
+    save_image,
+)
+from .metrics import render_cache_lookups
+from .prefetch import get_image_pool
+from .revalidation import BackgroundRefresher
+from .single_flight import SingleFlight
+from .upstream import UpstreamUnavailable, get_upstream_client
+from .variants import derive_variant
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_TIMEOUT = 30 * 60
+
+# The lease lives in the database cache, because its add() is atomic across workers.
+render_flights = SingleFlight(
+    lease_cache="default", lease_timeout=settings.RENDER_SINGLE_FLIGHT_LEASE_TIMEOUT
+)
+
+# Renders are served stale for up to settings.RENDER_STALE_TIMEOUT seconds after they expire,
+# while they are refreshed in the background. Only after that does a request wait for a new image.
+render_refresher = BackgroundRefresher(
+    render_flights, max_workers=settings.RENDER_REFRESH_CONCURRENCY
+)
+
+
+def get_render_cache_key(installation_id: UUID, width: int, height: int) -> str:
+    return f"image_gallery_cache_key_{installation_id}_{width}_{height}"
+
+
+def get_bitmap_cache_key(
+    installation_id: UUID, width: int, height: int, algorithm: str
+) -> str:
+    return f"{get_render_cache_key(installation_id, width, height)}_1bpp_{algorithm}"
+
+
+def get_last_frame_cache_key(bitmap_cache_key: str) -> str:
+    return f"{bitmap_cache_key}_last_frame"
+
+
+def get_encoded_cache_key(
+    installation_id: UUID, width: int, height: int, encoding: str
+) -> str:
+    return f"{get_render_cache_key(installation_id, width, height)}_{encoding}"
+
+
+def get_master_cache_key(installation_id: UUID) -> str:
+    return f"image_gallery_master_{installation_id}"
+
+
+def get_variant_timeout(master: StoredImage) -> int:
+    # Variants expire with their master, so that all sizes of an installation show the same image.
+    return max(1, int(master.expires_at - time.time()))
+
+
+def check_current_image(
+    cache_key: str,
+    stored_image: StoredImage | None,
+    kind: str | None,
+    refresh: Callable[[], StoredImage],
+    allow_stale: bool,
+) -> StoredImage | None:
+    # Returns a fresh image, or with allow_stale, a stale image, which is then refreshed in the background.
+    # Renders that are computed from another render, like bitmaps, never allow stale images,
+    # so they are not computed from an outdated image. Counts hits of `kind`, the caller counts misses.
+    if stored_image is None:
+        return None
+    if not stored_image.is_stale():
+        if kind:
+            render_cache_lookups.inc(kind, "hit")
+        return stored_image
+    if not allow_stale:
+        return None
+    if kind:
+        render_cache_lookups.inc(kind, "stale")
+    render_refresher.refresh(
+        cache_key, load=lambda: load_fresh_image(cache_key), compute=refresh
+    )
+    return stored_image
+
+
+def load_fresh_image(cache_key: str) -> StoredImage | None:
+    stored_image = load_image(cache_key)
+    return stored_image if stored_image and not stored_image.is_stale() else None
+
+
+def compute_master_image(installation_id: UUID) -> StoredImage:
+    image_pool = get_image_pool()
+    image = image_pool.take(*get_master_size()) if image_pool else None
+    if image is None:
+        image = fetch_image(*get_master_size())
+    return save_image(
+        get_master_cache_key(installation_id),
+        installation_id,
+        image,
+        timeout=RENDER_CACHE_TIMEOUT,
+    )
+
+
+def get_master_image(installation_id: UUID, allow_stale: bool = True) -> StoredImage:
+    cache_key = get_master_cache_key(installation_id)
+    compute = functools.partial(compute_master_image, installation_id)
+    stored_image = check_current_image(
+        cache_key, load_image(cache_key), None, compute, allow_stale
+    )
+    if stored_image:
+        return stored_image
+    return render_flights.run(
+        cache_key, load=lambda: load_fresh_image(cache_key), compute=compute
+    )
+
+
+def compute_image(installation_id: UUID, width: int, height: int) -> StoredImage:
+    cache_key = get_render_cache_key(installation_id, width, height)
+    if settings.RENDER_DERIVE_VARIANTS:
+        # Every size is derived from the master image of the installation.
+        master = get_master_image(installation_id, allow_stale=False)
+        image = derive_variant(master, width, height)
+        return save_image(
+            cache_key, installation_id, image, timeout=get_variant_timeout(master)
+        )
+
+    # Take a prefetched image if one is ready, so the request does not wait for the upstream server.
+    image_pool = get_image_pool()
+    image = image_pool.take(width, height) if image_pool else None
+    if image is None:
+        image = fetch_image(width, height)
+    return save_image(cache_key, installation_id, image, timeout=RENDER_CACHE_TIMEOUT)
+
+
+def get_image(
+    installation_id: UUID, width: int, height: int, allow_stale: bool = True
+) -> StoredImage:
+    cache_key = get_render_cache_key(installation_id, width, height)
+    compute = functools.partial(compute_image, installation_id, width, height)
+    stored_image = check_current_image(
+        cache_key, load_image(cache_key), "image", compute, allow_stale
+    )
+    if stored_image:
+        return stored_image
+    render_cache_lookups.inc("image", "miss")
+
+    # When many devices miss the same key at once, only one of them fetches the image.
+    return render_flights.run(
+        cache_key, load=lambda: load_fresh_image(cache_key), compute=compute
+    )
+
+
+class RenderStream:
+    # Streams an upstream response to the client as it arrives, and tees it into a bounded buffer.
+    # Once the whole image has arrived, `on_complete` is called with it. It is called with None instead
+    # if the download fails, the client disconnects, or the image is larger than `max_buffered_bytes`.
+
+    def __init__(
+        self,
+        response: requests.Response,
+        on_complete: Callable[[bytes | None], None],
+        max_buffered_bytes: int,
+        chunk_size: int = 16 * 1024,
+    ):
+        self.response = response
+        self.on_complete = on_complete
+        self.max_buffered_bytes = max_buffered_bytes
+        self.chunk_size = chunk_size
+        self.is_closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        chunks = []
+        size = 0
+        image = None
+        try:
+            for chunk in self.response.iter_content(self.chunk_size):
+                size += len(chunk)
+                if chunks is not None:
+                    if size > self.max_buffered_bytes:
+                        chunks = None
+                    else:
+                        chunks.append(chunk)
+                yield chunk
+            if chunks is not None:
+                image = b"".join(chunks)
+        finally:
+            self.close(image)
+
+    def close(self, image: bytes | None = None):
+        # StreamingHttpResponse calls this when the response is closed, even if it was never iterated.
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self.response.close()
+        self.on_complete(image)
+
+
+def get_image_or_stream(
+    installation_id: UUID, width: int, height: int
+) -> StoredImage | RenderStream:
+    # Like get_image, but a miss that has to wait on the upstream server is streamed to the client
+    # instead of being buffered first. The streamed image is cached once it has fully arrived.
+    # Derived variants are never streamed, they need the whole master image first.
+    if not get_image_source().is_remote or settings.RENDER_DERIVE_VARIANTS:
+        return get_image(installation_id, width, height)
+    cache_key = get_render_cache_key(installation_id, width, height)
+    stored_image = check_current_image(
+        cache_key,
+        load_image(cache_key),
+        "image",
+        functools.partial(compute_image, installation_id, width, height),
+        allow_stale=True,
+    )
+    if stored_image:
+        return stored_image
+
+    flight = render_flights.lead(cache_key, load=lambda: load_fresh_image(cache_key))
+    if flight is None:
+        # Another request is already fetching the image, or has just cached it.
+        return get_image(installation_id, width, height)
+
+    # Where this function returns get_image() instead, get_image counts the lookup.
+    render_cache_lookups.inc("image", "miss")
+    try:
+        image_pool = get_image_pool()
+        image = image_pool.take(width, height) if image_pool else None
+        if image is not None:
+            stored_image = save_image(
+                cache_key, installation_id, image, timeout=RENDER_CACHE_TIMEOUT
+            )
+            render_flights.land(cache_key, flight, stored_image)
+            return stored_image
+        response = get_upstream_client().open_stream(width, height)
+    except UpstreamUnavailable:
+        # get_image falls back to the last good image.
+        render_flights.land(cache_key, flight)
+        return get_image(installation_id, width, height)
+    except BaseException:
+        render_flights.land(cache_key, flight)
+        raise
+
+    def on_complete(image: bytes | None):
+        stored_image = None
+        try:
+            if image is not None:
+                get_upstream_client().record_good_image(width, height, image)
+                stored_image = save_image(
+                    cache_key, installation_id, image, timeout=RENDER_CACHE_TIMEOUT
+                )
+        finally:
+            render_flights.land(cache_key, flight, stored_image)
+
+    return RenderStream(
+        response, on_complete, max_buffered_bytes=settings.RENDER_STREAM_MAX_BYTES
+    )
+
+
+def compute_bitmap(
+    installation_id: UUID, width: int, height: int, algorithm: str
+) -> StoredImage:
+    image = get_image(installation_id, width, height, allow_stale=False)
+    bitmap = render_bitmap(image.content, width, height, algorithm)
+    # Expires with the image it was dithered from, like encodings.
+    return save_image(
+        get_bitmap_cache_key(installation_id, width, height, algorithm),
+        installation_id,
+        bitmap,
+        timeout=get_variant_timeout(image),
+    )
+
+
+def get_bitmap(
+    installation_id: UUID, width: int, height: int, algorithm: str
+) -> StoredImage:
+    # The packed 1bpp bitmap is cached separately from the image it was dithered from,
+    # so a cache hit does not need to load or decode the image at all.
+    cache_key = get_bitmap_cache_key(installation_id, width, height, algorithm)
+    compute = functools.partial(
+        compute_bitmap, installation_id, width, height, algorithm
+    )
+    stored_bitmap = check_current_image(
+        cache_key, load_image(cache_key), "bitmap", compute, allow_stale=True
+    )
+    if stored_bitmap:
+        return stored_bitmap
+    render_cache_lookups.inc("bitmap", "miss")
+
+    return render_flights.run(
+        cache_key, load=lambda: load_fresh_image(cache_key), compute=compute
+    )
+
+
+def load_last_frame(bitmap_cache_key: str) -> tuple[str, bytes] | None:
+    # The (digest, bitmap) of the last 1bpp frame served for a render cache key, see app/deltas.py.
+    # It is kept apart from the image store, because it must outlive the frame's render cache entry.
+    return caches["render"].get(get_last_frame_cache_key(bitmap_cache_key))
+
+
+def remember_last_frame(bitmap_cache_key: str, stored_bitmap: StoredImage):
+    caches["render"].set(
+        get_last_frame_cache_key(bitmap_cache_key),
+        (stored_bitmap.digest, stored_bitmap.content),
+        timeout=settings.RENDER_LAST_FRAME_TIMEOUT,
+    )
+
+
+def compute_encoded(
+    installation_id: UUID, width: int, height: int, encoding: str
+) -> StoredImage:
+    image = get_image(installation_id, width, height, allow_stale=False)
+    encoded = encode(image.content, width, height, encoding)
+    # Expires with the image it was encoded from, so all encodings show the same image.
+    return save_image(
+        get_encoded_cache_key(installation_id, width, height, encoding),
+        installation_id,
+        encoded,
+        timeout=get_variant_timeout(image),
+    )
+
+
+def get_encoded(
+    installation_id: UUID, width: int, height: int, encoding: str
+) -> StoredImage:
+    # Like get_bitmap, every encoding of an image is cached under its own key.
+    cache_key = get_encoded_cache_key(installation_id, width, height, encoding)
+    compute = functools.partial(
+        compute_encoded, installation_id, width, height, encoding
+    )
+    stored_encoded = check_current_image(
+        cache_key, load_image(cache_key), "encoded", compute, allow_stale=True
+    )
+    if stored_encoded:
+        return stored_encoded
+    render_cache_lookups.inc("encoded", "miss")
+
+    return render_flights.run(
+        cache_key, load=lambda: load_fresh_image(cache_key), compute=compute
+    )
+
+
+def get_target_cache_key(
+    installation_id: UUID,
+    width: int,
+    height: int,
+    algorithm: str | None,
+    encoding: str | None,
+) -> str:
+    if algorithm:
+        return get_bitmap_cache_key(installation_id, width, height, algorithm)
+    if encoding:
+        return get_encoded_cache_key(installation_id, width, height, encoding)
+    return get_render_cache_key(installation_id, width, height)
+
+
+def get_target_kind(target: tuple[UUID, int, int, str | None, str | None]) -> str:
+    # The kind of render, as in the render cache metrics.
+    _, _, _, algorithm, encoding = target
+    return "bitmap" if algorithm else "encoded" if encoding else "image"
+
+
+def compute_target(
+    installation_id: UUID,
+    width: int,
+    height: int,
+    algorithm: str | None,
+    encoding: str | None,
+) -> StoredImage:
+    if algorithm:
+        return compute_bitmap(installation_id, width, height, algorithm)
+    if encoding:
+        return compute_encoded(installation_id, width, height, encoding)
+    return compute_image(installation_id, width, height)
+
+
+def revalidate(
+    target: tuple[UUID, int, int, str | None, str | None], pointer: ImagePointer
+):
+    # For responses that are answered from the pointer alone, like 304 Not Modified,
+    # and so do not go through get_image and friends.
+    if pointer.is_stale():
+        cache_key = get_target_cache_key(*target)
+        render_refresher.refresh(
+            cache_key,
+            load=lambda: load_fresh_image(cache_key),
+            compute=functools.partial(compute_target, *target),
+        )
+
+
+def render_many(
+    targets: list[tuple[UUID, int, int, str | None, str | None]]
+) -> dict[str, StoredImage | Exception]:
+    # Renders (installation id, width, height, dithering algorithm or None, encoding or None) targets,
+    # keyed by render cache key.
+    # Cache hits are loaded with one cache lookup, misses are filled concurrently.
+    # A target that fails gets its exception instead of an image, so one failure does not fail the others.
+    targets_by_key = {get_target_cache_key(*target): target for target in targets}
+    results: dict[str, StoredImage | Exception] = load_images(list(targets_by_key))
+    for key, stored_image in results.items():
+        target = targets_by_key[key]
+        kind = get_target_kind(target)
+        if stored_image.is_stale():
+            render_cache_lookups.inc(kind, "stale")
+            revalidate(target, stored_image)
+        else:
+            render_cache_lookups.inc(kind, "hit")
+    misses = [key for key in targets_by_key if key not in results]
+
+    def render(key):
+        installation_id, width, height, algorithm, encoding = targets_by_key[key]
+        try:
+            if algorithm:
+                return get_bitmap(installation_id, width, height, algorithm)
+            if encoding:
+                return get_encoded(installation_id, width, height, encoding)
+            return get_image(installation_id, width, height)
+        except Exception as exception:
+            logger.exception("Rendering %s failed", key)
+            return exception
+
+    def render_in_thread(key):
+        try:
+            return render(key)
+        finally:
+            # Every thread opens its own database connections.
+            connections.close_all()
+
+    if len(misses) == 1:
+        results[misses[0]] = render(misses[0])
+    elif misses:
+        with concurrent.futures.ThreadPoolExecutor(
+            min(len(misses), settings.RENDER_BATCH_CONCURRENCY)
+        ) as executor:
+            results.update(zip(misses, executor.map(render_in_thread, misses)))
+    return results
+
+
+# Async variants for the async views, which only wait on network I/O instead of blocking a worker.
+
+
+async def aload_fresh_image(cache_key: str) -> StoredImage | None:
+    stored_image = await aload_image(cache_key)
+    return stored_image if stored_image and not stored_image.is_stale() else None
+
+
+async def aget_master_image(
+    installation_id: UUID, allow_stale: bool = True
+) -> StoredImage:
+    cache_key = get_master_cache_key(installation_id)
+    # Stale images are refreshed by the synchronous compute functions, in the refresher's threads.
+    stored_image = check_current_image(
+        cache_key,
+        await aload_image(cache_key),
+        None,
+        functools.partial(compute_master_image, installation_id),
+        allow_stale,
+    )
+    if stored_image:
+        return stored_image
+
+    async def fetch():
+        image_pool = get_image_pool()
+        image = image_pool.take(*get_master_size()) if image_pool else None
+        if image is None:
+            image = await afetch_image(*get_master_size())
+        return await asave_image(
+            cache_key, installation_id, image, timeout=RENDER_CACHE_TIMEOUT
+        )
+
+    return await render_flights.arun(
+        cache_key, load=lambda: aload_fresh_image(cache_key), compute=fetch
+    )
+
+
+async def aget_image(
+    installation_id: UUID, width: int, height: int, allow_stale: bool = True
+) -> StoredImage:
+    cache_key = get_render_cache_key(installation_id, width, height)
+    stored_image = check_current_image(
+        cache_key,
+        await aload_image(cache_key),
+        "image",
+        functools.partial(compute_image, installation_id, width, height),
+        allow_stale,
+    )
+    if stored_image:
+        return stored_image
+    render_cache_lookups.inc("image", "miss")
+
+    async def derive():
+        master = await aget_master_image(installation_id, allow_stale=False)
+        # Resizing is CPU bound, so it runs in a thread pool instead of the event loop.
+        image = await sync_to_async(derive_variant, thread_sensitive=False)(
+            master, width, height
+        )
+        return await asave_image(
+            cache_key, installation_id, image, timeout=get_variant_timeout(master)
+        )
+
+    async def fetch():
+        image_pool = get_image_pool()
+        image = image_pool.take(width, height) if image_pool else None
+        if image is None:
+            image = await afetch_image(width, height)
+        return await asave_image(
+            cache_key, installation_id, image, timeout=RENDER_CACHE_TIMEOUT
+        )
+
+    return await render_flights.arun(
+        cache_key,
+        load=lambda: aload_fresh_image(cache_key),
+        compute=derive if settings.RENDER_DERIVE_VARIANTS else fetch,
+    )
+
+
+async def aget_bitmap(
+    installation_id: UUID, width: int, height: int, algorithm: str
+) -> StoredImage:
+    cache_key = get_bitmap_cache_key(installation_id, width, height, algorithm)
+    stored_bitmap = check_current_image(
+        cache_key,
+        await aload_image(cache_key),
+        "bitmap",
+        functools.partial(compute_bitmap, installation_id, width, height, algorithm),
+        allow_stale=True,
+    )
+    if stored_bitmap:
+        return stored_bitmap
+    render_cache_lookups.inc("bitmap", "miss")
+
+    async def dither():
+        image = await aget_image(installation_id, width, height, allow_stale=False)
+        # Dithering is CPU bound, so it runs in a thread pool instead of the event loop.
+        bitmap = await sync_to_async(render_bitmap, thread_sensitive=False)(
+            image.content, width, height, algorithm
+        )
+        return await asave_image(
+            cache_key, installation_id, bitmap, timeout=get_variant_timeout(image)
+        )
+
+    return await render_flights.arun(
+        cache_key, load=lambda: aload_fresh_image(cache_key), compute=dither
+    )
+
+
+async def aget_encoded(
+    installation_id: UUID, width: int, height: int, encoding: str
+) -> StoredImage:
+    cache_key = get_encoded_cache_key(installation_id, width, height, encoding)
+    stored_encoded = check_current_image(
+        cache_key,
+        await aload_image(cache_key),
+        "encoded",
+        functools.partial(compute_encoded, installation_id, width, height, encoding),
+        allow_stale=True,
+    )
+    if stored_encoded:
+        return stored_encoded
+    render_cache_lookups.inc("encoded", "miss")
+
+    async def encode_image():
+        image = await aget_image(installation_id, width, height, allow_stale=False)
+        # Encoding is CPU bound, so it runs in a thread pool instead of the event loop.
+        encoded = await sync_to_async(encode, thread_sensitive=False)(
+            image.content, width, height, encoding
+        )
+        return await asave_image(
+            cache_key, installation_id, encoded, timeout=get_variant_timeout(image)
+        )
+
+    return await render_flights.arun(
+        cache_key, load=lambda: aload_fresh_image(cache_key), compute=encode_image
+    )
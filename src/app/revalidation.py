@@ -0,0 +1,81 @@
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from django.db import connections
+
+from .metrics import render_refresh_duration
+from .single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRefresher:
+    # Stale-while-revalidate: recomputes a cached value in a background thread, while requests keep
+    # being answered with the stale value. See get_image in app/render.py.
+    #
+    # A key is refreshed at most once at a time in this process, and, through a lead on the single flight,
+    # at most once at a time across workers. Requests that miss the key completely while it is being
+    # refreshed wait for the refresh instead of computing the value again.
+    # refresh() does no I/O itself, so it can also be called from async views.
+
+    def __init__(self, flights: SingleFlight, max_workers: int):
+        self.flights = flights
+        self.max_workers = max_workers
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._counters = {"refreshed": 0, "failed": 0, "skipped": 0}
+
+    def refresh(self, key: str, load: Callable[[], Any], compute: Callable[[], Any]):
+        # `load` returns the value if it is current again, like for SingleFlight.run().
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._submit(self._refresh, key, load, compute)
+
+    def _submit(self, function: Callable, *args):
+        with self._lock:
+            if self._executor is None:
+                # Created on first use, so every uWSGI worker gets its own threads.
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="render-refresh"
+                )
+            executor = self._executor
+        executor.submit(function, *args)
+
+    def _refresh(self, key: str, load: Callable[[], Any], compute: Callable[[], Any]):
+        try:
+            flight = self.flights.lead(key, load=load)
+            if flight is None:
+                # Another worker is already refreshing the key, or has refreshed it since.
+                self._count("skipped")
+                return
+            start = time.perf_counter()
+            result = None
+            try:
+                result = compute()
+                self._count("refreshed")
+                render_refresh_duration.observe(time.perf_counter() - start, "ok")
+            except Exception:
+                logger.exception("Refreshing %s failed", key)
+                self._count("failed")
+                render_refresh_duration.observe(time.perf_counter() - start, "error")
+            finally:
+                self.flights.land(key, flight, result)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+            # Every thread opens its own database connections.
+            connections.close_all()
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "pending": len(self._pending)}
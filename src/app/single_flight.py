@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+from django.core.cache import caches
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight:
+    # Makes concurrent cache misses for the same key wait for one computation, instead of each computing it.
+    #
+    # Within a process, the first request for a key computes the value and the others wait for its result.
+    # Across processes, the computing request holds a lease in a shared cache. Requests in other workers
+    # that find the lease taken poll for the value to appear, until the lease is released or times out.
+    # The lease cache must have an atomic add(), like the database cache.
+    #
+    # `load` must return the cached value or None, and `compute` must compute and cache the value.
+
+    def __init__(
+        self, lease_cache: str, lease_timeout: float, poll_interval: float = 0.05
+    ):
+        self.lease_cache = lease_cache
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "computed": 0,
+            "coalesced": 0,
+            "coalesced_across_workers": 0,
+        }
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    @staticmethod
+    def _get_lease_key(key: str) -> str:
+        return f"single_flight_lease_{key}"
+
+    def run(self, key: str, load: Callable[[], Any], compute: Callable[[], Any]):
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = Flight()
+        if not is_leader:
+            self._count("coalesced")
+            if not flight.done.wait(self.lease_timeout):
+                # The leader is stuck, like a lead that never lands. Like for an expired lease, compute the value.
+                result = load()
+                if result is not None:
+                    return result
+                self._count("computed")
+                return compute()
+            if flight.exception:
+                raise flight.exception
+            if flight.result is None:
+                # The leader gave up without a value, see land().
+                return self.run(key, load, compute)
+            return flight.result
+
+        try:
+            flight.result = self._run_with_lease(key, load, compute)
+            return flight.result
+        except Exception as exception:
+            flight.exception = exception
+            raise
+        finally:
+            self._finish(key, flight)
+
+    def _run_with_lease(self, key, load, compute):
+        lease_cache = caches[self.lease_cache]
+        lease_key = self._get_lease_key(key)
+        if not lease_cache.add(lease_key, True, timeout=self.lease_timeout):
+            deadline = time.monotonic() + self.lease_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                is_leased = lease_cache.has_key(lease_key)
+                result = load()
+                if result is not None:
+                    self._count("coalesced_across_workers")
+                    return result
+                if not is_leased:
+                    # The other worker gave up without caching a value.
+                    break
+            self._count("computed")
+            return compute()
+
+        try:
+            # The worker that held the lease before may have cached the value since this request missed it.
+            result = load()
+            if result is not None:
+                self._count("coalesced_across_workers")
+                return result
+            self._count("computed")
+            return compute()
+        finally:
+            lease_cache.delete(lease_key)
+
+    def lead(self, key: str, load: Callable[[], Any]) -> Flight | None:
+        # For computations that outlive the call, like a streamed response.
+        # Returns a flight if the caller is the only one computing the value, and None if another request
+        # is computing it, or `load` finds it cached already.
+        # The caller must then call land() with the value, even if computing it fails.
+        with self._lock:
+            if key in self._flights:
+                return None
+            flight = self._flights[key] = Flight()
+        lease_cache = caches[self.lease_cache]
+        lease_key = self._get_lease_key(key)
+        is_leased = False
+        try:
+            is_leased = lease_cache.add(lease_key, True, timeout=self.lease_timeout)
+            if not is_leased:
+                self._finish(key, flight)
+                return None
+            result = load()
+        except Exception as exception:
+            # Requests waiting on the flight get the exception, instead of waiting for a landing that never comes.
+            flight.exception = exception
+            self._finish(key, flight)
+            if is_leased:
+                lease_cache.delete(lease_key)
+            raise
+        if result is not None:
+            self._count("coalesced_across_workers")
+            self.land(key, flight, result)
+            return None
+        self._count("computed")
+        return flight
+
+    def land(self, key: str, flight: Flight, result=None):
+        # Requests waiting on a flight that lands without a value compute the value themselves.
+        caches[self.lease_cache].delete(self._get_lease_key(key))
+        flight.result = result
+        self._finish(key, flight)
+
+    def _finish(self, key: str, flight: Flight):
+        with self._lock:
+            del self._flights[key]
+        flight.done.set()
+
+    async def arun(
+        self,
+        key: str,
+        load: Callable[[], Awaitable[Any]],
+        compute: Callable[[], Awaitable[Any]],
+    ):
+        # The async variant, for requests that share an event loop.
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            self._count("coalesced")
+            return await asyncio.shield(flight)
+
+        flight = self._async_flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._arun_with_lease(key, load, compute)
+            flight.set_result(result)
+            return result
+        except Exception as exception:
+            flight.set_exception(exception)
+            # Waiters re-raise the exception. Mark it as retrieved, in case there are none.
+            flight.exception()
+            raise
+        finally:
+            del self._async_flights[key]
+
+    async def _arun_with_lease(self, key, load, compute):
+        lease_cache = caches[self.lease_cache]
+        lease_key = self._get_lease_key(key)
+        if not await lease_cache.aadd(lease_key, True, timeout=self.lease_timeout):
+            deadline = time.monotonic() + self.lease_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                is_leased = await lease_cache.ahas_key(lease_key)
+                result = await load()
+                if result is not None:
+                    self._count("coalesced_across_workers")
+                    return result
+                if not is_leased:
+                    break
+            self._count("computed")
+            return await compute()
+
+        try:
+            result = await load()
+            if result is not None:
+                self._count("coalesced_across_workers")
+                return result
+            self._count("computed")
+            return await compute()
+        finally:
+            await lease_cache.adelete(lease_key)
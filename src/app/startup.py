@@ -0,0 +1,127 @@
+import contextlib
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from django.utils.timezone import now
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Startup of a container and of its workers, timed phase by phase.
+#
+# boot.sh runs the prepare_deploy command once per container start, which skips the steps that have nothing to do.
+# Every worker then runs warm_up from image_gallery/wsgi.py (or asgi.py) before it accepts requests,
+# with settings.WARMUP_ENABLED. With `lazy-apps = true` in uwsgi.ini, each worker loads the app by itself,
+# so without warming up, the first requests of every worker would pay for the imports, the JWT key,
+# the settings page template, the database connection and an empty in-memory render cache.
+#
+# The duration of every phase is logged and recorded in the startup_phase_duration metric.
+
+
+class StartupPhases:
+    def __init__(self, process: str):
+        self.process = process
+        self.durations = []  # (phase, seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.durations.append((name, duration))
+            metrics.startup_phase_duration.observe(duration, self.process, name)
+
+    def report(self) -> str:
+        total = sum(duration for _, duration in self.durations)
+        phases = ", ".join(
+            f"{name} {duration:.3f}s" for name, duration in self.durations
+        )
+        return f"{self.process} took {total:.3f}s: {phases}"
+
+
+# The app modules are imported within the phases, so that their import time counts towards them.
+
+
+def load_app():
+    # Imports the views and everything they use, and builds the url resolver.
+    get_resolver().url_patterns
+    get_resolver().reverse_dict
+
+
+def parse_jwt_key():
+    from .views import get_jwt_public_key
+
+    if "JWT_PUBLIC_KEY" in os.environ:
+        get_jwt_public_key()
+
+
+def compile_templates():
+    # Renders the settings page for every orientation, which also fills its cache in app/views.py.
+    from .installations import InstallationSettings
+    from .views import render_settings_page
+
+    for is_vertically_oriented in (False, True):
+        render_settings_page(
+            InstallationSettings(is_vertically_oriented=is_vertically_oriented)
+        )
+
+
+def connect_databases():
+    # Async views connect from the threads of sync_to_async, a connection opened here would go unused.
+    if settings.ASYNC_VIEWS:
+        return
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def prime_render_cache():
+    # Loads the renders that expire last, so they are most likely to be requested soon, into the in-memory tier
+    # of the render cache. Blob files are read once, to bring them into the page cache.
+    from .image_store import load_images
+    from .models import ImageReference
+
+    keys = list(
+        ImageReference.objects.filter(expiration_time__gt=now())
+        .order_by("-expiration_time")
+        .values_list("key", flat=True)[: settings.WARMUP_RENDER_KEYS]
+    )
+    load_images(keys)
+
+
+def start_image_pool():
+    from .prefetch import get_image_pool
+
+    get_image_pool()
+
+
+WARMUP_PHASES = [
+    ("app", load_app),
+    ("jwt_key", parse_jwt_key),
+    ("templates", compile_templates),
+    ("databases", connect_databases),
+    ("render_cache", prime_render_cache),
+    ("image_pool", start_image_pool),
+]
+
+
+def warm_up() -> StartupPhases:
+    phases = StartupPhases("worker warmup")
+    for name, warm in WARMUP_PHASES:
+        with phases.phase(name):
+            try:
+                warm()
+            except Exception:
+                # The worker can still serve requests, they only start cold.
+                logger.exception("Warmup phase %s failed", name)
+    if settings.ASYNC_VIEWS:
+        # Priming the render cache connected from the main thread, which async views never use.
+        connections.close_all()
+    logger.info(phases.report())
+    return phases
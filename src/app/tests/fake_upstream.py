@@ -0,0 +1,59 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+TEST_IMAGE_PATH = Path(__file__).parent / "assets" / "800.jpg"
+
+
+class FakeUpstreamServer:
+    # A local stand-in for picsum.photos. It answers every GET with the bundled test image.
+    # Use it as a context manager and point settings.IMAGE_UPSTREAM_URL at `url`.
+
+    def __init__(self, image: bytes | None = None, delay: float = 0, status: int = 200):
+        self.image = image if image is not None else TEST_IMAGE_PATH.read_bytes()
+        self.delay = delay
+        self.status = status
+        self.requested_paths = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self) -> int:
+        return len(self.requested_paths)
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requested_paths.append(self.path)
+                if fake.delay:
+                    time.sleep(fake.delay)
+                try:
+                    self.send_response(fake.status)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(fake.image)))
+                    self.end_headers()
+                    self.wfile.write(fake.image)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up, e.g. after a read timeout.
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,23 @@
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+
+from app.tests.temporary_storage import use_temporary_storage
+
+
+class RenderTestMixin:
+    # For tests that render images: starts with an empty render cache in temporary storage and without
+    # prefetched images, and authenticates every request to the device endpoints as self.installation_id.
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_storage(self)
+        caches["render"].clear()
+        self.installation_id = uuid.uuid4()
+        patcher = mock.patch("app.render.get_image_pool", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("app.views.authenticate_jwt")
+        patcher.start().return_value.installation_id = self.installation_id
+        self.addCleanup(patcher.stop)
@@ -0,0 +1,45 @@
+import time
+import uuid
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# Signs device JWTs with a throwaway RSA key, the way the Invisible Computers backend does.
+
+DEVELOPER_ID = "test-developer-id"
+
+_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+PUBLIC_KEY_PEM = (
+    _private_key.public_key()
+    .public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    .decode()
+)
+
+# Like the JWT_PUBLIC_KEY environment variable, with escaped newlines.
+ENVIRONMENT = {
+    "JWT_PUBLIC_KEY": PUBLIC_KEY_PEM.replace("\n", "\\n"),
+    "MY_DEVELOPER_ID": DEVELOPER_ID,
+}
+
+
+def sign_jwt(
+    installation_id: uuid.UUID | None = None,
+    developer_id: str = DEVELOPER_ID,
+    expires_in: float = 3600,
+) -> str:
+    return jwt.encode(
+        {
+            "user_id": str(uuid.uuid4()),
+            "device_id": str(uuid.uuid4()),
+            "installation_id": str(installation_id or uuid.uuid4()),
+            "developer_id": developer_id,
+            "exp": int(time.time() + expires_in),
+        },
+        _private_key,
+        algorithm="RS256",
+    )
@@ -0,0 +1,26 @@
+import copy
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+# The file caches, the blob files and the metrics default to directories in /tmp, which a development server
+# on the same machine uses too. Tests that write or clear them use a temporary directory of their own instead.
+FILE_CACHES = ["render_shared", "installations", "login_tokens"]
+
+
+def use_temporary_storage(test_case: SimpleTestCase):
+    # Call in setUp, before clearing any cache.
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    caches_setting = copy.deepcopy(settings.CACHES)
+    for alias in FILE_CACHES:
+        caches_setting[alias]["LOCATION"] = os.path.join(directory.name, alias)
+    settings_override = override_settings(
+        CACHES=caches_setting,
+        RENDER_BLOB_DIR=os.path.join(directory.name, "blobs"),
+        METRICS_DIR=os.path.join(directory.name, "metrics"),
+    )
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
@@ -0,0 +1,126 @@
+import json
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.http import FileResponse
+from django.test import AsyncRequestFactory, TestCase, override_settings
+
+from app.async_views import AsyncGetLoginToken, AsyncGetRender
+from app.image_store import get_image_digest
+from app.login_tokens import get_token_digest
+from app.models import OneTimeToken
+from app.tests.fake_upstream import FakeUpstreamServer
+from app.tests.signed_jwt import ENVIRONMENT, sign_jwt
+from app.tests.temporary_storage import use_temporary_storage
+from app.views import get_jwt_public_key
+
+
+@override_settings(IMAGE_PREFETCH_ENABLED=False)
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["render"].clear()
+        patcher = mock.patch.dict("os.environ", ENVIRONMENT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_jwt_public_key.cache_clear()
+
+    async def test_async_render_fetches_once_and_then_serves_from_cache(self):
+        token = sign_jwt()
+        request_factory = AsyncRequestFactory()
+        view = AsyncGetRender.as_view()
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            response = await view(
+                request_factory.get(path, headers={"authorization": token})
+            )
+            assert response.status_code == 200
+            assert response.content == upstream.image
+
+            response = await view(
+                request_factory.get(path, headers={"authorization": token})
+            )
+            assert response.getvalue() == upstream.image
+            etag = response["ETag"]
+
+            response = await view(
+                request_factory.get(
+                    path, headers={"authorization": token, "if-none-match": etag}
+                )
+            )
+            assert response.status_code == 304
+
+        assert upstream.requested_paths == ["/800/480/"]
+
+    async def test_async_render_rejects_missing_token(self):
+        response = await AsyncGetRender.as_view()(
+            AsyncRequestFactory().get(
+                "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+            )
+        )
+        assert response.status_code == 401
+
+    async def test_async_render_serves_hits_from_blob_files(self):
+        request = AsyncRequestFactory().get(
+            "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480",
+            headers={"authorization": sign_jwt()},
+        )
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            await AsyncGetRender.as_view()(request)
+            response = await AsyncGetRender.as_view()(request)
+        assert isinstance(response, FileResponse)
+        assert response.getvalue() == upstream.image
+
+    async def test_async_render_answers_with_the_blob_url(self):
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+        for blob_store in ["files", "cache"]:
+            request = AsyncRequestFactory().get(
+                path + "&response-mode=redirect",
+                headers={"authorization": sign_jwt(installation_id=uuid.uuid4())},
+            )
+            with FakeUpstreamServer() as upstream, override_settings(
+                IMAGE_UPSTREAM_URL=upstream.url, RENDER_BLOB_STORE=blob_store
+            ):
+                rendered = await AsyncGetRender.as_view()(request)
+                cached = await AsyncGetRender.as_view()(request)
+            digest = get_image_digest(upstream.image)
+            assert rendered.status_code == cached.status_code == 302
+            assert (
+                cached["Location"] == f"http://testserver/app/render/blob/{digest}.bin"
+            )
+            assert upstream.requested_paths == ["/800/480/"]
+
+    async def test_async_render_answers_upstream_errors_with_their_status(self):
+        request_factory = AsyncRequestFactory()
+        with FakeUpstreamServer(status=404) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            response = await AsyncGetRender.as_view()(
+                request_factory.get(
+                    "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480",
+                    headers={"authorization": sign_jwt()},
+                )
+            )
+        assert response.status_code == 503
+        assert json.loads(response.content)["detail"] == (
+            "The image server is unavailable, try again later."
+        )
+
+    async def test_async_login_token(self):
+        installation_id = uuid.uuid4()
+        response = await AsyncGetLoginToken.as_view()(
+            AsyncRequestFactory().get(
+                "/app/get-login-token/",
+                headers={"authorization": sign_jwt(installation_id=installation_id)},
+            )
+        )
+        assert response.status_code == 200
+        token = await OneTimeToken.objects.aget(installation_id=installation_id)
+        login_token = json.loads(response.content)["login_token"]
+        assert token.token_digest == get_token_digest(login_token)
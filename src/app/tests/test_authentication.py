@@ -0,0 +1,76 @@
+import time
+import uuid
+from unittest import mock
+
+import jwt
+from django.test import RequestFactory, TestCase
+from rest_framework.exceptions import AuthenticationFailed
+
+from app.tests.signed_jwt import ENVIRONMENT, sign_jwt
+from app.tests.temporary_storage import use_temporary_storage
+from app.token_cache import VerifiedTokenCache
+from app.views import authenticate_jwt, get_jwt_public_key, verified_tokens
+
+
+class AuthenticateJWTTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        patcher = mock.patch.dict("os.environ", ENVIRONMENT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_jwt_public_key.cache_clear()
+        verified_tokens.clear()
+
+    def request(self, token):
+        return RequestFactory().get("/app/render/", HTTP_AUTHORIZATION=token)
+
+    def test_repeated_token_is_verified_only_once(self):
+        installation_id = uuid.uuid4()
+        token = sign_jwt(installation_id=installation_id)
+
+        with mock.patch("app.views.jwt.decode", wraps=jwt.decode) as decode:
+            assert (
+                authenticate_jwt(self.request(token)).installation_id == installation_id
+            )
+            assert (
+                authenticate_jwt(self.request(token)).installation_id == installation_id
+            )
+            assert (
+                authenticate_jwt(self.request(sign_jwt())).installation_id
+                != installation_id
+            )
+
+        assert decode.call_count == 2
+        assert get_jwt_public_key.cache_info().misses == 1
+        assert len(verified_tokens) == 2
+
+    def test_rejected_tokens_are_not_cached(self):
+        with self.assertRaises(AuthenticationFailed):
+            authenticate_jwt(self.request(sign_jwt(developer_id="someone-else")))
+        with self.assertRaises(AuthenticationFailed):
+            authenticate_jwt(self.request(sign_jwt(expires_in=-10)))
+        assert len(verified_tokens) == 0
+
+    def test_cached_token_expires_with_its_exp_claim(self):
+        token = sign_jwt(expires_in=1)
+        authenticate_jwt(self.request(token))
+        time.sleep(1.1)
+        with self.assertRaises(AuthenticationFailed):
+            authenticate_jwt(self.request(token))
+
+
+class VerifiedTokenCacheTest(TestCase):
+    def test_cache_is_bounded_and_honors_max_age(self):
+        cache = VerifiedTokenCache(maxsize=2, max_age=60)
+        cache.set(b"a", "a")
+        cache.set(b"b", "b")
+        cache.get(b"a")
+        cache.set(b"c", "c")
+        assert cache.get(b"b") is None
+        assert cache.get(b"a") == "a"
+
+        cache.set(b"expired", "expired", exp=time.time() - 1)
+        assert cache.get(b"expired") is None
+        cache = VerifiedTokenCache(maxsize=2, max_age=0)
+        cache.set(b"a", "a", exp=time.time() + 60)
+        assert cache.get(b"a") is None
@@ -0,0 +1,163 @@
+import email
+import email.policy
+import json
+import time
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from app.image_store import StoredImage, save_image
+from app.models import AppInstallation
+from app.render import get_render_cache_key
+from app.tests.signed_jwt import ENVIRONMENT, sign_jwt
+from app.tests.temporary_storage import use_temporary_storage
+from app.views import get_jwt_public_key
+
+PATH = "/app/render/batch/"
+
+
+def parse_parts(response) -> list:
+    message = email.message_from_bytes(
+        f"Content-Type: {response['Content-Type']}\r\n\r\n".encode() + response.content,
+        policy=email.policy.HTTP,
+    )
+    return [(part, part.get_payload(decode=True)) for part in message.iter_parts()]
+
+
+class BatchRenderTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["render"].clear()
+        caches["installations"].clear()
+        patcher = mock.patch.dict("os.environ", ENVIRONMENT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_jwt_public_key.cache_clear()
+
+    def post(self, token, targets):
+        return self.client.post(
+            PATH,
+            {"targets": targets},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=token,
+        )
+
+    def test_renders_cached_targets_of_several_installations(self):
+        installation_id = uuid.uuid4()
+        other_installation_id = uuid.uuid4()
+        AppInstallation.objects.create(
+            installation_id=other_installation_id, is_vertically_oriented=True
+        )
+        for key, image in [
+            (get_render_cache_key(installation_id, 800, 480), b"horizontal"),
+            (get_render_cache_key(installation_id, 480, 800), b"vertical"),
+            (get_render_cache_key(other_installation_id, 480, 800), b"other"),
+        ]:
+            save_image(key, installation_id, image, timeout=60)
+
+        device_type = "BLACK_AND_WHITE_SCREEN_800X480"
+        with self.assertNumQueries(1):
+            response = self.post(
+                sign_jwt(installation_id),
+                [
+                    {"device_type": device_type},
+                    {"device_type": device_type, "orientation": "vertical"},
+                    {
+                        "device_type": device_type,
+                        "token": sign_jwt(other_installation_id),
+                    },
+                ],
+            )
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("multipart/mixed; boundary=")
+        parts = parse_parts(response)
+        assert [content for _, content in parts] == [
+            b"horizontal",
+            b"vertical",
+            b"other",
+        ]
+        assert [part["X-Render-Index"] for part, _ in parts] == ["0", "1", "2"]
+        assert all(part["X-Render-Status"] == "200" for part, _ in parts)
+        assert all(part["ETag"] for part, _ in parts)
+
+    def test_invalid_targets_fail_on_their_own(self):
+        installation_id = uuid.uuid4()
+        save_image(
+            get_render_cache_key(installation_id, 800, 480),
+            installation_id,
+            b"image",
+            timeout=60,
+        )
+
+        response = self.post(
+            sign_jwt(installation_id),
+            [
+                {"device_type": "BLACK_AND_WHITE_SCREEN_800X480"},
+                {"device_type": "UNKNOWN"},
+                {"device_type": "BLACK_AND_WHITE_SCREEN_800X480", "token": "invalid"},
+                {"device_type": "BLACK_AND_WHITE_SCREEN_800X480", "orientation": "up"},
+                {"orientation": "vertical"},
+                {"device_type": ["BLACK_AND_WHITE_SCREEN_800X480"]},
+                {"device_type": "BLACK_AND_WHITE_SCREEN_800X480", "image_format": {}},
+            ],
+        )
+
+        assert response.status_code == 200
+        parts = parse_parts(response)
+        assert [part["X-Render-Status"] for part, _ in parts] == [
+            "200",
+            "400",
+            "401",
+            "400",
+            "400",
+            "400",
+            "400",
+        ]
+        assert parts[0][1] == b"image"
+        assert json.loads(parts[4][1]) == {"detail": ["Missing device_type"]}
+        assert json.loads(parts[6][1]) == {
+            "detail": ["Invalid image_format, expected a string"]
+        }
+
+    def test_batch_requires_authentication_and_a_list_of_targets(self):
+        response = self.client.post(
+            PATH, {"targets": []}, content_type="application/json"
+        )
+        assert response.status_code == 403
+
+        assert self.post(sign_jwt(), []).status_code == 400
+        assert self.post(sign_jwt(), ["target"]).status_code == 400
+        with override_settings(RENDER_BATCH_MAX_TARGETS=1):
+            response = self.post(
+                sign_jwt(),
+                [{"device_type": "BLACK_AND_WHITE_SCREEN_800X480"}] * 2,
+            )
+        assert response.status_code == 400
+
+    def test_misses_are_rendered_concurrently(self):
+        def slow_get_image(installation_id, width, height):
+            time.sleep(0.3)
+            return StoredImage(
+                digest="digest", expires_at=time.time() + 60, content=b"image"
+            )
+
+        tokens = [sign_jwt() for _ in range(4)]
+        start = time.monotonic()
+        with mock.patch("app.render.get_image", side_effect=slow_get_image):
+            response = self.post(
+                tokens[0],
+                [
+                    {"device_type": "BLACK_AND_WHITE_SCREEN_800X480", "token": token}
+                    for token in tokens
+                ],
+            )
+        duration = time.monotonic() - start
+
+        parts = parse_parts(response)
+        assert [part["X-Render-Status"] for part, _ in parts] == ["200"] * 4
+        assert all(content == b"image" for _, content in parts)
+        # Rendered one after the other, the four misses would take at least 1.2 seconds.
+        assert duration < 1.2
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import time
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from httmock import HTTMock, all_requests
+
+from app.blob_files import BlobFileStore
+from app.image_store import get_image_digest, load_image, read_blob, save_image
+from app.tests.fake_upstream import TEST_IMAGE_PATH
+from app.tests.render_test_mixin import RenderTestMixin
+from app.tests.temporary_storage import use_temporary_storage
+
+
+class BlobFileStoreTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_blobs_are_sharded_by_digest(self):
+        store = BlobFileStore(self.directory, max_bytes=1024)
+        digest = get_image_digest(b"image")
+        store.write(digest, b"image")
+
+        assert store.get_path(digest) == os.path.join(
+            self.directory, digest[:2], digest[2:4], digest
+        )
+        assert store.read(digest) == b"image"
+        assert os.listdir(os.path.dirname(store.get_path(digest))) == [digest]
+        assert store.read(get_image_digest(b"missing")) is None
+        store.delete(digest)
+        assert store.read(digest) is None
+
+    def test_least_recently_used_blobs_are_evicted(self):
+        store = BlobFileStore(self.directory, max_bytes=1000)
+        # From the oldest to the newest.
+        digests = [get_image_digest(bytes([index])) for index in range(5)]
+        for index, digest in enumerate(digests):
+            # Without the eviction that writing would already run.
+            with mock.patch.object(store, "evict"):
+                store.write(digest, b"x" * 250)
+            past = time.time() - 1000 * (len(digests) - index)
+            os.utime(store.get_path(digest), (past, past))
+        # Reading the oldest blob marks it as used.
+        assert store.read(digests[0]) == b"x" * 250
+
+        # Down to 90% of the maximum.
+        assert store.evict() == 2
+        assert store.read(digests[0]) is not None
+        assert store.read(digests[1]) is None
+        assert store.read(digests[2]) is None
+        assert store.read(digests[3]) is not None
+        assert store.read(digests[4]) is not None
+        assert store.evict() == 0
+
+    def test_writing_evicts_after_a_tenth_of_the_maximum(self):
+        store = BlobFileStore(self.directory, max_bytes=1000)
+        with mock.patch.object(store, "evict") as evict:
+            store.write(get_image_digest(b"first"), b"x" * 60)
+            evict.assert_not_called()
+            store.write(get_image_digest(b"second"), b"x" * 60)
+            evict.assert_called_once()
+
+    def test_abandoned_temporary_files_are_removed(self):
+        store = BlobFileStore(self.directory, max_bytes=1000)
+        path = os.path.join(self.directory, ".tmp-abandoned")
+        with open(path, "wb") as file:
+            file.write(b"partial")
+        past = time.time() - 2 * 60 * 60
+        os.utime(path, (past, past))
+
+        store.evict()
+        assert not os.path.exists(path)
+
+
+class BlobStoreSettingTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["render"].clear()
+
+    def test_blobs_can_be_kept_in_the_render_cache(self):
+        with override_settings(RENDER_BLOB_STORE="cache"):
+            save_image("key", uuid.uuid4(), b"cached image", timeout=60)
+            assert load_image("key").content == b"cached image"
+        assert read_blob(get_image_digest(b"cached image")) is None
+
+    @override_settings(RENDER_BLOB_STORE="invalid")
+    def test_invalid_blob_store_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            read_blob(get_image_digest(b"image"))
+
+
+@override_settings(RENDER_STREAMING_ENABLED=False)
+class FileRenderResponseTest(RenderTestMixin, TestCase):
+    def test_hit_is_served_from_the_blob_file(self):
+        image = TEST_IMAGE_PATH.read_bytes()
+
+        @all_requests
+        def upstream(url, request):
+            return {"status_code": 200, "content": image}
+
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+        with HTTMock(upstream):
+            miss = self.client.get(path)
+        assert not isinstance(miss, FileResponse)
+
+        hit = self.client.get(path)
+        assert isinstance(hit, FileResponse)
+        assert hit.getvalue() == image
+        assert hit["ETag"] == miss["ETag"]
+        assert hit["Content-Type"] == miss["Content-Type"]
+        assert hit["Cache-Control"] == miss["Cache-Control"]
+        assert hit["Content-Length"] == str(len(image))
+        assert "Content-Disposition" not in hit
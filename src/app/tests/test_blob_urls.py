@@ -0,0 +1,93 @@
+import json
+
+from django.test import TestCase, override_settings
+from httmock import HTTMock, all_requests
+
+from app.image_store import delete_blob, get_image_digest
+from app.tests.fake_upstream import TEST_IMAGE_PATH
+from app.tests.render_test_mixin import RenderTestMixin
+
+PATH = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+
+
+@override_settings(RENDER_STREAMING_ENABLED=False)
+class BlobUrlTest(RenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = TEST_IMAGE_PATH.read_bytes()
+        self.upstream_requests = 0
+
+    def render(self, path: str, **headers):
+        @all_requests
+        def upstream(url, request):
+            self.upstream_requests += 1
+            return {"status_code": 200, "content": self.image}
+
+        with HTTMock(upstream):
+            return self.client.get(path, **headers)
+
+    def test_redirect_to_the_immutable_url(self):
+        digest = get_image_digest(self.image)
+        response = self.render(PATH + "&response-mode=redirect")
+        assert response.status_code == 302
+        assert response["Location"] == f"http://testserver/app/render/blob/{digest}.bin"
+        assert response["ETag"] == f'"{digest}"'
+        assert "X-Refresh-After" in response
+
+        # Repeated polls only need the pointer.
+        assert self.render(PATH + "&response-mode=redirect").status_code == 302
+        assert self.upstream_requests == 1
+
+        # The image itself needs no authentication and can be cached forever.
+        with self.assertNumQueries(0):
+            blob = self.client.get(response["Location"])
+        assert blob.getvalue() == self.image
+        assert blob["Content-Type"] == "application/octet-stream"
+        assert blob["ETag"] == f'"{digest}"'
+        assert "immutable" in blob["Cache-Control"]
+        assert "public" in blob["Cache-Control"]
+        not_modified = self.client.get(
+            response["Location"], HTTP_IF_NONE_MATCH=f'"{digest}"'
+        )
+        assert not_modified.status_code == 304
+
+    def test_pointer_names_the_url_of_the_encoded_image(self):
+        response = self.render(PATH + "&response-mode=pointer&image-format=png-gray")
+        pointer = json.loads(response.content)
+        assert pointer["url"].endswith(f"/app/render/blob/{pointer['digest']}.png")
+        assert pointer["content_type"] == "image/png"
+        assert response["ETag"] == f'"{pointer["digest"]}"'
+
+        blob = self.client.get(pointer["url"])
+        assert blob["Content-Type"] == "image/png"
+        assert get_image_digest(blob.getvalue()) == pointer["digest"]
+
+    @override_settings(RENDER_RESPONSE_MODE="redirect")
+    def test_evicted_image_is_rendered_again(self):
+        digest = get_image_digest(self.image)
+        self.render(PATH)
+        delete_blob(digest)
+
+        response = self.render(PATH)
+        assert response.status_code == 302
+        assert self.upstream_requests == 2
+        assert self.client.get(response["Location"]).getvalue() == self.image
+
+    @override_settings(
+        RENDER_RESPONSE_MODE="redirect", RENDER_BLOB_URL="https://cdn.example.com/"
+    )
+    def test_blob_urls_can_point_to_a_cdn(self):
+        response = self.render(PATH)
+        assert (
+            response["Location"]
+            == f"https://cdn.example.com/{get_image_digest(self.image)}.bin"
+        )
+
+    def test_invalid_urls_are_not_found(self):
+        digest = get_image_digest(b"missing")
+        assert self.client.get(f"/app/render/blob/{digest}.bin").status_code == 404
+        assert self.client.get(f"/app/render/blob/{digest}.gif").status_code == 404
+        assert self.client.get("/app/render/blob/..%2Fsecret.bin").status_code == 404
+
+    def test_invalid_response_mode_is_rejected(self):
+        assert self.render(PATH + "&response-mode=inline").status_code == 400
@@ -0,0 +1,138 @@
+import time
+import uuid
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+
+def tiered_caches(**options):
+    # A tiered cache in front of two local memory caches, standing in for the file and database tiers.
+    location = str(uuid.uuid4())
+    return {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "tiered": {
+            "BACKEND": "app.cache_backends.TieredCache",
+            "LOCATION": location,
+            "OPTIONS": {"TIERS": ["shared", "fallback"], **options},
+        },
+        "shared": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"{location}-shared",
+        },
+        "fallback": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"{location}-fallback",
+        },
+    }
+
+
+class TieredCacheTest(TestCase):
+    def test_set_writes_through_and_get_promotes(self):
+        with override_settings(CACHES=tiered_caches()):
+            cache = caches["tiered"]
+            cache.set("key", b"value", timeout=60)
+            assert caches["shared"].get("key")[1] == b"value"
+            assert caches["fallback"].get("key")[1] == b"value"
+
+            assert cache.get("key") == b"value"
+            assert cache.stats()["tiers"]["memory"] == {"hits": 1, "misses": 0}
+
+            cache._memory.clear()
+            caches["shared"].clear()
+            assert cache.get("key") == b"value"
+            assert cache.stats()["tiers"] == {
+                "memory": {"hits": 1, "misses": 1},
+                "shared": {"hits": 0, "misses": 1},
+                "fallback": {"hits": 1, "misses": 0},
+            }
+            # The value was promoted into the faster tiers, with its original expiry time.
+            expires_at, value = caches["shared"].get("key")
+            assert value == b"value"
+            assert 55 < expires_at - time.time() <= 60
+            assert cache.get("key") == b"value"
+            assert cache.stats()["tiers"]["memory"]["hits"] == 2
+
+    def test_get_many_asks_each_tier_for_the_keys_it_is_missing(self):
+        with override_settings(CACHES=tiered_caches()):
+            cache = caches["tiered"]
+            cache.set("memory", b"1", timeout=60)
+            cache.set("shared", b"2", timeout=60)
+            cache.set("fallback", b"3", timeout=60)
+            cache._memory.delete(cache.make_key("shared"))
+            cache._memory.delete(cache.make_key("fallback"))
+            caches["shared"].delete("fallback")
+
+            assert cache.get_many(["memory", "shared", "fallback", "missing"]) == {
+                "memory": b"1",
+                "shared": b"2",
+                "fallback": b"3",
+            }
+            assert cache.stats()["tiers"] == {
+                "memory": {"hits": 1, "misses": 3},
+                "shared": {"hits": 1, "misses": 2},
+                "fallback": {"hits": 1, "misses": 1},
+            }
+            assert caches["shared"].get("fallback")[1] == b"3"
+            assert cache.get_many(["shared", "fallback"]) == {
+                "shared": b"2",
+                "fallback": b"3",
+            }
+            assert cache.stats()["tiers"]["memory"]["hits"] == 3
+
+    def test_memory_tier_evicts_least_recently_used_beyond_byte_budget(self):
+        with override_settings(
+            CACHES=tiered_caches(MEMORY_MAX_BYTES=250, MEMORY_MAX_ITEM_BYTES=200)
+        ):
+            cache = caches["tiered"]
+            cache.set("a", b"a" * 100)
+            cache.set("b", b"b" * 100)
+            cache.get("a")
+            cache.set("c", b"c" * 100)
+            cache.set("too-large", b"x" * 201)
+
+            assert list(cache._memory.entries) == [
+                cache.make_key("a"),
+                cache.make_key("c"),
+            ]
+            assert cache.stats()["memory_bytes"] == 200
+            # Evicted and oversized values are still served by the slower tiers.
+            assert cache.get("b") == b"b" * 100
+            assert cache.get("too-large") == b"x" * 201
+
+    def test_no_write_through_and_no_promotion(self):
+        with override_settings(
+            CACHES=tiered_caches(WRITE_THROUGH=False, PROMOTE_ON_HIT=False)
+        ):
+            cache = caches["tiered"]
+            cache.set("key", {"some": "value"})
+            assert cache.get("key") == {"some": "value"}
+            assert caches["shared"].get("key") is not None
+            assert caches["fallback"].get("key") is None
+
+            cache._memory.clear()
+            assert cache.get("key") == {"some": "value"}
+            assert cache._memory.get(cache.make_key("key")) is None
+
+    def test_get_from_tiers_skips_the_memory_tier(self):
+        with override_settings(CACHES=tiered_caches()):
+            cache = caches["tiered"]
+            cache.set("key", b"old")
+            # Another process replaces the value in the shared tier.
+            caches["shared"].set("key", (None, b"new"))
+            assert cache.get("key") == b"old"
+            assert cache.get_from_tiers("key") == b"new"
+            assert cache.get("key") == b"new"
+
+    def test_expired_and_foreign_values_are_misses(self):
+        with override_settings(CACHES=tiered_caches()):
+            cache = caches["tiered"]
+            cache.set("key", b"value", timeout=0.05)
+            time.sleep(0.1)
+            assert cache.get("key") is None
+
+            caches["fallback"].set("legacy", b"not written by the tiered cache")
+            assert cache.get("legacy") is None
+            assert cache.add("key", b"new") is True
+            assert cache.add("key", b"newer") is False
+            assert cache.delete("key") is True
+            assert cache.get("key") is None
@@ -0,0 +1,148 @@
+import io
+from unittest import mock
+
+import numpy as np
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from PIL import Image, ImageOps
+
+from app.async_views import AsyncGetRender
+from app.deltas import (
+    apply_delta,
+    compute_delta,
+    encode_region,
+    encode_xor_runs,
+    to_rows,
+)
+from app.dithering import render_bitmap
+from app.tests.fake_upstream import TEST_IMAGE_PATH, FakeUpstreamServer
+from app.tests.render_test_mixin import RenderTestMixin
+
+
+def invert_box(image: bytes, box: tuple[int, int, int, int]) -> bytes:
+    with Image.open(io.BytesIO(image)) as decoded:
+        decoded = decoded.convert("RGB")
+    decoded.paste(ImageOps.invert(decoded.crop(box)), box)
+    output = io.BytesIO()
+    decoded.save(output, format="PNG")
+    return output.getvalue()
+
+
+class DeltaTest(TestCase):
+    width, height = 800, 480
+
+    def setUp(self):
+        self.image = TEST_IMAGE_PATH.read_bytes()
+        self.previous = render_bitmap(self.image, self.width, self.height, "threshold")
+
+    def test_deltas_reproduce_the_new_frame(self):
+        frame = render_bitmap(
+            invert_box(self.image, (100, 50, 300, 120)),
+            self.width,
+            self.height,
+            "threshold",
+        )
+        previous_rows = to_rows(self.previous, self.width, self.height)
+        rows = to_rows(frame, self.width, self.height)
+        for encoding, delta in [
+            ("region", encode_region(previous_rows, rows)),
+            ("xor-rle", encode_xor_runs(previous_rows, rows)),
+        ]:
+            assert len(delta) < len(frame)
+            assert (
+                apply_delta(self.previous, encoding, delta, self.width, self.height)
+                == frame
+            )
+
+    def test_smallest_delta_is_chosen(self):
+        # A filled box is one small region.
+        frame = render_bitmap(
+            invert_box(self.image, (100, 50, 180, 90)),
+            self.width,
+            self.height,
+            "threshold",
+        )
+        encoding, _ = compute_delta(self.previous, frame, self.width, self.height)
+        assert encoding == "region"
+
+        # A few scattered pixels are a few short runs.
+        pixels = bytearray(self.previous)
+        for index in (0, len(pixels) // 2, len(pixels) - 1):
+            pixels[index] ^= 1
+        encoding, delta = compute_delta(
+            self.previous, bytes(pixels), self.width, self.height
+        )
+        assert encoding == "xor-rle"
+        assert len(delta) == 4 + 3 * 8 + 3
+
+        assert compute_delta(self.previous, self.previous, self.width, self.height)
+
+    def test_no_delta_when_it_is_not_smaller(self):
+        noise = np.random.RandomState(0).randint(0, 256, len(self.previous), np.uint8)
+        assert (
+            compute_delta(self.previous, noise.tobytes(), self.width, self.height)
+            is None
+        )
+
+
+@override_settings(RENDER_STREAMING_ENABLED=False, RENDER_DELTA_FRAMES=True)
+class DeltaRenderTest(RenderTestMixin, TestCase):
+    path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480&image-format=1bpp"
+
+    def get_frame(self, image: bytes, **params):
+        # Every request renders a new image, as if the previous render had expired.
+        with mock.patch("app.render.fetch_image", return_value=image), mock.patch(
+            "app.render.load_image", return_value=None
+        ):
+            return self.client.get(
+                self.path
+                + "".join(f"&{name}={value}" for name, value in params.items())
+            )
+
+    def test_device_with_the_last_frame_gets_a_delta(self):
+        image = TEST_IMAGE_PATH.read_bytes()
+        response = self.get_frame(image)
+        assert response["X-Image-Format"] == "1bpp"
+        previous = response.content
+        last_frame = response["ETag"].strip('"')
+
+        new_image = invert_box(image, (100, 50, 300, 120))
+        response = self.get_frame(new_image, **{"last-frame": last_frame})
+        assert response["X-Image-Format"] == "1bpp-delta"
+        assert response["X-Delta-Base"] == last_frame
+        frame = apply_delta(
+            previous, response["X-Delta-Encoding"], response.content, 800, 480
+        )
+        assert frame == render_bitmap(new_image, 800, 480, "floyd-steinberg")
+        assert response["ETag"].strip('"') != last_frame
+
+        # The last frame is now the new one, so the old one no longer gets a delta.
+        response = self.get_frame(image, **{"last-frame": last_frame})
+        assert response["X-Image-Format"] == "1bpp"
+
+    async def test_async_render_sends_deltas_too(self):
+        image = TEST_IMAGE_PATH.read_bytes()
+        new_image = invert_box(image, (100, 50, 300, 120))
+
+        async def get_frame(image: bytes, path: str):
+            with FakeUpstreamServer(image=image) as upstream, override_settings(
+                IMAGE_UPSTREAM_URL=upstream.url
+            ), mock.patch("app.render.aload_image", return_value=None), mock.patch(
+                "app.async_views.authenticate_jwt"
+            ) as mock_authenticate_jwt:
+                mock_authenticate_jwt.return_value.installation_id = (
+                    self.installation_id
+                )
+                return await AsyncGetRender.as_view()(AsyncRequestFactory().get(path))
+
+        response = await get_frame(image, self.path)
+        last_frame = response["ETag"].strip('"')
+        response = await get_frame(new_image, self.path + f"&last-frame={last_frame}")
+        assert response["X-Image-Format"] == "1bpp-delta"
+        assert response["X-Delta-Base"] == last_frame
+
+    @override_settings(RENDER_DELTA_FRAMES=False)
+    def test_delta_frames_are_optional(self):
+        image = TEST_IMAGE_PATH.read_bytes()
+        last_frame = self.get_frame(image)["ETag"].strip('"')
+        response = self.get_frame(image, **{"last-frame": last_frame})
+        assert response["X-Image-Format"] == "1bpp"
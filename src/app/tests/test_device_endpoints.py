@@ -1,42 +1,172 @@
 import uuid
 from unittest import mock
 
-from django.test import TestCase
+from django.http import FileResponse
+from django.test import TestCase, override_settings
 from httmock import HTTMock, all_requests
 
+from app.image_store import get_image_digest
+from app.refresh_hints import get_next_refresh, get_refresh_jitter
+from app.tests.fake_upstream import TEST_IMAGE_PATH, FakeUpstreamServer
+from app.tests.render_test_mixin import RenderTestMixin
 
-class RenderViewTest(TestCase):
+
+@override_settings(RENDER_STREAMING_ENABLED=False)
+class RenderViewTest(RenderTestMixin, TestCase):
     def test_render_view(self):
-        mock_user_id = uuid.uuid4()
-        uuid.uuid4()
-        mock_device_id = uuid.uuid4()
-        mock_device = mock.Mock()
+        requested_urls = []
 
         # Mock the http request to the lorem picsum API
-        test_image_path = "third_party_app_example/tests/assets/800.jpg"
-        with open(test_image_path, "rb") as file:
-            image_file = file.read()
+        image_file = TEST_IMAGE_PATH.read_bytes()
 
         @all_requests
         def response_content(url, request):
+            requested_urls.append(request.url)
             return {"status_code": 200, "content": image_file}
 
-        path = (
-            f"/image-gallery/render/"
-            f"?device-type=BLACK_AND_WHITE_SCREEN_880X528&device-id={mock_device_id}"
-        )
-        with mock.patch(
-            "third_party_app_example.views.authenticate_jwt"
-        ) as mock_authenticate_jwt:
-            mock_authenticate_jwt.return_value = (mock_user_id, mock_device)
-
-            # Query the first time, expecting an HTTP request to the lorem picsum API
-            with HTTMock(response_content):
-                response = self.client.get(path=path)
-                assert response.status_code == 200
-            # Query the second time, expecting a cache hit
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+
+        # Query the first time, expecting an HTTP request to the lorem picsum API
+        with HTTMock(response_content):
+            response = self.client.get(path=path)
+            assert response.status_code == 200
+            assert response.content == image_file
+        assert len(requested_urls) == 1
+        assert requested_urls[0].endswith("/800/480/")
+
+        # Query the second time, expecting a cache hit
+        with HTTMock(response_content):
             response = self.client.get(
                 path=path,
             )
 
-            assert response.status_code == 200
+        assert response.status_code == 200
+        assert response.getvalue() == image_file
+        assert len(requested_urls) == 1
+
+
+@override_settings(RENDER_STREAMING_ENABLED=False)
+class ConditionalRenderTest(RenderTestMixin, TestCase):
+    def test_matching_etag_is_answered_with_not_modified(self):
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+        with mock.patch("app.render.fetch_image", return_value=b"image"):
+            response = self.client.get(path)
+        assert response.status_code == 200
+        etag = response["ETag"]
+        assert etag == f'"{get_image_digest(b"image")}"'
+        assert "private" in response["Cache-Control"]
+        assert 1790 < int(response["Cache-Control"].split("max-age=")[1]) <= 1800
+        assert response["Expires"]
+
+        with mock.patch("app.views.get_image") as mock_get_image:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        mock_get_image.assert_not_called()
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response["ETag"] == etag
+        assert int(response["Cache-Control"].split("max-age=")[1]) <= 1800
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH='"outdated"')
+        assert response.status_code == 200
+        assert response.getvalue() == b"image"
+
+    @override_settings(RENDER_REFRESH_JITTER=300)
+    def test_refresh_hint_follows_the_cache_entry_with_jitter(self):
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+        jitter = get_refresh_jitter(self.installation_id)
+        with mock.patch("app.render.fetch_image", return_value=b"image"):
+            response = self.client.get(path)
+        max_age = int(response["Cache-Control"].split("max-age=")[1])
+        refresh_after = int(response["X-Refresh-After"])
+        assert max_age + jitter - 1 <= refresh_after <= max_age + jitter + 1
+        assert response["X-Next-Refresh"]
+
+        # The pointer alone answers with the same hint.
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
+        assert abs(int(response["X-Refresh-After"]) - refresh_after) <= 1
+
+    def test_bitmap_has_its_own_etag(self):
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+        with mock.patch(
+            "app.render.fetch_image", return_value=TEST_IMAGE_PATH.read_bytes()
+        ):
+            image_etag = self.client.get(path)["ETag"]
+            response = self.client.get(
+                path + "&image-format=1bpp", HTTP_IF_NONE_MATCH=image_etag
+            )
+        assert response.status_code == 200
+        assert response["ETag"] == f'"{get_image_digest(response.content)}"'
+
+        response = self.client.get(
+            path + "&image-format=1bpp", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        assert response.status_code == 304
+
+
+class StreamingRenderTest(RenderTestMixin, TestCase):
+    path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+
+    def test_miss_is_streamed_and_then_served_from_cache(self):
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            response = self.client.get(self.path)
+            assert response.streaming
+            assert response["Content-Length"] == str(len(upstream.image))
+            assert "ETag" not in response
+            assert int(response["X-Refresh-After"]) >= 1800
+            assert b"".join(response.streaming_content) == upstream.image
+
+            # Served from the blob file.
+            response = self.client.get(self.path)
+            assert isinstance(response, FileResponse)
+            assert response.getvalue() == upstream.image
+            assert response["ETag"] == f'"{get_image_digest(upstream.image)}"'
+
+        assert upstream.request_count == 1
+
+    def test_images_larger_than_the_buffer_are_not_cached(self):
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url, RENDER_STREAM_MAX_BYTES=1024
+        ):
+            for _ in range(2):
+                response = self.client.get(self.path)
+                assert b"".join(response.streaming_content) == upstream.image
+
+        assert upstream.request_count == 2
+
+    def test_abandoned_stream_is_not_cached(self):
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            response = self.client.get(self.path)
+            # The device disconnects after the first chunk.
+            next(iter(response.streaming_content))
+            response.close()
+
+            response = self.client.get(self.path)
+            assert b"".join(response.streaming_content) == upstream.image
+
+        assert upstream.request_count == 2
+
+
+class RefreshHintTest(TestCase):
+    @override_settings(RENDER_REFRESH_JITTER=300)
+    def test_jitter_is_fixed_per_installation_and_spread(self):
+        installation_ids = [uuid.uuid4() for _ in range(200)]
+        jitters = [
+            get_refresh_jitter(installation_id) for installation_id in installation_ids
+        ]
+        assert jitters == [
+            get_refresh_jitter(installation_id) for installation_id in installation_ids
+        ]
+        assert all(0 <= jitter < 300 for jitter in jitters)
+        # Renders that expire together are refreshed over the whole window.
+        assert min(jitters) < 60 and max(jitters) > 240
+
+    @override_settings(RENDER_REFRESH_JITTER=0)
+    def test_expired_image_is_refreshed_now(self):
+        with mock.patch("app.refresh_hints.time.time", return_value=1000):
+            assert get_next_refresh(uuid.uuid4(), expires_at=500) == 1000
+            assert get_next_refresh(uuid.uuid4(), expires_at=1500) == 1500
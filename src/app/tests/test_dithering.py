@@ -0,0 +1,101 @@
+import json
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+
+from app.dithering import floyd_steinberg, ordered, render_bitmap, threshold
+from app.image_store import save_image
+from app.render import compute_bitmap, get_render_cache_key
+from app.tests.fake_upstream import TEST_IMAGE_PATH
+from app.tests.render_test_mixin import RenderTestMixin
+
+
+def naive_floyd_steinberg(grayscale):
+    grayscale = grayscale.astype(np.float64)
+    height, width = grayscale.shape
+    bits = np.zeros((height, width), dtype=bool)
+    for y in range(height):
+        for x in range(width):
+            bits[y, x] = grayscale[y, x] >= 128
+            error = grayscale[y, x] - bits[y, x] * 255
+            if x + 1 < width:
+                grayscale[y, x + 1] += error * 7 / 16
+            if y + 1 < height:
+                if x > 0:
+                    grayscale[y + 1, x - 1] += error * 3 / 16
+                grayscale[y + 1, x] += error * 5 / 16
+                if x + 1 < width:
+                    grayscale[y + 1, x + 1] += error * 1 / 16
+    return bits
+
+
+class DitheringTest(TestCase):
+    def test_floyd_steinberg_matches_sequential_implementation(self):
+        grayscale = (
+            np.random.RandomState(0).randint(0, 256, (29, 41)).astype(np.float32)
+        )
+        assert np.array_equal(
+            floyd_steinberg(grayscale), naive_floyd_steinberg(grayscale)
+        )
+
+    def test_dithering_preserves_mean_brightness(self):
+        grayscale = np.full((64, 64), 64, dtype=np.float32)
+        assert not threshold(grayscale).any()
+        assert abs(ordered(grayscale).mean() - 0.25) < 0.01
+        assert abs(floyd_steinberg(grayscale).mean() - 0.25) < 0.01
+
+    def test_render_bitmap_is_packed_to_one_bit_per_pixel(self):
+        image = TEST_IMAGE_PATH.read_bytes()
+        for algorithm in ["floyd-steinberg", "ordered", "threshold"]:
+            assert len(render_bitmap(image, 800, 480, algorithm)) == 48000
+            assert len(render_bitmap(image, 640, 960, algorithm)) == 76800
+        with self.assertRaises(ValueError):
+            render_bitmap(image, 800, 480, "unknown")
+
+
+class RenderBitmapTest(RenderTestMixin, TestCase):
+    def test_render_returns_and_caches_bitmap(self):
+        image = TEST_IMAGE_PATH.read_bytes()
+        path = (
+            "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480&image-format=1bpp"
+        )
+
+        with mock.patch(
+            "app.render.fetch_image", return_value=image
+        ) as mock_fetch_image:
+            response = self.client.get(path)
+            assert response.status_code == 200
+            assert len(response.content) == 48000
+            assert response["X-Image-Width"] == "800"
+            assert response["X-Image-Height"] == "480"
+
+            response = self.client.get(path + "&dithering=threshold")
+            assert len(response.content) == 48000
+
+            # The second algorithm was dithered from the cached image,
+            # and the bitmaps themselves are now cached too.
+            with mock.patch("app.render.render_bitmap") as mock_render_bitmap:
+                response = self.client.get(path)
+            mock_render_bitmap.assert_not_called()
+            assert len(response.getvalue()) == 48000
+
+        assert mock_fetch_image.call_count == 1
+
+    def test_bitmap_expires_with_its_image(self):
+        image = save_image(
+            get_render_cache_key(self.installation_id, 800, 480),
+            self.installation_id,
+            TEST_IMAGE_PATH.read_bytes(),
+            timeout=60,
+        )
+        bitmap = compute_bitmap(self.installation_id, 800, 480, "threshold")
+        assert abs(bitmap.expires_at - image.expires_at) <= 1
+
+    def test_invalid_dithering_algorithm_is_rejected(self):
+        response = self.client.get(
+            "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+            "&image-format=1bpp&dithering=unknown"
+        )
+        assert response.status_code == 400
+        assert json.loads(response.content) == ["Invalid dithering algorithm unknown"]
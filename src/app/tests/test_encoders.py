@@ -0,0 +1,113 @@
+import io
+import json
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from app.encoders import ENCODERS, encode, get_accepted_encoding, get_device_encoding
+from app.tests.fake_upstream import TEST_IMAGE_PATH
+from app.tests.render_test_mixin import RenderTestMixin
+
+
+class EncodersTest(TestCase):
+    def test_encodings_have_the_render_size_and_content_type(self):
+        image = TEST_IMAGE_PATH.read_bytes()
+        expected_modes = {
+            "png-1bit": "1",
+            "png-gray": "L",
+            "jpeg": "RGB",
+            "webp": "RGB",
+        }
+        for encoding, encoder in ENCODERS.items():
+            with Image.open(io.BytesIO(encode(image, 480, 800, encoding))) as decoded:
+                assert decoded.size == (480, 800)
+                assert decoded.mode == expected_modes[encoding]
+                assert Image.MIME[decoded.format] == encoder.content_type
+
+    def test_jpeg_is_progressive(self):
+        encoded = encode(TEST_IMAGE_PATH.read_bytes(), 800, 480, "jpeg")
+        with Image.open(io.BytesIO(encoded)) as decoded:
+            assert decoded.info.get("progressive")
+
+    def test_accept_header_negotiation(self):
+        assert get_accepted_encoding("image/webp", None) == "webp"
+        assert get_accepted_encoding("image/jpeg;q=0.5, image/webp", None) == "webp"
+        assert get_accepted_encoding("image/webp;q=0.5, image/jpeg", None) == "jpeg"
+        assert get_accepted_encoding("image/webp;q=0, image/jpeg;q=0.1", None) == "jpeg"
+        assert get_accepted_encoding("image/png", None) == "png-gray"
+        assert get_accepted_encoding("image/png", "png-1bit") == "png-1bit"
+        assert get_accepted_encoding("*/*", None) is None
+        assert (
+            get_accepted_encoding("application/octet-stream, image/webp", None) is None
+        )
+        assert get_accepted_encoding("text/html", None) is None
+
+    @override_settings(
+        RENDER_DEVICE_ENCODINGS={"BLACK_AND_WHITE_SCREEN_800X480": "gif"}
+    )
+    def test_invalid_device_encoding_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_device_encoding("BLACK_AND_WHITE_SCREEN_800X480")
+
+
+@override_settings(RENDER_STREAMING_ENABLED=False)
+class EncodedRenderTest(RenderTestMixin, TestCase):
+    path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch(
+            "app.render.fetch_image", return_value=TEST_IMAGE_PATH.read_bytes()
+        )
+        self.mock_fetch_image = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_image_format_parameter_is_cached_per_encoding(self):
+        with mock.patch("app.render.encode", wraps=encode) as mock_encode:
+            webp = self.client.get(self.path + "&image-format=webp")
+            jpeg = self.client.get(self.path + "&image-format=jpeg")
+            assert self.client.get(self.path + "&image-format=webp").getvalue() == (
+                webp.content
+            )
+        assert mock_encode.call_count == 2
+        assert self.mock_fetch_image.call_count == 1
+        assert webp["Content-Type"] == "image/webp"
+        assert webp["X-Image-Format"] == "webp"
+        assert jpeg["Content-Type"] == "image/jpeg"
+        assert webp["ETag"] != jpeg["ETag"]
+
+        response = self.client.get(
+            self.path + "&image-format=webp", HTTP_IF_NONE_MATCH=webp["ETag"]
+        )
+        assert response.status_code == 304
+
+    def test_accept_header_chooses_the_encoding(self):
+        response = self.client.get(self.path, HTTP_ACCEPT="image/webp")
+        assert response["Content-Type"] == "image/webp"
+        assert "Accept" in response["Vary"]
+
+        response = self.client.get(self.path, HTTP_ACCEPT="*/*")
+        assert response["Content-Type"] == "application/octet-stream"
+        assert response.getvalue() == TEST_IMAGE_PATH.read_bytes()
+
+    @override_settings(
+        RENDER_DEVICE_ENCODINGS={"BLACK_AND_WHITE_SCREEN_800X480": "png-1bit"}
+    )
+    def test_device_type_default_encoding(self):
+        response = self.client.get(self.path)
+        assert response["X-Image-Format"] == "png-1bit"
+        with Image.open(io.BytesIO(response.content)) as decoded:
+            assert decoded.mode == "1"
+
+        response = self.client.get(self.path, HTTP_ACCEPT="image/png")
+        assert response["X-Image-Format"] == "png-1bit"
+
+        response = self.client.get(self.path + "&image-format=original")
+        assert response["Content-Type"] == "application/octet-stream"
+
+    def test_invalid_image_format_is_rejected(self):
+        response = self.client.get(self.path + "&image-format=gif")
+        assert response.status_code == 400
+        assert json.loads(response.content) == ["Invalid image format gif"]
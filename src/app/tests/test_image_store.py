@@ -0,0 +1,92 @@
+import datetime
+import uuid
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase
+from django.utils.timezone import now
+
+from app.image_store import (
+    collect_garbage,
+    get_image_digest,
+    get_stats,
+    load_image,
+    read_blob,
+    save_image,
+)
+from app.models import ImageBlob, ImageReference
+from app.tests.temporary_storage import use_temporary_storage
+
+
+class ImageStoreTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["render"].clear()
+
+    def test_identical_images_are_stored_once(self):
+        first_installation_id = uuid.uuid4()
+        second_installation_id = uuid.uuid4()
+        save_image("first", first_installation_id, b"image", timeout=60)
+        save_image("second", second_installation_id, b"image", timeout=60)
+        save_image("third", second_installation_id, b"other image", timeout=60)
+
+        assert load_image("first").content == b"image"
+        assert load_image("second").content == b"image"
+        assert load_image("missing") is None
+        assert load_image("first").digest == get_image_digest(b"image")
+        assert ImageBlob.objects.count() == 2
+        assert get_stats() == {
+            "blobs": 2,
+            "references": 3,
+            "stored_bytes": 16,
+            "referenced_bytes": 21,
+            "dedup_ratio": 21 / 16,
+        }
+
+    def test_saving_a_new_image_under_a_key_replaces_the_reference(self):
+        installation_id = uuid.uuid4()
+        save_image("key", installation_id, b"old image", timeout=60)
+        save_image("key", installation_id, b"new image", timeout=60)
+
+        assert load_image("key").content == b"new image"
+        assert ImageReference.objects.get(key="key").blob_id == get_image_digest(
+            b"new image"
+        )
+
+    def test_collect_garbage_deletes_unreferenced_images(self):
+        installation_id = uuid.uuid4()
+        save_image("expired", installation_id, b"expired image", timeout=60)
+        save_image("shared-expired", installation_id, b"shared image", timeout=60)
+        save_image("shared-current", installation_id, b"shared image", timeout=60)
+        ImageReference.objects.filter(key__endswith="expired").update(
+            expiration_time=now() - datetime.timedelta(seconds=1)
+        )
+
+        assert collect_garbage() == (2, 1)
+        assert list(ImageBlob.objects.values_list("digest", flat=True)) == [
+            get_image_digest(b"shared image")
+        ]
+        assert read_blob(get_image_digest(b"expired image")) is None
+        assert load_image("shared-current").content == b"shared image"
+        assert collect_garbage() == (0, 0)
+
+    def test_collect_garbage_keeps_images_saved_again_meanwhile(self):
+        installation_id = uuid.uuid4()
+        save_image("expired", installation_id, b"expired image", timeout=60)
+        ImageReference.objects.update(
+            expiration_time=now() - datetime.timedelta(seconds=1)
+        )
+        saved = []
+
+        def save_after_listing(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if "IS NULL" in sql and not saved:
+                # Another worker saves the image between the listing and the deletion.
+                saved.append(True)
+                save_image("again", installation_id, b"expired image", timeout=60)
+            return result
+
+        with connection.execute_wrapper(save_after_listing):
+            assert collect_garbage() == (1, 0)
+        assert saved
+        assert load_image("again").content == b"expired image"
@@ -0,0 +1,98 @@
+import uuid
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from app.image_store import save_image
+from app.installations import (
+    InstallationSettings,
+    get_installation_settings,
+    save_installation_settings,
+)
+from app.models import AppInstallation
+from app.render import get_render_cache_key
+from app.tests.render_test_mixin import RenderTestMixin
+from app.tests.temporary_storage import use_temporary_storage
+from app.views import generate_login_token
+
+
+class InstallationSettingsTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["installations"].clear()
+        self.installation_id = uuid.uuid4()
+
+    def test_settings_are_read_through_the_cache(self):
+        AppInstallation.objects.create(
+            installation_id=self.installation_id, is_vertically_oriented=True
+        )
+        with self.assertNumQueries(1):
+            assert get_installation_settings(
+                self.installation_id
+            ).is_vertically_oriented
+        with self.assertNumQueries(0):
+            assert get_installation_settings(
+                self.installation_id
+            ).is_vertically_oriented
+
+    def test_new_installations_are_cached_with_the_default_settings(self):
+        with self.assertNumQueries(1):
+            assert get_installation_settings(self.installation_id) == (
+                InstallationSettings()
+            )
+        with self.assertNumQueries(0):
+            assert get_installation_settings(self.installation_id) == (
+                InstallationSettings()
+            )
+        assert not AppInstallation.objects.exists()
+
+    def test_saved_settings_are_written_through(self):
+        get_installation_settings(self.installation_id)
+        save_installation_settings(
+            self.installation_id, InstallationSettings(is_vertically_oriented=True)
+        )
+
+        with self.assertNumQueries(0):
+            assert get_installation_settings(
+                self.installation_id
+            ).is_vertically_oriented
+        assert AppInstallation.objects.get(
+            installation_id=self.installation_id
+        ).is_vertically_oriented
+
+
+class RenderInstallationLookupTest(RenderTestMixin, TestCase):
+    path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+
+    def setUp(self):
+        super().setUp()
+        caches["installations"].clear()
+        for width, height in [(800, 480), (480, 800)]:
+            save_image(
+                get_render_cache_key(self.installation_id, width, height),
+                self.installation_id,
+                f"{width}x{height}".encode(),
+                timeout=60,
+            )
+
+    def test_steady_state_render_makes_no_queries(self):
+        self.client.get(self.path)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.path)
+        assert response.getvalue() == b"800x480"
+
+    def test_settings_page_updates_the_orientation_of_renders(self):
+        assert self.client.get(self.path).getvalue() == b"800x480"
+
+        token = generate_login_token(self.installation_id)
+        self.client.get(
+            f"/app/login/?login-token={token}&device-type=BLACK_AND_WHITE_SCREEN_800X480"
+        )
+        self.client.post("/app/settings/", {"orientation": "vertical"})
+        assert AppInstallation.objects.get().is_vertically_oriented
+        # Devices do not send the session cookie of the settings page.
+        self.client.cookies.clear()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.path)
+        assert response.getvalue() == b"480x800"
@@ -0,0 +1,103 @@
+import io
+import os
+import shutil
+import tempfile
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from app.library import ImageLibrary, NoImageAvailable
+from app.tests.temporary_storage import use_temporary_storage
+
+
+def write_image(directory: str, name: str, size: tuple[int, int], color="white"):
+    Image.new("RGB", size, color).save(os.path.join(directory, name))
+
+
+class ImageLibraryTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.index_path = os.path.join(self.directory, ".image_index.json")
+        write_image(self.directory, "landscape.jpg", (1200, 800))
+        write_image(self.directory, "portrait.png", (600, 1000), color="black")
+        write_image(self.directory, "square.jpg", (800, 800), color="gray")
+        # A copy of an image, and a file that is not an image
+        shutil.copy(
+            os.path.join(self.directory, "landscape.jpg"),
+            os.path.join(self.directory, "copy.jpg"),
+        )
+        with open(os.path.join(self.directory, "notes.jpg"), "w") as file:
+            file.write("not an image")
+
+    def create_library(self) -> ImageLibrary:
+        return ImageLibrary(
+            self.directory, self.index_path, sizes=[(800, 480), (480, 800)]
+        )
+
+    def test_images_are_picked_by_aspect_ratio(self):
+        library = self.create_library()
+
+        assert library.pick(800, 480).name in ("landscape.jpg", "copy.jpg")
+        assert library.pick(480, 800).name == "portrait.png"
+        # No image fits a panorama, so it gets any image.
+        assert library.pick(1000, 200).name is not None
+        stats = library.stats()
+        assert stats["images"] == 4
+        assert stats["distinct_images"] == 3
+        assert stats["buckets"]["800x480"] == 1
+
+    def test_fetch_returns_a_jpeg_of_the_requested_size(self):
+        library = self.create_library()
+
+        image = Image.open(io.BytesIO(library.fetch(480, 800)))
+        assert image.format == "JPEG"
+        assert image.size == (480, 800)
+
+    def test_index_is_persisted_and_updated_incrementally(self):
+        # The file that is not an image counts as changed, so that it is remembered in the index.
+        assert self.create_library().scan() == (5, 0)
+
+        with mock.patch("app.library.read_image_info") as read_image_info:
+            library = self.create_library()
+            assert library.scan() == (0, 0)
+        read_image_info.assert_not_called()
+
+        os.remove(os.path.join(self.directory, "portrait.png"))
+        write_image(self.directory, "tall.jpg", (500, 900))
+        # The directory changed, so picking an image scans it again.
+        assert library.pick(480, 800).name == "tall.jpg"
+        assert library.stats()["images"] == 4
+        assert self.create_library().scan() == (0, 0)
+
+    def test_empty_library_has_no_image(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+        with self.assertRaises(NoImageAvailable):
+            self.create_library().pick(800, 480)
+
+
+class RenderFromLibraryTest(TestCase):
+    def test_render_serves_an_image_from_the_library(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        write_image(directory, "image.jpg", (1600, 1000))
+        use_temporary_storage(self)
+        caches["render"].clear()
+
+        with override_settings(
+            IMAGE_SOURCE="library",
+            IMAGE_LIBRARY_DIR=directory,
+            IMAGE_LIBRARY_INDEX=os.path.join(directory, ".image_index.json"),
+        ), mock.patch("app.views.authenticate_jwt") as mock_authenticate_jwt:
+            mock_authenticate_jwt.return_value.installation_id = uuid.uuid4()
+            response = self.client.get(
+                "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+            )
+
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.content)).size == (800, 480)
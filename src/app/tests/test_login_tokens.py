@@ -0,0 +1,103 @@
+import datetime
+import uuid
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from rest_framework.exceptions import AuthenticationFailed
+
+from app.login_tokens import (
+    CacheLoginTokenStore,
+    DatabaseLoginTokenStore,
+    get_token_digest,
+)
+from app.models import OneTimeToken
+from app.tests.temporary_storage import use_temporary_storage
+from app.views import generate_login_token
+
+
+class DatabaseLoginTokenStoreTest(TestCase):
+    store = DatabaseLoginTokenStore()
+
+    def test_token_is_stored_hashed_and_used_only_once(self):
+        installation_id = uuid.uuid4()
+        with self.assertNumQueries(1):
+            token = self.store.create(installation_id)
+        assert not OneTimeToken.objects.filter(token_digest=token).exists()
+        assert OneTimeToken.objects.get().token_digest == get_token_digest(token)
+
+        with self.assertNumQueries(1):
+            assert self.store.consume(token) == installation_id
+        with self.assertRaisesMessage(AuthenticationFailed, "Token does not exist"):
+            self.store.consume(token)
+        assert not OneTimeToken.objects.exists()
+
+    def test_new_token_replaces_the_previous_one(self):
+        installation_id = uuid.uuid4()
+        previous_token = self.store.create(installation_id)
+        token = self.store.create(installation_id)
+
+        assert OneTimeToken.objects.count() == 1
+        with self.assertRaises(AuthenticationFailed):
+            self.store.consume(previous_token)
+        assert self.store.consume(token) == installation_id
+
+    def test_expired_token_is_rejected_and_deleted(self):
+        token = self.store.create(uuid.uuid4())
+        OneTimeToken.objects.update(
+            expiration_time=now() - datetime.timedelta(seconds=1)
+        )
+
+        with self.assertRaisesMessage(AuthenticationFailed, "Token expired"):
+            self.store.consume(token)
+        assert not OneTimeToken.objects.exists()
+
+    def test_prune_deletes_only_expired_tokens(self):
+        for _ in range(3):
+            self.store.create(uuid.uuid4())
+        OneTimeToken.objects.filter(
+            pk__in=OneTimeToken.objects.values_list("pk", flat=True)[:2]
+        ).update(expiration_time=now() - datetime.timedelta(seconds=1))
+
+        call_command("prune_login_tokens", stdout=open("/dev/null", "w"))
+
+        assert OneTimeToken.objects.count() == 1
+
+
+class CacheLoginTokenStoreTest(TestCase):
+    store = CacheLoginTokenStore("login_tokens")
+
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["login_tokens"].clear()
+
+    def test_tokens_skip_the_database(self):
+        installation_id = uuid.uuid4()
+        with self.assertNumQueries(0):
+            previous_token = self.store.create(installation_id)
+            token = self.store.create(installation_id)
+            assert self.store.consume(token) == installation_id
+            with self.assertRaises(AuthenticationFailed):
+                self.store.consume(token)
+            with self.assertRaises(AuthenticationFailed):
+                self.store.consume(previous_token)
+
+
+class LoginTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+
+    def test_login_with_either_store(self):
+        for store in ["database", "cache"]:
+            with self.subTest(store=store), override_settings(LOGIN_TOKEN_STORE=store):
+                installation_id = uuid.uuid4()
+                token = generate_login_token(installation_id)
+                path = f"/app/login/?login-token={token}&device-type=BLACK_AND_WHITE_SCREEN_800X480"
+
+                response = self.client.get(path)
+                assert response.status_code == 302
+                assert self.client.session["installation-id"] == str(installation_id)
+                # The login view is not a DRF view, so the failure is not turned into a response.
+                with self.assertRaises(AuthenticationFailed):
+                    self.client.get(path)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from app import metrics
+from app.metrics import INITIAL_FILE_SIZE, MetricsFile, collect
+from app.tests.temporary_storage import use_temporary_storage
+
+
+class MetricsFileTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_values_of_all_processes_are_summed(self):
+        first = MetricsFile(os.path.join(self.directory, "1.metrics"))
+        second = MetricsFile(os.path.join(self.directory, "2.metrics"))
+        first.add([("a", 1), ("b", 0.5)])
+        first.add([("a", 1)])
+        second.add([("a", 3)])
+
+        assert collect(self.directory) == {"a": 5, "b": 0.5}
+
+    def test_restarted_process_continues_from_its_file(self):
+        path = os.path.join(self.directory, "1.metrics")
+        MetricsFile(path).add([("a", 2)])
+        MetricsFile(path).add([("a", 1), ("b", 1)])
+
+        assert collect(self.directory) == {"a": 3, "b": 1}
+
+    def test_file_grows_when_it_is_full(self):
+        metrics_file = MetricsFile(os.path.join(self.directory, "1.metrics"))
+        metrics_file.add([(f"key_{index}" * 20, index) for index in range(1000)])
+
+        assert os.path.getsize(os.path.join(self.directory, "1.metrics")) > (
+            INITIAL_FILE_SIZE
+        )
+        values = collect(self.directory)
+        assert len(values) == 1000
+        assert values["key_999" * 20] == 999
+
+
+class MetricsEndpointTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        settings_override = override_settings(LOCAL_DEV_MODE=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        caches["render"].clear()
+
+    def test_render_requests_are_counted(self):
+        path = "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+        with mock.patch(
+            "app.views.authenticate_jwt"
+        ) as mock_authenticate_jwt, mock.patch(
+            "app.render.get_image_pool", return_value=None
+        ), mock.patch(
+            "app.render.fetch_image", return_value=b"image"
+        ), override_settings(
+            RENDER_STREAMING_ENABLED=False
+        ):
+            mock_authenticate_jwt.return_value.installation_id = uuid.uuid4()
+            for _ in range(2):
+                assert self.client.get(path).status_code == 200
+            with self.assertRaises(ValueError):
+                self.client.get("/app/render/?device-type=UNKNOWN")
+
+        response = self.client.get("/app/metrics/")
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        lines = response.content.decode().splitlines()
+        assert "# TYPE image_gallery_requests_total counter" in lines
+        assert (
+            'image_gallery_requests_total{route="app/render/",status="200"} 2.0'
+            in lines
+        )
+        assert (
+            'image_gallery_render_cache_lookups_total{kind="image",result="hit"} 1.0'
+            in lines
+        )
+        assert (
+            'image_gallery_render_cache_lookups_total{kind="image",result="miss"} 1.0'
+            in lines
+        )
+        # The unknown device type fails the request.
+        assert "image_gallery_invalid_device_types_total 1.0" in lines
+        assert (
+            'image_gallery_requests_total{route="app/render/",status="500"} 1.0'
+            in lines
+        )
+        assert (
+            'image_gallery_request_duration_seconds_bucket{route="app/render/",le="+Inf"} 3.0'
+            in lines
+        )
+        assert (
+            'image_gallery_request_duration_seconds_count{route="app/render/"} 3.0'
+            in lines
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", ("label",), (1, 2))
+        self.addCleanup(metrics.registry.pop, "test_seconds")
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value, "a")
+
+        lines = self.client.get("/app/metrics/").content.decode().splitlines()
+
+        assert 'test_seconds_bucket{label="a",le="1"} 1.0' in lines
+        assert 'test_seconds_bucket{label="a",le="2"} 3.0' in lines
+        assert 'test_seconds_bucket{label="a",le="+Inf"} 4.0' in lines
+        assert 'test_seconds_sum{label="a"} 6.5' in lines
+
+    def test_scrapes_need_the_token_if_one_is_set(self):
+        with override_settings(METRICS_TOKEN="secret"):
+            assert self.client.get("/app/metrics/").status_code == 401
+            response = self.client.get(
+                "/app/metrics/", HTTP_AUTHORIZATION="Bearer secret"
+            )
+        assert response.status_code == 200
+
+    @override_settings(LOCAL_DEV_MODE=False)
+    def test_scrapes_are_not_served_without_a_token_outside_local_development(self):
+        assert self.client.get("/app/metrics/").status_code == 404
+        with override_settings(METRICS_TOKEN="secret"):
+            response = self.client.get(
+                "/app/metrics/", HTTP_AUTHORIZATION="Bearer secret"
+            )
+        assert response.status_code == 200
@@ -0,0 +1,28 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, modify_settings
+from django.test.utils import CaptureQueriesContext
+
+from app.tests.signed_jwt import ENVIRONMENT, sign_jwt
+from app.tests.temporary_storage import use_temporary_storage
+from app.views import get_jwt_public_key
+
+
+@modify_settings(MIDDLEWARE={"prepend": "app.middleware.RequestStatsMiddleware"})
+class RequestStatsMiddlewareTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+
+    def test_query_count_header(self):
+        get_jwt_public_key.cache_clear()
+        with mock.patch.dict("os.environ", ENVIRONMENT), CaptureQueriesContext(
+            connection
+        ) as queries:
+            response = self.client.get(
+                "/app/get-login-token/", HTTP_AUTHORIZATION=sign_jwt()
+            )
+
+        assert response.status_code == 200
+        assert len(queries) > 0
+        assert response["X-Query-Count"] == str(len(queries))
@@ -0,0 +1,103 @@
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from app.prefetch import ImagePool
+from app.tests.fake_upstream import FakeUpstreamServer
+from app.tests.temporary_storage import use_temporary_storage
+
+
+class ImagePoolTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+
+    def test_refill_fills_every_size_up_to_capacity(self):
+        with FakeUpstreamServer() as upstream:
+            with override_settings(IMAGE_UPSTREAM_URL=upstream.url):
+                pool = ImagePool(
+                    sizes=[(800, 480), (480, 800)], capacity=3, low_water_mark=1
+                )
+                pool.refill()
+
+        assert upstream.request_count == 6
+        assert sorted(upstream.requested_paths)[0] == "/480/800/"
+        stats = pool.stats()
+        assert stats["pools"]["800x480"]["depth"] == 3
+        assert stats["pools"]["800x480"]["last_refill_latency"] is not None
+
+    def test_take_below_low_water_mark_wakes_up_refill(self):
+        pool = ImagePool(
+            sizes=[(800, 480)],
+            capacity=3,
+            low_water_mark=2,
+            fetch=lambda width, height: b"image",
+        )
+        pool.refill()
+
+        assert pool.take(800, 480) == b"image"
+        assert not pool._wakeup.is_set()
+        assert pool.take(800, 480) == b"image"
+        assert pool._wakeup.is_set()
+        assert pool.take(800, 480) == b"image"
+        assert pool.take(800, 480) is None
+        assert pool.take(123, 456) is None
+        assert pool.stats()["hits"] == 3
+        assert pool.stats()["misses"] == 2
+
+    def test_background_thread_keeps_pool_filled(self):
+        with FakeUpstreamServer() as upstream:
+            with override_settings(IMAGE_UPSTREAM_URL=upstream.url):
+                pool = ImagePool(sizes=[(800, 480)], capacity=2, low_water_mark=2)
+                pool.start()
+                try:
+                    for _ in range(50):
+                        if pool.stats()["pools"]["800x480"]["depth"] == 2:
+                            break
+                        pool._stopped.wait(0.05)
+                    assert pool.take(800, 480) == upstream.image
+                    for _ in range(50):
+                        if pool.stats()["pools"]["800x480"]["depth"] == 2:
+                            break
+                        pool._stopped.wait(0.05)
+                finally:
+                    pool.stop()
+
+        assert pool.stats()["pools"]["800x480"]["depth"] == 2
+        assert upstream.request_count == 3
+
+
+class RenderFromPoolTest(TestCase):
+    def test_cache_miss_is_served_from_pool_without_upstream_request(self):
+        use_temporary_storage(self)
+        caches["render"].clear()
+        installation_id = uuid.uuid4()
+        pool = ImagePool(
+            sizes=[(800, 480)],
+            capacity=1,
+            low_water_mark=0,
+            fetch=lambda width, height: b"prefetched",
+        )
+        pool.refill()
+
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ), mock.patch("app.render.get_image_pool", return_value=pool), mock.patch(
+            "app.views.authenticate_jwt"
+        ) as mock_authenticate_jwt:
+            mock_authenticate_jwt.return_value.installation_id = installation_id
+            response = self.client.get(
+                "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+            )
+            assert response.status_code == 200
+            assert response.content == b"prefetched"
+
+            # The pool is now empty, so the next miss is streamed from the upstream server.
+            caches["render"].clear()
+            response = self.client.get(
+                "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480"
+            )
+            assert b"".join(response.streaming_content) == upstream.image
+
+        assert upstream.request_count == 1
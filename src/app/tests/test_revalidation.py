@@ -0,0 +1,154 @@
+import time
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from app.image_store import load_image, save_image
+from app.render import (
+    get_bitmap,
+    get_image,
+    get_render_cache_key,
+    render_flights,
+    render_refresher,
+)
+from app.revalidation import BackgroundRefresher
+from app.tests.render_test_mixin import RenderTestMixin
+
+
+def wait_for_refreshes(refresher: BackgroundRefresher):
+    deadline = time.monotonic() + 5
+    while refresher.stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def save_stale_image(cache_key: str, installation_id: uuid.UUID, image: bytes):
+    # Expires right away, but stays in the store for the stale timeout.
+    return save_image(cache_key, installation_id, image, timeout=0)
+
+
+# The refresh runs in another thread, which a TestCase transaction would hide.
+@override_settings(RENDER_STALE_TIMEOUT=600)
+class StaleWhileRevalidateTest(RenderTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        self.cache_key = get_render_cache_key(self.installation_id, 800, 480)
+
+    def test_stale_image_is_served_while_it_is_refreshed(self):
+        save_stale_image(self.cache_key, self.installation_id, b"old")
+
+        def fetch_image(width, height):
+            time.sleep(0.2)
+            return b"new"
+
+        with mock.patch(
+            "app.render.fetch_image", side_effect=fetch_image
+        ) as mock_fetch:
+            start = time.monotonic()
+            assert get_image(self.installation_id, 800, 480).content == b"old"
+            assert get_image(self.installation_id, 800, 480).content == b"old"
+            assert time.monotonic() - start < 0.2
+            wait_for_refreshes(render_refresher)
+
+        assert mock_fetch.call_count == 1
+        stored_image = load_image(self.cache_key)
+        assert stored_image.content == b"new"
+        assert not stored_image.is_stale()
+        assert not caches["default"].has_key(f"single_flight_lease_{self.cache_key}")
+
+    def test_failed_refresh_keeps_the_stale_image(self):
+        save_stale_image(self.cache_key, self.installation_id, b"old")
+        failed = render_refresher.stats()["failed"]
+
+        with mock.patch("app.render.fetch_image", side_effect=ConnectionError):
+            assert get_image(self.installation_id, 800, 480).content == b"old"
+            wait_for_refreshes(render_refresher)
+
+        assert render_refresher.stats()["failed"] == failed + 1
+        assert load_image(self.cache_key).content == b"old"
+
+
+@override_settings(RENDER_STALE_TIMEOUT=600)
+class RevalidationTest(RenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_key = get_render_cache_key(self.installation_id, 800, 480)
+        # Refreshes run right away, in the test's thread and transaction.
+        patcher = mock.patch.object(
+            render_refresher, "_submit", lambda function, *args: function(*args)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pending_refreshes_are_not_repeated(self):
+        refresher = BackgroundRefresher(render_flights, max_workers=1)
+        computed = []
+        with mock.patch.object(refresher, "_submit"):
+            refresher.refresh(
+                "key", load=lambda: None, compute=lambda: computed.append(True)
+            )
+            refresher.refresh(
+                "key", load=lambda: None, compute=lambda: computed.append(True)
+            )
+            assert refresher._submit.call_count == 1
+        assert refresher.stats()["pending"] == 1
+
+    def test_image_refreshed_by_another_worker_is_not_refreshed_again(self):
+        save_stale_image(self.cache_key, self.installation_id, b"old")
+        cache = caches["render"]
+        memory_key = cache.make_and_validate_key(self.cache_key)
+        stale_pointer = cache._memory.get(memory_key)
+        stale_entry_expires_at = cache._memory.entries[memory_key][0]
+        fresh_image = save_image(
+            self.cache_key, self.installation_id, b"new", timeout=60
+        )
+        # The in-memory tier of this worker still has the stale pointer.
+        cache._memory.set(memory_key, stale_pointer, stale_entry_expires_at)
+
+        with mock.patch("app.render.fetch_image") as mock_fetch:
+            assert get_image(self.installation_id, 800, 480) == fresh_image
+        mock_fetch.assert_not_called()
+        assert cache._memory.get(memory_key) == (
+            fresh_image.digest,
+            fresh_image.expires_at,
+        )
+
+    def test_refresh_is_skipped_if_the_value_is_current_again(self):
+        refresher = BackgroundRefresher(render_flights, max_workers=1)
+        compute = mock.Mock()
+        with mock.patch.object(
+            refresher, "_submit", lambda function, *args: function(*args)
+        ):
+            refresher.refresh("key", load=lambda: "current", compute=compute)
+        compute.assert_not_called()
+        assert refresher.stats()["skipped"] == 1
+        assert refresher.stats()["refreshed"] == 0
+
+    @override_settings(RENDER_STALE_TIMEOUT=0)
+    def test_without_a_stale_timeout_expired_images_are_fetched(self):
+        save_stale_image(self.cache_key, self.installation_id, b"old")
+        with mock.patch("app.render.fetch_image", return_value=b"new"):
+            assert get_image(self.installation_id, 800, 480).content == b"new"
+
+    def test_bitmap_is_not_computed_from_a_stale_image(self):
+        save_stale_image(self.cache_key, self.installation_id, b"old")
+        with mock.patch("app.render.fetch_image", return_value=b"new"), mock.patch(
+            "app.render.render_bitmap", side_effect=lambda image, *args: image
+        ):
+            assert get_bitmap(self.installation_id, 800, 480, "ordered").content == (
+                b"new"
+            )
+
+    @override_settings(RENDER_STREAMING_ENABLED=False)
+    def test_not_modified_response_refreshes_a_stale_image(self):
+        stale_image = save_stale_image(self.cache_key, self.installation_id, b"old")
+        with mock.patch("app.render.fetch_image", return_value=b"new"):
+            response = self.client.get(
+                "/app/render/?device-type=BLACK_AND_WHITE_SCREEN_800X480",
+                HTTP_IF_NONE_MATCH=f'"{stale_image.digest}"',
+            )
+        assert response.status_code == 304
+        assert "max-age=0" in response["Cache-Control"]
+        assert load_image(self.cache_key).content == b"new"
@@ -0,0 +1,107 @@
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.views import View
+
+from app.models import AppInstallation
+from app.query_budget import QueryBudgetExceeded, query_budget
+from app.tests.temporary_storage import use_temporary_storage
+from app.views import generate_login_token
+
+
+def get_checked_orientation(response) -> str:
+    (orientation,) = re.findall(r'value="(\w+)"\s+checked', response.content.decode())
+    return orientation
+
+
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+class SettingsPageTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["installations"].clear()
+        self.installation_id = uuid.uuid4()
+
+    def login(self):
+        token = generate_login_token(self.installation_id)
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f"/app/login/?login-token={token}&device-type=BLACK_AND_WHITE_SCREEN_800X480"
+            )
+        assert response.status_code == 302
+
+    def test_settings_page_flow_queries(self):
+        self.login()
+        with self.assertNumQueries(0):
+            response = self.client.get("/app/settings/")
+        assert get_checked_orientation(response) == "horizontal"
+
+        with self.assertNumQueries(1):
+            self.client.post("/app/settings/", {"orientation": "vertical"})
+        assert AppInstallation.objects.get().is_vertically_oriented
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/app/settings/")
+        assert get_checked_orientation(response) == "vertical"
+
+    def test_settings_page_has_the_csrf_token_of_the_session(self):
+        self.login()
+        self.client.get("/app/settings/")
+        response = self.client.get("/app/settings/")
+        page = response.content.decode()
+        assert "csrf-token-placeholder" not in page
+        assert re.search(r'name="csrfmiddlewaretoken" value="\w+"', page)
+
+
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class DatabaseSessionSettingsPageTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+
+    def test_settings_page_flow_stays_within_budget(self):
+        assert settings.SESSION_ENGINE == "django.contrib.sessions.backends.db"
+        installation_id = uuid.uuid4()
+        for _ in range(2):
+            # Logging in again loads the session of the previous login.
+            token = generate_login_token(installation_id)
+            response = self.client.get(
+                f"/app/login/?login-token={token}&device-type=BLACK_AND_WHITE_SCREEN_800X480"
+            )
+            assert response.status_code == 302
+
+        self.client.post("/app/settings/", {"orientation": "vertical"})
+        response = self.client.get("/app/settings/")
+        assert get_checked_orientation(response) == "vertical"
+
+
+class BudgetedView(View):
+    @query_budget(1)
+    def get(self, request):
+        list(AppInstallation.objects.all())
+        list(AppInstallation.objects.all())
+
+
+class AtomicView(View):
+    @query_budget(1)
+    def get(self, request):
+        with transaction.atomic():
+            list(AppInstallation.objects.all())
+
+
+class QueryBudgetTest(TestCase):
+    @override_settings(QUERY_BUDGETS_STRICT=True)
+    def test_strict_budget_raises(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "made 2 queries"):
+            BudgetedView().get(None)
+
+    @override_settings(QUERY_BUDGETS_STRICT=True)
+    def test_transaction_statements_are_not_counted(self):
+        AtomicView().get(None)
+
+    @override_settings(QUERY_BUDGETS_STRICT=False)
+    def test_budget_logs_a_warning(self):
+        with self.assertLogs("app.query_budget", "WARNING"):
+            BudgetedView().get(None)
@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from app.render import get_image
+from app.single_flight import SingleFlight
+from app.tests.fake_upstream import FakeUpstreamServer
+from app.tests.temporary_storage import use_temporary_storage
+
+
+def run_in_threads(function, count: int) -> list:
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = function()
+        except Exception as exception:
+            results[index] = exception
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+# The flights share the database cache between threads, which a TestCase transaction would hide.
+class SingleFlightTest(TransactionTestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["default"].clear()
+        caches["render"].clear()
+        self.flights = SingleFlight(
+            lease_cache="default", lease_timeout=5, poll_interval=0.01
+        )
+
+    def test_concurrent_misses_compute_once(self):
+        computed = []
+
+        def compute():
+            computed.append(True)
+            time.sleep(0.2)
+            return "value"
+
+        results = run_in_threads(
+            lambda: self.flights.run("key", load=lambda: None, compute=compute), 5
+        )
+
+        assert results == ["value"] * 5
+        assert len(computed) == 1
+        assert self.flights.stats() == {
+            "computed": 1,
+            "coalesced": 4,
+            "coalesced_across_workers": 0,
+        }
+        assert not caches["default"].has_key("single_flight_lease_key")
+
+    def test_waiters_get_the_exception_of_the_computation(self):
+        def compute():
+            time.sleep(0.2)
+            raise ConnectionError("upstream down")
+
+        results = run_in_threads(
+            lambda: self.flights.run("key", load=lambda: None, compute=compute), 3
+        )
+
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert not caches["default"].has_key("single_flight_lease_key")
+
+    def test_waits_for_the_worker_that_holds_the_lease(self):
+        # Pretend that another worker is fetching the value.
+        caches["default"].add("single_flight_lease_key", True, timeout=5)
+        values = {}
+
+        def other_worker():
+            time.sleep(0.1)
+            values["key"] = "value"
+            caches["default"].delete("single_flight_lease_key")
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        result = self.flights.run(
+            "key", load=lambda: values.get("key"), compute=mock.Mock()
+        )
+        thread.join()
+
+        assert result == "value"
+        assert self.flights.stats()["coalesced_across_workers"] == 1
+        assert self.flights.stats()["computed"] == 0
+
+    def test_computes_when_the_lease_is_released_without_a_value(self):
+        caches["default"].add("single_flight_lease_key", True, timeout=5)
+        threading.Timer(
+            0.05, lambda: caches["default"].delete("single_flight_lease_key")
+        ).start()
+
+        result = self.flights.run("key", load=lambda: None, compute=lambda: "value")
+
+        assert result == "value"
+        assert self.flights.stats()["computed"] == 1
+
+    def test_loads_again_after_taking_the_lease(self):
+        # The previous leader cached the value between the miss of this request and its lease.
+        compute = mock.Mock()
+
+        assert self.flights.run("key", load=lambda: "value", compute=compute) == "value"
+        assert self.flights.lead("key", load=lambda: "value") is None
+
+        compute.assert_not_called()
+        assert self.flights.stats()["computed"] == 0
+        assert not caches["default"].has_key("single_flight_lease_key")
+
+    def test_waiters_compute_the_value_when_the_leader_lands_without_one(self):
+        flight = self.flights.lead("key", load=lambda: None)
+        assert flight is not None
+        assert self.flights.lead("key", load=lambda: None) is None
+
+        threading.Timer(0.1, lambda: self.flights.land("key", flight)).start()
+        result = self.flights.run("key", load=lambda: None, compute=lambda: "value")
+
+        assert result == "value"
+        assert self.flights.stats()["computed"] == 2
+        assert self.flights.lead("key", load=lambda: None) is not None
+
+    def test_failed_lead_does_not_leave_its_flight_behind(self):
+        def load():
+            raise ConnectionError("cache down")
+
+        with self.assertRaises(ConnectionError):
+            self.flights.lead("key", load=load)
+
+        assert "key" not in self.flights._flights
+        assert not caches["default"].has_key("single_flight_lease_key")
+        assert (
+            self.flights.run("key", load=lambda: None, compute=lambda: "value")
+            == "value"
+        )
+
+    def test_waiters_stop_waiting_for_a_lead_that_never_lands(self):
+        flights = SingleFlight(
+            lease_cache="default", lease_timeout=0.1, poll_interval=0.01
+        )
+        assert flights.lead("key", load=lambda: None) is not None
+
+        result = flights.run("key", load=lambda: None, compute=lambda: "value")
+
+        assert result == "value"
+        assert flights.stats()["computed"] == 2
+
+    def test_async_concurrent_misses_compute_once(self):
+        computed = []
+
+        async def load():
+            return None
+
+        async def compute():
+            computed.append(True)
+            await asyncio.sleep(0.1)
+            return "value"
+
+        async def run_all():
+            return await asyncio.gather(
+                *(
+                    self.flights.arun("key", load=load, compute=compute)
+                    for _ in range(5)
+                )
+            )
+
+        assert asyncio.run(run_all()) == ["value"] * 5
+        assert len(computed) == 1
+        assert self.flights.stats()["coalesced"] == 4
+
+    @mock.patch("app.render.get_image_pool", return_value=None)
+    def test_concurrent_render_misses_fetch_the_image_once(self, _):
+        installation_id = uuid.uuid4()
+        with FakeUpstreamServer(delay=0.3) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            results = run_in_threads(lambda: get_image(installation_id, 800, 480), 4)
+
+        assert upstream.request_count == 1
+        assert len({result.digest for result in results}) == 1
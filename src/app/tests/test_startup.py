@@ -0,0 +1,70 @@
+import io
+import tempfile
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from app.image_store import save_image
+from app.startup import WARMUP_PHASES, warm_up
+from app.tests.temporary_storage import use_temporary_storage
+from app.views import render_settings_page
+
+
+class PrepareDeployTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+
+    def test_steps_with_nothing_to_do_are_skipped(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+
+        with override_settings(STATIC_ROOT=static_root.name):
+            first = io.StringIO()
+            call_command("prepare_deploy", stdout=first)
+            second = io.StringIO()
+            call_command("prepare_deploy", stdout=second)
+
+        # The test database is migrated and has the cache table already.
+        assert "migrate: skipped" in first.getvalue()
+        assert "createcachetable: skipped" in first.getvalue()
+        assert "collectstatic: collected" in first.getvalue()
+        assert "collectstatic: skipped" in second.getvalue()
+        assert "prepare deploy took" in second.getvalue()
+
+
+class WarmUpTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["render"].clear()
+        patcher = mock.patch("app.prefetch.get_image_pool", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_current_renders_are_loaded_into_memory(self):
+        save_image("current", uuid.uuid4(), b"image", timeout=60)
+        cache = caches["render"]
+        cache._memory.clear()
+        render_settings_page.cache_clear()
+
+        phases = warm_up()
+
+        assert [name for name, _ in phases.durations] == [
+            name for name, _ in WARMUP_PHASES
+        ]
+        assert cache._memory.get(cache.make_key("current")) is not None
+        assert render_settings_page.cache_info().currsize == 2
+
+    def test_failed_phase_does_not_stop_the_worker(self):
+        warmed = []
+        phases = [
+            ("failing", mock.Mock(side_effect=RuntimeError)),
+            ("next", lambda: warmed.append("next")),
+        ]
+        with mock.patch("app.startup.WARMUP_PHASES", phases), self.assertLogs(
+            "app.startup", "ERROR"
+        ):
+            warm_up()
+        assert warmed == ["next"]
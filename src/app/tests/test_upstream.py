@@ -0,0 +1,144 @@
+import asyncio
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from app.tests.fake_upstream import FakeUpstreamServer
+from app.tests.temporary_storage import use_temporary_storage
+from app.upstream import UpstreamClient, UpstreamUnavailable
+
+
+@override_settings(
+    IMAGE_UPSTREAM_RETRIES=2,
+    IMAGE_UPSTREAM_RETRY_BACKOFF=0.001,
+    IMAGE_UPSTREAM_TIMEOUT=0.2,
+)
+class UpstreamClientTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        self.client = UpstreamClient(failure_threshold=2, reset_timeout=60)
+
+    def test_fetch_returns_the_image(self):
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            assert self.client.fetch(800, 480) == upstream.image
+            assert self.client.fetch(480, 800) == upstream.image
+
+        assert upstream.requested_paths == ["/800/480/", "/480/800/"]
+        stats = self.client.stats()
+        assert stats["requests"] == 2
+        assert stats["errors"] == 0
+        assert stats["breaker"] == "closed"
+        assert stats["mean_latency"] is not None
+
+    def test_server_errors_are_retried(self):
+        with FakeUpstreamServer(status=503) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            with self.assertRaises(UpstreamUnavailable):
+                self.client.fetch(800, 480)
+
+        assert upstream.request_count == 3
+        assert self.client.stats()["retries"] == 2
+        assert self.client.stats()["errors"] == 3
+
+    def test_client_errors_are_not_retried(self):
+        with FakeUpstreamServer(status=404) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            with self.assertRaises(UpstreamUnavailable):
+                self.client.fetch(800, 480)
+
+        assert upstream.request_count == 1
+
+    def test_hung_upstream_times_out(self):
+        with FakeUpstreamServer(delay=1) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url, IMAGE_UPSTREAM_RETRIES=0
+        ):
+            with self.assertRaises(UpstreamUnavailable):
+                self.client.fetch(800, 480)
+
+        assert self.client.stats()["errors"] == 1
+
+    def test_open_breaker_serves_the_last_good_image(self):
+        with FakeUpstreamServer() as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            image = self.client.fetch(800, 480)
+            upstream.status = 500
+            # The upstream server fails, so both fetches fall back to the last good image and open the breaker.
+            assert self.client.fetch(800, 480) == image
+            assert self.client.fetch(800, 480) == image
+            assert self.client.breaker.state == "open"
+            request_count = upstream.request_count
+
+            # While the breaker is open, the upstream server is not called at all.
+            assert self.client.fetch(800, 480) == image
+            with self.assertRaises(UpstreamUnavailable):
+                self.client.fetch(480, 800)
+            with self.assertRaises(UpstreamUnavailable):
+                self.client.fetch(800, 480, fallback=False)
+
+        assert upstream.request_count == request_count
+        stats = self.client.stats()
+        assert stats["rejected"] == 3
+        assert stats["fallbacks"] == 3
+
+    def test_breaker_closes_after_a_successful_trial_request(self):
+        with FakeUpstreamServer(status=500) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url, IMAGE_UPSTREAM_RETRIES=0
+        ):
+            for _ in range(2):
+                with self.assertRaises(UpstreamUnavailable):
+                    self.client.fetch(800, 480)
+            assert self.client.breaker.state == "open"
+
+            upstream.status = 200
+            with mock.patch("app.upstream.time.monotonic", return_value=10**9):
+                assert self.client.breaker.state == "half-open"
+                assert self.client.fetch(800, 480) == upstream.image
+            assert self.client.breaker.state == "closed"
+
+    def test_client_errors_do_not_open_the_breaker(self):
+        with FakeUpstreamServer(status=404) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+            for _ in range(3):
+                with self.assertRaises(UpstreamUnavailable):
+                    self.client.fetch(800, 480)
+
+        assert upstream.request_count == 3
+        assert self.client.breaker.state == "closed"
+
+    def test_trial_request_that_raises_lets_the_next_trial_through(self):
+        with FakeUpstreamServer(status=500) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url, IMAGE_UPSTREAM_RETRIES=0
+        ):
+            for _ in range(2):
+                with self.assertRaises(UpstreamUnavailable):
+                    self.client.fetch(800, 480)
+
+            upstream.status = 200
+            with mock.patch("app.upstream.time.monotonic", return_value=10**9):
+                with mock.patch.object(
+                    self.client.session, "get", side_effect=ValueError
+                ), self.assertRaises(ValueError):
+                    self.client.fetch(800, 480)
+                assert self.client.fetch(800, 480) == upstream.image
+            assert self.client.breaker.state == "closed"
+
+    def test_afetch_retries_and_returns_the_image(self):
+        with FakeUpstreamServer(status=502) as upstream, override_settings(
+            IMAGE_UPSTREAM_URL=upstream.url
+        ):
+
+            async def fetch():
+                with self.assertRaises(UpstreamUnavailable):
+                    await self.client.afetch(800, 480)
+                upstream.status = 200
+                return await self.client.afetch(800, 480)
+
+            assert asyncio.run(fetch()) == upstream.image
+
+        assert upstream.request_count == 4
@@ -0,0 +1,84 @@
+import io
+import uuid
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from app.devices import get_all_render_sizes, get_master_size
+from app.image_store import StoredImage
+from app.render import get_image, get_master_cache_key, get_render_cache_key
+from app.tests.fake_upstream import FakeUpstreamServer
+from app.tests.temporary_storage import use_temporary_storage
+from app.variants import clear_variants, derive_variant, render_variant
+
+
+def create_jpeg(size: tuple[int, int]) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", size, "gray").save(output, format="JPEG")
+    return output.getvalue()
+
+
+class DeriveVariantTest(TestCase):
+    def setUp(self):
+        clear_variants()
+
+    def test_master_covers_every_render_size(self):
+        assert get_master_size() == (960, 960)
+        master = create_jpeg(get_master_size())
+        for width, height in get_all_render_sizes():
+            variant = Image.open(io.BytesIO(render_variant(master, width, height)))
+            assert variant.format == "JPEG"
+            assert variant.size == (width, height)
+
+    def test_exact_jpeg_is_served_as_it_is(self):
+        master = create_jpeg((800, 480))
+        assert render_variant(master, 800, 480) is master
+
+    def test_variants_are_memoized_by_master_digest(self):
+        master = StoredImage(
+            digest="digest", expires_at=0, content=create_jpeg(get_master_size())
+        )
+        with mock.patch(
+            "app.variants.render_variant", wraps=render_variant
+        ) as mock_render_variant:
+            first = derive_variant(master, 800, 480)
+            assert derive_variant(master, 800, 480) is first
+            derive_variant(master, 480, 800)
+        assert mock_render_variant.call_count == 2
+
+
+@override_settings(RENDER_DERIVE_VARIANTS=True, IMAGE_PREFETCH_ENABLED=False)
+class DerivedRenderTest(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        caches["render"].clear()
+        clear_variants()
+
+    def test_every_size_is_derived_from_one_master_fetch(self):
+        installation_id = uuid.uuid4()
+        with FakeUpstreamServer(
+            image=create_jpeg(get_master_size())
+        ) as upstream, override_settings(IMAGE_UPSTREAM_URL=upstream.url):
+            images = {
+                size: get_image(installation_id, *size)
+                for size in get_all_render_sizes()
+            }
+
+        assert upstream.requested_paths == ["/960/960/"]
+        for (width, height), image in images.items():
+            assert Image.open(io.BytesIO(image.content)).size == (width, height)
+        # Variants are derived lazily, and expire with their master.
+        master = caches["render"].get(get_master_cache_key(installation_id))
+        variant = caches["render"].get(get_render_cache_key(installation_id, 800, 480))
+        assert abs(variant[1] - master[1]) <= 1
+
+    def test_variants_of_other_installations_use_their_own_master(self):
+        with FakeUpstreamServer(
+            image=create_jpeg(get_master_size())
+        ) as upstream, override_settings(IMAGE_UPSTREAM_URL=upstream.url):
+            get_image(uuid.uuid4(), 800, 480)
+            get_image(uuid.uuid4(), 800, 480)
+
+        assert upstream.request_count == 2
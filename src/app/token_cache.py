@@ -0,0 +1,45 @@
+import collections
+import threading
+import time
+from typing import Any
+
+
+class VerifiedTokenCache:
+    # A bounded, per-process cache of JWTs that already passed verification.
+    # Entries expire at the `exp` claim of their token, or after `max_age` seconds, whichever is earlier.
+    # Keys should be digests of the tokens, so that the cache does not hold usable credentials.
+
+    def __init__(self, maxsize: int, max_age: float):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._entries = collections.OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: bytes, value: Any, exp: float | None = None):
+        expires_at = time.time() + self.max_age
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,314 @@
+import asyncio
+import collections
+import random
+import statistics
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from rest_framework.exceptions import APIException
+
+from .metrics import upstream_events, upstream_request_duration
+
+# The client for the upstream image server.
+# Requests share a keep-alive connection pool, are bounded by connect and read timeouts,
+# and are retried with exponential backoff on connection errors and 5xx responses.
+# A circuit breaker stops calling the upstream server after repeated failures, i.e. connection errors and
+# 5xx responses. Client errors mean that the upstream server is up, so they do not count. While it is open,
+# the client serves the last image it fetched for the requested size, if there is one.
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(APIException):
+    status_code = 503
+    default_detail = "The image server is unavailable, try again later."
+    default_code = "upstream_unavailable"
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures, and then rejects calls for `reset_timeout` seconds.
+    # After that, a single trial call is let through. If it succeeds, the breaker closes, otherwise it opens again.
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.is_trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if (
+                time.monotonic() - self.opened_at < self.reset_timeout
+                or self.is_trial_running
+            ):
+                return False
+            self.is_trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.is_trial_running = False
+
+    def release_trial(self):
+        # For calls that end without telling whether the upstream server works, like on a client error.
+        with self.lock:
+            self.is_trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.is_trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    # The URL, timeouts and retries are read from the settings on every request,
+    # the circuit breaker and the metrics live as long as the client.
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=settings.IMAGE_UPSTREAM_MAX_CONNECTIONS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # (width, height) -> image
+        self._last_good_images = {}
+        self._latencies = collections.deque(maxlen=1000)
+        self._counters = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "rejected": 0,
+            "fallbacks": 0,
+        }
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_url(width: int, height: int) -> str:
+        return f"{settings.IMAGE_UPSTREAM_URL}/{width}/{height}/"
+
+    @staticmethod
+    def _get_backoff(attempt: int) -> float:
+        # Exponential backoff with jitter, so that workers do not retry in lockstep.
+        backoff = settings.IMAGE_UPSTREAM_RETRY_BACKOFF * 2 ** (attempt - 1)
+        return backoff * random.uniform(0.5, 1)
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+        upstream_events.inc(counter)
+
+    def _record_attempt(self, start: float, is_error: bool):
+        latency = time.perf_counter() - start
+        with self._lock:
+            self._counters["requests"] += 1
+            if is_error:
+                self._counters["errors"] += 1
+            self._latencies.append(latency)
+        upstream_request_duration.observe(latency, "error" if is_error else "ok")
+
+    def _record_success(self, width: int, height: int, image: bytes):
+        self.breaker.record_success()
+        self.record_good_image(width, height, image)
+
+    def _get_fallback(self, width: int, height: int, fallback: bool) -> bytes:
+        image = self._last_good_images.get((width, height)) if fallback else None
+        if image is None:
+            raise UpstreamUnavailable()
+        self._count("fallbacks")
+        return image
+
+    def _get(
+        self, width: int, height: int, stream: bool = False
+    ) -> requests.Response | None:
+        # Returns the first successful response, or None when all attempts failed.
+        try:
+            return self._get_with_retries(width, height, stream)
+        except BaseException:
+            # An unexpected error must not leave a half-open breaker waiting for its trial call forever.
+            self.breaker.release_trial()
+            raise
+
+    def _get_with_retries(
+        self, width: int, height: int, stream: bool
+    ) -> requests.Response | None:
+        is_failure = True
+        for attempt in range(settings.IMAGE_UPSTREAM_RETRIES + 1):
+            if attempt:
+                self._count("retries")
+                time.sleep(self._get_backoff(attempt))
+            start = time.perf_counter()
+            try:
+                response = self.session.get(
+                    self._get_url(width, height),
+                    timeout=(
+                        settings.IMAGE_UPSTREAM_CONNECT_TIMEOUT,
+                        settings.IMAGE_UPSTREAM_TIMEOUT,
+                    ),
+                    stream=stream,
+                )
+                response.raise_for_status()
+            except requests.HTTPError as exception:
+                self._record_attempt(start, is_error=True)
+                exception.response.close()
+                is_failure = exception.response.status_code >= 500
+                if exception.response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+            except requests.RequestException:
+                self._record_attempt(start, is_error=True)
+                is_failure = True
+            else:
+                self._record_attempt(start, is_error=False)
+                return response
+
+        self._record_failed_request(is_failure)
+        return None
+
+    def _record_failed_request(self, is_failure: bool):
+        if is_failure:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_trial()
+
+    def fetch(self, width: int, height: int, fallback: bool = True) -> bytes:
+        if not self.breaker.allow_request():
+            self._count("rejected")
+            return self._get_fallback(width, height, fallback)
+        response = self._get(width, height)
+        if response is None:
+            return self._get_fallback(width, height, fallback)
+        self._record_success(width, height, response.content)
+        return response.content
+
+    def open_stream(self, width: int, height: int) -> requests.Response:
+        # Returns a response whose body has not been read yet, for streaming it to the client.
+        # There is no fallback, callers should use fetch() if this raises.
+        # Call record_good_image() once the whole image has arrived.
+        if not self.breaker.allow_request():
+            self._count("rejected")
+            raise UpstreamUnavailable()
+        response = self._get(width, height, stream=True)
+        if response is None:
+            raise UpstreamUnavailable()
+        self.breaker.record_success()
+        return response
+
+    def record_good_image(self, width: int, height: int, image: bytes):
+        self._last_good_images[(width, height)] = image
+
+    async def afetch(self, width: int, height: int, fallback: bool = True) -> bytes:
+        if not self.breaker.allow_request():
+            self._count("rejected")
+            return self._get_fallback(width, height, fallback)
+        try:
+            image = await self._aget(width, height)
+        except BaseException:
+            # Like in _get, also when the request is cancelled.
+            self.breaker.release_trial()
+            raise
+        if image is None:
+            return self._get_fallback(width, height, fallback)
+        return image
+
+    async def _aget(self, width: int, height: int) -> bytes | None:
+        is_failure = True
+        for attempt in range(settings.IMAGE_UPSTREAM_RETRIES + 1):
+            if attempt:
+                self._count("retries")
+                await asyncio.sleep(self._get_backoff(attempt))
+            start = time.perf_counter()
+            try:
+                response = await get_async_client().get(self._get_url(width, height))
+                response.raise_for_status()
+            except httpx.HTTPStatusError as exception:
+                self._record_attempt(start, is_error=True)
+                is_failure = exception.response.status_code >= 500
+                if exception.response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+            except httpx.HTTPError:
+                self._record_attempt(start, is_error=True)
+                is_failure = True
+            else:
+                self._record_attempt(start, is_error=False)
+                self._record_success(width, height, response.content)
+                return response.content
+
+        self._record_failed_request(is_failure)
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "breaker": self.breaker.state,
+            "mean_latency": statistics.fmean(latencies) if latencies else None,
+            "p95_latency": (
+                statistics.quantiles(latencies, n=20, method="inclusive")[18]
+                if len(latencies) > 1
+                else None
+            ),
+        }
+
+
+_upstream_client = None
+_upstream_client_lock = threading.Lock()
+
+
+def get_upstream_client() -> UpstreamClient:
+    # One client per process, so that all threads of a uWSGI worker share its connections and breaker.
+    global _upstream_client
+    if _upstream_client is None:
+        with _upstream_client_lock:
+            if _upstream_client is None:
+                _upstream_client = UpstreamClient(
+                    failure_threshold=settings.IMAGE_UPSTREAM_BREAKER_THRESHOLD,
+                    reset_timeout=settings.IMAGE_UPSTREAM_BREAKER_RESET_TIMEOUT,
+                )
+    return _upstream_client
+
+
+# The async views share one connection pool per event loop, i.e. per ASGI worker process.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                settings.IMAGE_UPSTREAM_TIMEOUT,
+                connect=settings.IMAGE_UPSTREAM_CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.IMAGE_UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.IMAGE_UPSTREAM_MAX_CONNECTIONS,
+            ),
+            # picsum.photos redirects to the actual image
+            follow_redirects=True,
+        )
+        _async_clients[loop] = client
+    return client
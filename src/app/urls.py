@@ -1,19 +1,37 @@
+from django.conf import settings
 from django.urls import path
 
+from .async_views import AsyncGetLoginToken, AsyncGetRender
 from .views import (
     GetLoginToken,
     GetRender,
+    GetRenderBlob,
     Login,
+    Metrics,
+    RenderBatch,
+    RenderStats,
     Settings,
 )
 
+# Under an ASGI server, the device facing endpoints are served by async views on the same urls.
+if settings.ASYNC_VIEWS:
+    get_login_token_view = AsyncGetLoginToken.as_view()
+    render_view = AsyncGetRender.as_view()
+else:
+    get_login_token_view = GetLoginToken.as_view()
+    render_view = GetRender.as_view()
+
 urlpatterns = [
-    path("get-login-token/", GetLoginToken.as_view(), name="login"),
+    path("get-login-token/", get_login_token_view, name="login"),
     path(
         "login/",
         Login.as_view(),
         name="login",
     ),
     path("settings/", Settings.as_view(), name="settings"),
-    path("render/", GetRender.as_view(), name="render"),
+    path("render/", render_view, name="render"),
+    path("render/blob/<str:name>", GetRenderBlob.as_view(), name="render-blob"),
+    path("render/batch/", RenderBatch.as_view(), name="render-batch"),
+    path("render/stats/", RenderStats.as_view(), name="render-stats"),
+    path("metrics/", Metrics.as_view(), name="metrics"),
 ]
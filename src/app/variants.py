@@ -0,0 +1,74 @@
+import collections
+import io
+import threading
+
+from PIL import Image, ImageOps
+
+from .image_store import StoredImage
+
+# Derives the render sizes of an installation from one master image, instead of fetching an image per size.
+# See get_master_size in app/devices.py for the size of the master, and get_image in app/render.py
+# for how masters are fetched and cached.
+# Derived variants are memoized per process by master digest and size, so that rendering the same
+# master again, e.g. for another dithering algorithm or after the render cache evicted the variant,
+# does not decode and resize it again.
+
+EXIF_ORIENTATION = 0x0112
+VARIANT_MEMO_SIZE = 64
+
+
+def is_exact_jpeg(image: Image.Image, width: int, height: int) -> bool:
+    # Whether the image can be served as it is, without decoding and encoding it again.
+    return (
+        image.format == "JPEG"
+        and image.size == (width, height)
+        and image.getexif().get(EXIF_ORIENTATION, 1) == 1
+    )
+
+
+def fit_image(image: Image.Image, width: int, height: int) -> bytes:
+    # Rotates the image upright, crops it to the aspect ratio of (width, height) around its center,
+    # scales it to exactly (width, height), and returns it as a JPEG.
+    image = ImageOps.exif_transpose(image)
+    fitted = ImageOps.fit(image.convert("RGB"), (width, height), method=Image.LANCZOS)
+    output = io.BytesIO()
+    fitted.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def render_variant(master: bytes, width: int, height: int) -> bytes:
+    with Image.open(io.BytesIO(master)) as image:
+        if is_exact_jpeg(image, width, height):
+            return master
+        return fit_image(image, width, height)
+
+
+_variants = collections.OrderedDict()  # (master digest, width, height) -> bytes
+_variants_lock = threading.Lock()
+_variant_stats = {"derived": 0, "memoized": 0}
+
+
+def derive_variant(master: StoredImage, width: int, height: int) -> bytes:
+    key = (master.digest, width, height)
+    with _variants_lock:
+        variant = _variants.get(key)
+        if variant is not None:
+            _variants.move_to_end(key)
+            _variant_stats["memoized"] += 1
+            return variant
+    variant = render_variant(master.content, width, height)
+    with _variants_lock:
+        _variants[key] = variant
+        while len(_variants) > VARIANT_MEMO_SIZE:
+            _variants.popitem(last=False)
+        _variant_stats["derived"] += 1
+    return variant
+
+
+def clear_variants():
+    with _variants_lock:
+        _variants.clear()
+
+
+def stats() -> dict:
+    return {**_variant_stats, "memoized_variants": len(_variants)}
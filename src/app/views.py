@@ -1,25 +1,87 @@
 import dataclasses
-import datetime
-import io
+import functools
+import hashlib
+import json
 import os
+import re
 import secrets
+import time
 from typing import Any
 from uuid import UUID
 
 import jwt
-import pytz
-import requests
-from django.core.cache import cache
-from django.http import HttpResponse, HttpResponseRedirect
-from django.shortcuts import render
+from django.conf import settings
+from django.core.cache import caches
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
 from django.urls import reverse
-from django.utils.timezone import now
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
 from django.views import View
-from rest_framework.exceptions import AuthenticationFailed
+from jwt.algorithms import RSAAlgorithm
+from rest_framework.exceptions import (
+    APIException,
+    AuthenticationFailed,
+    ValidationError,
+)
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import AppInstallation, OneTimeToken
+from . import image_store, metrics, variants
+from .batch import encode_multipart
+from .blob_urls import (
+    BLOB_CONTENT_TYPES,
+    IMMUTABLE_MAX_AGE,
+    get_blob_url,
+    get_response_mode,
+)
+from .deltas import compute_delta
+from .devices import get_render_size
+from .dithering import DITHERING_ALGORITHMS
+from .encoders import ENCODERS, get_accepted_encoding, get_device_encoding
+from .image_sources import get_image_source
+from .image_store import ImagePointer, StoredImage, load_pointer, open_blob_file
+from .installations import (
+    InstallationSettings,
+    get_installation_settings,
+    get_many_installation_settings,
+    save_installation_settings,
+)
+from .login_tokens import get_login_token_store
+from .prefetch import get_image_pool
+from .query_budget import query_budget
+from .refresh_hints import add_refresh_hint
+from .render import (
+    RENDER_CACHE_TIMEOUT,
+    RenderStream,
+    get_bitmap,
+    get_encoded,
+    get_image,
+    get_image_or_stream,
+    get_target_cache_key,
+    get_target_kind,
+    load_last_frame,
+    remember_last_frame,
+    render_flights,
+    render_many,
+    render_refresher,
+    revalidate,
+)
+from .token_cache import VerifiedTokenCache
 
 
 class GetLoginToken(APIView):
@@ -34,6 +96,7 @@ class GetLoginToken(APIView):
     permission_classes = []
     # For transparency, we handle permissions in the view itself.
 
+    @query_budget(1)
     def get(self, request):
         decoded_jwt: DecodedJWT = authenticate_jwt(request)
         installation_id = decoded_jwt.installation_id
@@ -46,52 +109,103 @@ class GetLoginToken(APIView):
 
 
 class Login(View):
+    # The token lookup, and reading the settings of an installation that are not cached yet.
+    @query_budget(2, uses_session=True)
     def get(self, request):
         login_token = request.GET.get("login-token")
         installation_id = authenticate_login_token(login_token=login_token)
 
         request.GET["device-type"]
 
-        AppInstallation.objects.get_or_create(
-            installation_id=installation_id,
-        )
-
+        # The installation is only saved once its settings are, see Settings.post.
         # For a more complex app, for example, the installation entity may be linked to a device entity, which in turn
         # could be linked to a user entity.
 
         # You can also use user-linked sessions.
         request.session["installation-id"] = str(installation_id)
+        set_session_installation_settings(
+            request, get_installation_settings(installation_id)
+        )
 
         # If you are using user-linked sessions, you could for example include the installation_id in the url of the settings page.
         return HttpResponseRedirect(reverse("settings"))
 
 
 class Settings(View):  # NOT a DRF view!!
+    # Only sessions from before the settings were kept in the session need to read them.
+    @query_budget(1, uses_session=True)
     def get(self, request):
         installation_id = authenticate_session(request)
-        installation = AppInstallation.objects.get(installation_id=installation_id)
+        installation_settings = get_session_installation_settings(
+            request, installation_id
+        )
 
-        return render(
-            request=request,
-            template_name="settings.html",
-            context={
-                "is_vertically_oriented": installation.is_vertically_oriented,
-            },
+        # The page only differs by the settings and the CSRF token, so it is rendered once per settings.
+        page = render_settings_page(installation_settings).replace(
+            CSRF_TOKEN_PLACEHOLDER, get_token(request)
         )
+        return HttpResponse(page)
 
+    @query_budget(1, uses_session=True)
     def post(self, request):
         installation_id = authenticate_session(request)
-        installation = AppInstallation.objects.get(installation_id=installation_id)
 
         is_vertically_oriented = request.POST["orientation"] == "vertical"
-        installation.is_vertically_oriented = is_vertically_oriented
-        installation.save()
+        installation_settings = InstallationSettings(
+            is_vertically_oriented=is_vertically_oriented
+        )
+        save_installation_settings(installation_id, installation_settings)
+        set_session_installation_settings(request, installation_settings)
         return HttpResponseRedirect(reverse("settings"))
 
 
+CSRF_TOKEN_PLACEHOLDER = "csrf-token-placeholder"
+
+
+@functools.lru_cache(maxsize=None)
+def render_settings_page(installation_settings: InstallationSettings) -> str:
+    return render_to_string(
+        "settings.html",
+        {
+            "is_vertically_oriented": installation_settings.is_vertically_oriented,
+            "csrf_token": CSRF_TOKEN_PLACEHOLDER,
+        },
+    )
+
+
+def get_session_installation_settings(
+    request, installation_id: UUID
+) -> InstallationSettings:
+    # The session keeps a copy of the settings, so the settings page does not need to read them.
+    # Changes made elsewhere, like in the admin, show up after the next login.
+    stored = request.session.get("installation-settings")
+    if stored is None:
+        installation_settings = get_installation_settings(installation_id)
+        set_session_installation_settings(request, installation_settings)
+        return installation_settings
+    return InstallationSettings(**stored)
+
+
+def set_session_installation_settings(
+    request, installation_settings: InstallationSettings
+):
+    request.session["installation-settings"] = dataclasses.asdict(installation_settings)
+
+
+class IgnoreAcceptContentNegotiation(BaseContentNegotiation):
+    # The Accept header of a render request chooses the encoding of the image, see get_render_encoding,
+    # so DRF must not answer image media types with 406 Not Acceptable. Errors are always JSON.
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
 class GetRender(APIView):
 
     permission_classes = []  # We handle authentication inside the view
+    content_negotiation_class = IgnoreAcceptContentNegotiation
 
     def get(self, request):
         decoded_jwt = authenticate_jwt(request)
@@ -99,44 +213,522 @@ class GetRender(APIView):
         # This endpoint may be called before the settings page is first called.
         # If you are working with  user and device entities, you should create them here if they do not exist yet.
         # The decoded_jwt contains the user_id as well as the device_id. You can use these to create the entities.
+        # Here, installations that were not configured yet just get the default settings, without a database write.
 
-        device_type = request.GET["device-type"]
         installation_id = decoded_jwt.installation_id
-        installation, _ = AppInstallation.objects.get_or_create(
-            installation_id=installation_id
+        installation_settings = get_installation_settings(installation_id)
+
+        render_request = RenderRequest.from_request(
+            request, installation_id, installation_settings.is_vertically_oriented
+        )
+        response_mode = get_response_mode(request.GET.get("response-mode"))
+        pointer = load_pointer(render_request.cache_key)
+        not_modified = get_not_modified_response(request, pointer, render_request)
+        if not_modified:
+            return not_modified
+        pointer_response = get_pointer_response(
+            request, pointer, response_mode, render_request
         )
+        if pointer_response:
+            return pointer_response
+        if response_mode != "content":
+            return get_blob_url_response(
+                request,
+                get_stored_render(render_request),
+                response_mode,
+                render_request,
+            )
 
-        if device_type == "BLACK_AND_WHITE_SCREEN_960X640":
-            if installation.is_vertically_oriented:
-                width = 640
-                height = 960
-            else:
-                width = 960
-                height = 640
-        elif device_type == "BLACK_AND_WHITE_SCREEN_800X480":
-            if installation.is_vertically_oriented:
-                width = 480
-                height = 800
+        if render_request.algorithm:
+            return get_bitmap_response(
+                request, get_stored_render(render_request), render_request
+            )
+        if settings.RENDER_STREAMING_ENABLED and not render_request.encoding:
+            stored_image = get_image_or_stream(
+                installation_id, render_request.width, render_request.height
+            )
+            if isinstance(stored_image, RenderStream):
+                return get_streaming_render_response(stored_image, installation_id)
+            return get_render_response(stored_image, render_request)
+        return get_render_response(get_stored_render(render_request), render_request)
+
+
+def get_stored_render(render_request: "RenderRequest") -> StoredImage:
+    if render_request.algorithm:
+        return get_bitmap(
+            render_request.installation_id,
+            render_request.width,
+            render_request.height,
+            render_request.algorithm,
+        )
+    if render_request.encoding:
+        return get_encoded(
+            render_request.installation_id,
+            render_request.width,
+            render_request.height,
+            render_request.encoding,
+        )
+    return get_image(
+        render_request.installation_id, render_request.width, render_request.height
+    )
+
+
+class GetRenderBlob(View):
+    # The immutable url of a stored image, see app/blob_urls.py. No authentication and no database queries.
+    def get(self, request, name):
+        digest, _, extension = name.partition(".")
+        content_type = BLOB_CONTENT_TYPES.get(extension)
+        if content_type is None or not re.fullmatch("[0-9a-f]{64}", digest):
+            raise Http404
+        response = get_conditional_response(request, etag=quote_etag(digest))
+        if response is None:
+            file = open_blob_file(digest)
+            if file:
+                response = FileResponse(file, content_type=content_type)
+                del response["Content-Disposition"]
             else:
-                width = 800
-                height = 480
+                content = image_store.read_blob(digest)
+                if content is None:
+                    raise Http404
+                response = HttpResponse(content, content_type=content_type)
+        response["ETag"] = quote_etag(digest)
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+        return response
+
+
+@dataclasses.dataclass
+class RenderRequest:
+    installation_id: UUID
+    width: int
+    height: int
+    algorithm: str | None  # The dithering algorithm for 1bpp renders
+    encoding: str | None  # See app/encoders.py
+    cache_key: str
+
+    @property
+    def target(self) -> tuple[UUID, int, int, str | None, str | None]:
+        # See render_many in app/render.py.
+        return (
+            self.installation_id,
+            self.width,
+            self.height,
+            self.algorithm,
+            self.encoding,
+        )
+
+    @staticmethod
+    def from_request(
+        request, installation_id: UUID, is_vertically_oriented: bool
+    ) -> "RenderRequest":
+        return RenderRequest.create(
+            installation_id,
+            request.GET["device-type"],
+            is_vertically_oriented,
+            image_format=request.GET.get("image-format"),
+            dithering=request.GET.get("dithering"),
+            accept=request.headers.get("Accept"),
+        )
+
+    @staticmethod
+    def create(
+        installation_id: UUID,
+        device_type: str,
+        is_vertically_oriented: bool,
+        image_format: str | None = None,
+        dithering: str | None = None,
+        accept: str | None = None,
+    ) -> "RenderRequest":
+        width, height = get_render_size(device_type, is_vertically_oriented)
+        if dithering and dithering not in DITHERING_ALGORITHMS:
+            raise ValidationError(f"Invalid dithering algorithm {dithering}")
+        if image_format == "1bpp":
+            # Devices that understand packed bitmaps can ask for the dithered 1bpp frame directly.
+            algorithm = dithering or settings.RENDER_DITHERING_ALGORITHM
+            encoding = None
         else:
-            raise ValueError(f"Invalid device type{device_type}")
-        cache_key = f"image_gallery_cache_key_{installation_id}_{width}_{height}"
-        cache_value = cache.get(key=cache_key)
-        image = io.BytesIO(cache_value) if cache_value else None
-
-        if not image:
-            image = requests.get(
-                url=f"https://picsum.photos/{width}/{height}/",
-                stream=True,
-            ).raw
-            cache.set(
-                key=cache_key,
-                value=image.read(),
-                timeout=30 * 60,
+            algorithm = None
+            encoding = get_render_encoding(device_type, image_format, accept)
+        return RenderRequest(
+            installation_id=installation_id,
+            width=width,
+            height=height,
+            algorithm=algorithm,
+            encoding=encoding,
+            cache_key=get_target_cache_key(
+                installation_id, width, height, algorithm, encoding
+            ),
+        )
+
+
+def get_render_encoding(
+    device_type: str, image_format: str | None, accept: str | None
+) -> str | None:
+    # See app/encoders.py for the order in which the encoding is chosen.
+    # `?image-format=original` asks for the image as it is, whatever the defaults.
+    if image_format == "original":
+        return None
+    if image_format:
+        if image_format not in ENCODERS:
+            raise ValidationError(f"Invalid image format {image_format}")
+        return image_format
+    device_encoding = get_device_encoding(device_type)
+    if accept:
+        return get_accepted_encoding(accept, device_encoding) or device_encoding
+    return device_encoding
+
+
+def get_not_modified_response(
+    request, pointer: ImagePointer | None, render_request: "RenderRequest"
+):
+    # A device that already has the current image only needs to hear that it is still current.
+    # This is answered from the image pointer alone, without loading the image.
+    if not pointer:
+        return None
+    not_modified = get_conditional_response(request, etag=quote_etag(pointer.digest))
+    if not_modified is None:
+        return None
+    # The device keeps a stale image until the refresh is done, and polls again after the refresh hint.
+    revalidate(render_request.target, pointer)
+    return add_render_cache_headers(
+        not_modified, pointer, render_request.installation_id
+    )
+
+
+def get_render_response(stored_image: StoredImage, render_request: RenderRequest):
+    response = HttpResponse(
+        stored_image.content, content_type=get_render_content_type(render_request)
+    )
+    return add_render_headers(response, stored_image, render_request)
+
+
+def get_pointer_response(
+    request,
+    pointer: ImagePointer | None,
+    response_mode: str,
+    render_request: RenderRequest,
+):
+    # The responses of a render cache hit that only need its pointer, shared by GetRender and AsyncGetRender:
+    # the url of the image, or the image straight from its blob file. None if the image has to be loaded.
+    if response_mode != "content":
+        # Unless the image was evicted and has to be rendered again.
+        if not pointer or not image_store.has_blob(pointer.digest):
+            return None
+        count_render_hit(pointer, render_request)
+        return get_blob_url_response(request, pointer, response_mode, render_request)
+    return get_file_render_response(pointer, render_request)
+
+
+def get_file_render_response(
+    pointer: ImagePointer | None, render_request: RenderRequest
+):
+    # A render cache hit is sent straight from its blob file, see app/blob_files.py. Under uWSGI, FileResponse
+    # is sent with sendfile() through wsgi.file_wrapper, so the image is never copied through Python.
+    # 1bpp frames are not, when they may be sent as deltas, see get_bitmap_response.
+    if not pointer or (render_request.algorithm and settings.RENDER_DELTA_FRAMES):
+        return None
+    file = open_blob_file(pointer.digest)
+    if file is None:
+        return None
+    count_render_hit(pointer, render_request)
+    response = FileResponse(file, content_type=get_render_content_type(render_request))
+    # FileResponse names the download after the blob file, which means nothing to a device.
+    del response["Content-Disposition"]
+    return add_render_headers(response, pointer, render_request)
+
+
+def count_render_hit(pointer: ImagePointer, render_request: RenderRequest):
+    # For hits answered from the pointer, without going through the get_* functions of app/render.py.
+    metrics.render_cache_lookups.inc(
+        get_target_kind(render_request.target),
+        "stale" if pointer.is_stale() else "hit",
+    )
+    revalidate(render_request.target, pointer)
+
+
+def get_blob_url_response(
+    request,
+    stored_image: ImagePointer | StoredImage,
+    response_mode: str,
+    render_request: RenderRequest,
+):
+    # The image is the same full frame for every device, so deltas are not sent this way.
+    content_type = get_render_content_type(render_request)
+    url = request.build_absolute_uri(get_blob_url(stored_image.digest, content_type))
+    if response_mode == "redirect":
+        response = HttpResponseRedirect(url)
+    else:
+        response = JsonResponse(
+            {
+                "url": url,
+                "digest": stored_image.digest,
+                "content_type": content_type,
+                "expires_at": round(stored_image.expires_at),
+            }
+        )
+    return add_render_headers(response, stored_image, render_request)
+
+
+def get_render_content_type(render_request: RenderRequest) -> str:
+    if render_request.encoding:
+        return ENCODERS[render_request.encoding].content_type
+    return "application/octet-stream"
+
+
+def add_render_headers(
+    response, stored_image: ImagePointer | StoredImage, render_request: RenderRequest
+):
+    if render_request.encoding:
+        response["X-Image-Format"] = render_request.encoding
+    if render_request.algorithm:
+        response["X-Image-Width"] = render_request.width
+        response["X-Image-Height"] = render_request.height
+        response["X-Image-Format"] = "1bpp"
+    return add_render_cache_headers(
+        response, stored_image, render_request.installation_id
+    )
+
+
+def get_bitmap_response(
+    request, stored_bitmap: StoredImage, render_request: RenderRequest
+):
+    # With settings.RENDER_DELTA_FRAMES, a device that still shows the last frame served for its render
+    # gets only the difference to the new frame, if that is smaller. See app/deltas.py.
+    delta_base = get_delta_base(request, stored_bitmap, render_request)
+    delta = None
+    if delta_base:
+        delta = compute_delta(
+            delta_base[1],
+            stored_bitmap.content,
+            render_request.width,
+            render_request.height,
+        )
+    return get_delta_response(stored_bitmap, render_request, delta_base, delta)
+
+
+def get_delta_base(
+    request, stored_bitmap: StoredImage, render_request: RenderRequest
+) -> tuple[str, bytes] | None:
+    # The (digest, bitmap) of the frame the device still shows, if a delta can be computed against it.
+    # Remembers the new frame as the last one served, in the render cache.
+    if not settings.RENDER_DELTA_FRAMES:
+        return None
+    last_frame = load_last_frame(render_request.cache_key)
+    if last_frame is None or last_frame[0] != stored_bitmap.digest:
+        remember_last_frame(render_request.cache_key, stored_bitmap)
+    if last_frame and request.GET.get("last-frame") == last_frame[0]:
+        return last_frame
+    return None
+
+
+def get_delta_response(
+    stored_bitmap: StoredImage,
+    render_request: RenderRequest,
+    delta_base: tuple[str, bytes] | None,
+    delta: tuple[str, bytes] | None,
+):
+    if delta is None:
+        if settings.RENDER_DELTA_FRAMES:
+            metrics.render_deltas.inc("full")
+        return get_render_response(stored_bitmap, render_request)
+
+    delta_encoding, content = delta
+    metrics.render_deltas.inc(delta_encoding)
+    response = HttpResponse(content, content_type="application/octet-stream")
+    response["X-Image-Width"] = render_request.width
+    response["X-Image-Height"] = render_request.height
+    response["X-Image-Format"] = "1bpp-delta"
+    response["X-Delta-Encoding"] = delta_encoding
+    response["X-Delta-Base"] = delta_base[0]
+    # The ETag is that of the full frame, which the device has once it applied the delta.
+    return add_render_cache_headers(
+        response, stored_bitmap, render_request.installation_id
+    )
+
+
+def get_streaming_render_response(stream: RenderStream, installation_id: UUID):
+    # The digest of a streamed image is only known once it has fully arrived, so there is no ETag yet.
+    response = StreamingHttpResponse(stream, content_type="application/octet-stream")
+    upstream_headers = stream.response.headers
+    if (
+        "Content-Length" in upstream_headers
+        and "Content-Encoding" not in upstream_headers
+    ):
+        response["Content-Length"] = upstream_headers["Content-Length"]
+    expires_at = time.time() + RENDER_CACHE_TIMEOUT
+    response["Expires"] = http_date(expires_at)
+    patch_cache_control(response, private=True, max_age=RENDER_CACHE_TIMEOUT)
+    patch_vary_headers(response, ["Accept"])
+    return add_refresh_hint(response, installation_id, expires_at)
+
+
+def add_render_cache_headers(
+    response, stored_image: ImagePointer | StoredImage, installation_id: UUID
+):
+    # Tell the device how long the image stays current, so it does not need to poll before then.
+    max_age = max(0, round(stored_image.expires_at - time.time()))
+    response["ETag"] = quote_etag(stored_image.digest)
+    response["Expires"] = http_date(stored_image.expires_at)
+    patch_cache_control(response, private=True, max_age=max_age)
+    # The encoding of the image may depend on the Accept header.
+    patch_vary_headers(response, ["Accept"])
+    return add_refresh_hint(response, installation_id, stored_image.expires_at)
+
+
+class RenderBatch(APIView):
+    # Renders many targets in one request, e.g. to warm several variants or to render for a fleet of installations.
+    # The body is {"targets": [{"device_type": ..., "orientation": ..., "image_format": ..., "dithering": ..., "token": ...}]}.
+    # Only device_type is required. Without an orientation ("vertical" or "horizontal"), the installation's setting is used.
+    # A target renders for the installation of the request's JWT, or for the installation of its own device JWT in `token`.
+    # The response is multipart, see app/batch.py.
+
+    permission_classes = []  # We handle authentication inside the view
+
+    def post(self, request):
+        decoded_jwt = authenticate_jwt(request)
+        targets = (
+            request.data.get("targets") if isinstance(request.data, dict) else None
+        )
+        if (
+            not isinstance(targets, list)
+            or not targets
+            or not all(isinstance(target, dict) for target in targets)
+        ):
+            raise ValidationError("Expected a non-empty list of targets")
+        if len(targets) > settings.RENDER_BATCH_MAX_TARGETS:
+            raise ValidationError(
+                f"At most {settings.RENDER_BATCH_MAX_TARGETS} targets per batch"
             )
-        return HttpResponse(image, content_type="application/octet-stream")
+
+        errors = {}
+        installation_ids = {}
+        for index, target in enumerate(targets):
+            try:
+                installation_ids[index] = get_batch_installation_id(target, decoded_jwt)
+            except APIException as exception:
+                errors[index] = exception
+
+        installation_settings = get_many_installation_settings(
+            list(set(installation_ids.values()))
+        )
+        render_requests = {}
+        for index, installation_id in installation_ids.items():
+            try:
+                render_requests[index] = get_batch_render_request(
+                    targets[index],
+                    installation_id,
+                    installation_settings[installation_id],
+                )
+            except APIException as exception:
+                errors[index] = exception
+
+        results = render_many(
+            [render_request.target for render_request in render_requests.values()]
+        )
+
+        parts = []
+        for index in range(len(targets)):
+            if index in errors:
+                part = get_batch_error_part(errors[index])
+            else:
+                render_request = render_requests[index]
+                result = results[render_request.cache_key]
+                if isinstance(result, Exception):
+                    part = get_batch_error_part(result)
+                else:
+                    response = get_render_response(result, render_request)
+                    part = (
+                        {**dict(response.items()), "X-Render-Status": "200"},
+                        result.content,
+                    )
+            part[0]["X-Render-Index"] = str(index)
+            parts.append(part)
+        content, content_type = encode_multipart(parts)
+        return HttpResponse(content, content_type=content_type)
+
+
+def get_batch_installation_id(target: dict, decoded_jwt: "DecodedJWT") -> UUID:
+    if "token" not in target:
+        return decoded_jwt.installation_id
+    if not isinstance(target["token"], str):
+        raise AuthenticationFailed("Invalid token")
+    return verify_jwt(target["token"]).installation_id
+
+
+def get_batch_render_request(
+    target: dict, installation_id: UUID, installation_settings: InstallationSettings
+) -> RenderRequest:
+    orientation = target.get("orientation")
+    if orientation not in (None, "vertical", "horizontal"):
+        raise ValidationError(f"Invalid orientation {orientation}")
+    if orientation is None:
+        is_vertically_oriented = installation_settings.is_vertically_oriented
+    else:
+        is_vertically_oriented = orientation == "vertical"
+    if target.get("device_type") is None:
+        raise ValidationError("Missing device_type")
+    # The values come from JSON, so they can be lists or objects, which RenderRequest.create can not look up.
+    for field in ["device_type", "image_format", "dithering"]:
+        if not isinstance(target.get(field), (str, type(None))):
+            raise ValidationError(f"Invalid {field}, expected a string")
+    try:
+        return RenderRequest.create(
+            installation_id,
+            target["device_type"],
+            is_vertically_oriented,
+            image_format=target.get("image_format"),
+            dithering=target.get("dithering"),
+        )
+    except ValueError as exception:
+        raise ValidationError(str(exception))
+
+
+def get_batch_error_part(exception: Exception) -> tuple[dict[str, str], bytes]:
+    if isinstance(exception, APIException):
+        status, detail = exception.status_code, exception.detail
+    else:
+        status, detail = 500, "Rendering failed"
+    headers = {"Content-Type": "application/json", "X-Render-Status": str(status)}
+    return headers, json.dumps({"detail": detail}).encode()
+
+
+class RenderStats(APIView):
+    # Statistics of the render pipeline in the worker process that handles the request.
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        image_pool = get_image_pool()
+        return Response(
+            {
+                "image_pool": image_pool.stats() if image_pool else None,
+                "render_cache": caches["render"].stats(),
+                "image_store": image_store.get_stats(),
+                "single_flight": render_flights.stats(),
+                "refreshes": render_refresher.stats(),
+                "image_source": get_image_source().stats(),
+                "variants": variants.stats(),
+            }
+        )
+
+
+class Metrics(View):
+    # The Prometheus scrape endpoint, with the metrics of all worker processes, see app/metrics.py.
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            return HttpResponse(status=404)
+        # Only local development serves the metrics to anyone, elsewhere they need a token.
+        if not settings.METRICS_TOKEN and not settings.LOCAL_DEV_MODE:
+            return HttpResponse(status=404)
+        expected = f"Bearer {settings.METRICS_TOKEN}".encode()
+        given = request.META.get("HTTP_AUTHORIZATION", "").encode()
+        if settings.METRICS_TOKEN and not secrets.compare_digest(given, expected):
+            return HttpResponse(status=401)
+        return HttpResponse(
+            metrics.render_metrics(settings.METRICS_DIR),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
 
 
 ## Authentication and authorization methods
@@ -156,19 +748,48 @@ class DecodedJWT:
         )
 
 
+@functools.lru_cache(maxsize=1)
+def get_jwt_public_key():
+    # Parse the PEM only once per process.
+    return RSAAlgorithm(RSAAlgorithm.SHA256).prepare_key(
+        os.environ["JWT_PUBLIC_KEY"].replace("\\n", "\n")
+    )
+
+
+# Devices poll the render url with the same JWT over and over.
+# Remembering which tokens were already verified saves the RSA signature check on every poll.
+verified_tokens = VerifiedTokenCache(
+    maxsize=settings.JWT_VERIFIED_TOKEN_CACHE_SIZE,
+    max_age=settings.JWT_VERIFIED_TOKEN_CACHE_MAX_AGE,
+)
+
+
 def authenticate_jwt(request) -> DecodedJWT:
     try:
         signed_token = request.META["HTTP_AUTHORIZATION"]
     except KeyError:
         raise AuthenticationFailed("No http auth header")
+    return verify_jwt(signed_token)
+
+
+def verify_jwt(signed_token: str) -> DecodedJWT:
+    start = time.perf_counter()
+    token_digest = hashlib.sha256(signed_token.encode()).digest()
+    decoded_jwt = verified_tokens.get(token_digest)
+    if decoded_jwt:
+        metrics.jwt_verify_duration.observe(time.perf_counter() - start, "true")
+        return decoded_jwt
+
     try:
         decoded_token = jwt.decode(
             signed_token,
-            os.environ["JWT_PUBLIC_KEY"].replace("\\n", "\n"),
+            get_jwt_public_key(),
             algorithms=["RS256"],
         )
     except jwt.exceptions.ExpiredSignatureError:
         raise AuthenticationFailed("Token expired")
+    except jwt.exceptions.InvalidTokenError:
+        raise AuthenticationFailed("Invalid token")
 
     try:
         if decoded_token["developer_id"] != os.environ["MY_DEVELOPER_ID"]:
@@ -177,37 +798,22 @@ def authenticate_jwt(request) -> DecodedJWT:
         raise AuthenticationFailed("Missing developer id")
 
     # At this point, we trust that the user is who they claim to be
-    return DecodedJWT.from_raw_jwt(decoded_token)
+    decoded_jwt = DecodedJWT.from_raw_jwt(decoded_token)
+    verified_tokens.set(token_digest, decoded_jwt, exp=decoded_token.get("exp"))
+    metrics.jwt_verify_duration.observe(time.perf_counter() - start, "false")
+    return decoded_jwt
 
 
 def authenticate_login_token(login_token) -> UUID:
     if not login_token:
         raise AuthenticationFailed("No login token")
-    one_time_token_object = OneTimeToken.objects.filter(token=login_token).first()
-    if not one_time_token_object:
-        raise AuthenticationFailed("Token does not exist")
-    if one_time_token_object.expiration_time < datetime.datetime.now(tz=pytz.UTC):
-        raise AuthenticationFailed("Token expired")
-
-    installation_id = one_time_token_object.installation_id
-
-    OneTimeToken.objects.filter(installation_id=installation_id).delete()
-    return installation_id
+    return get_login_token_store().consume(login_token)
 
 
 def generate_login_token(
     installation_id: UUID,
 ) -> str:
-
-    secret_token = secrets.token_urlsafe(50)[:50]
-    OneTimeToken.objects.filter(installation_id=installation_id).delete()
-    one_time_token = OneTimeToken.objects.create(
-        installation_id=installation_id,
-        token=secret_token,
-        expiration_time=now() + datetime.timedelta(minutes=10),
-    )
-
-    return one_time_token.token
+    return get_login_token_store().create(installation_id)
 
 
 def authenticate_session(request) -> UUID:
@@ -0,0 +1,91 @@
+# Measures the CPU time a worker spends per render cache hit, by how the image blob is served.
+#
+# "database cache" reads the blob from the database cache and returns it in an HttpResponse, like hits before
+# settings.RENDER_BLOB_STORE = "files". "file, python" serves the blob file with a FileResponse that is read in
+# Python, like a server without sendfile support. "file, sendfile" hands the file to os.sendfile(), like uWSGI
+# does with the FileResponse of get_file_render_response in app/views.py. The responses go to /dev/null.
+#
+# Run from the src directory:
+#     python -m benchmarks.bench_blob_store [--sizes 48000 200000 1000000] [--hits 500]
+# By default, it uses a throwaway SQLite database. Pass --database-url for another database.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+", default=[48000, 200000, 1000000])
+parser.add_argument("--hits", type=int, default=500)
+parser.add_argument("--database-url")
+args = parser.parse_args()
+
+directory = tempfile.TemporaryDirectory()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "image_gallery.settings")
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark")
+os.environ["DATABASE_URL"] = (
+    args.database_url or f"sqlite:///{directory.name}/db.sqlite3"
+)
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import caches  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.http import FileResponse, HttpResponse  # noqa: E402
+
+from app.blob_files import BlobFileStore  # noqa: E402
+from app.image_store import get_blob_cache_key, get_image_digest  # noqa: E402
+
+
+def measure(serve, hits: int) -> float:
+    with open(os.devnull, "wb") as output:
+        start = time.process_time()
+        for _ in range(hits):
+            serve(output)
+        return (time.process_time() - start) / hits
+
+
+def main():
+    call_command("migrate", verbosity=0)
+    call_command("createcachetable", verbosity=0)
+    cache = caches["default"]
+    store = BlobFileStore(os.path.join(directory.name, "blobs"), max_bytes=2**40)
+    print(
+        f"{'bytes':>8} {'database cache ms':>18} {'file, python ms':>16} {'file, sendfile ms':>18}"
+    )
+    for size in sorted(args.sizes):
+        blob = os.urandom(size)
+        digest = get_image_digest(blob)
+        cache.set(get_blob_cache_key(digest), blob, timeout=None)
+        store.write(digest, blob)
+
+        def serve_from_cache(output):
+            response = HttpResponse(cache.get(get_blob_cache_key(digest)))
+            output.write(response.content)
+
+        def serve_file_in_python(output):
+            response = FileResponse(store.open(digest))
+            for chunk in response:
+                output.write(chunk)
+            response.close()
+
+        def serve_file_with_sendfile(output):
+            response = FileResponse(store.open(digest))
+            file = response.file_to_stream
+            os.sendfile(output.fileno(), file.fileno(), 0, size)
+            response.close()
+
+        database = measure(serve_from_cache, args.hits)
+        python = measure(serve_file_in_python, args.hits)
+        sendfile = measure(serve_file_with_sendfile, args.hits)
+        print(
+            f"{size:>8} {database * 1000:>18.3f} {python * 1000:>16.3f} {sendfile * 1000:>18.3f}"
+        )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Measures the size and compute time of the 1bpp frame deltas in app/deltas.py on the bundled 800.jpg,
+# for changes from a small box to a completely different frame, with every dithering algorithm.
+# Floyd-Steinberg diffuses the error of a changed pixel into all pixels after it, so even a small change
+# alters most of the rest of the frame. Ordered and threshold dithering keep changes local.
+#
+# Run from the src directory:
+#     python -m benchmarks.bench_deltas [--frames 50]
+
+import argparse
+import io
+import time
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from app.deltas import compute_delta, encode_region, encode_xor_runs, to_rows
+from app.dithering import DITHERING_ALGORITHMS, render_bitmap
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "app" / "tests" / "assets" / "800.jpg"
+SIZES = [(800, 480), (960, 640)]
+
+
+def invert_box(image: bytes, box: tuple[int, int, int, int]) -> bytes:
+    with Image.open(io.BytesIO(image)) as decoded:
+        decoded = decoded.convert("RGB")
+    decoded.paste(ImageOps.invert(decoded.crop(box)), box)
+    output = io.BytesIO()
+    decoded.save(output, format="PNG")
+    return output.getvalue()
+
+
+def get_changes(image: bytes) -> dict[str, bytes]:
+    # The new images, by the kind of change from the original image.
+    with Image.open(io.BytesIO(image)) as decoded:
+        width, height = decoded.size
+        mirrored = io.BytesIO()
+        ImageOps.mirror(decoded.convert("RGB")).save(mirrored, format="PNG")
+    return {
+        "clock box": invert_box(image, (20, 20, 220, 80)),
+        "quarter": invert_box(image, (0, 0, width // 2, height // 2)),
+        "new image": mirrored.getvalue(),
+    }
+
+
+def measure(function, frames: int) -> tuple[float, bytes]:
+    result = function()  # warm up
+    start = time.perf_counter()
+    for _ in range(frames):
+        result = function()
+    return (time.perf_counter() - start) / frames, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    image = TEST_IMAGE_PATH.read_bytes()
+    changes = get_changes(image)
+    print(
+        f"{'algorithm':<16} {'change':<10} {'size':<8} {'frame':>7} {'region':>7} {'xor-rle':>7}"
+        f" {'region ms':>9} {'xor ms':>7} {'chosen':>8}"
+    )
+    for algorithm in DITHERING_ALGORITHMS:
+        for width, height in SIZES:
+            previous = render_bitmap(image, width, height, algorithm)
+            for name, changed in changes.items():
+                frame = render_bitmap(changed, width, height, algorithm)
+                previous_rows = to_rows(previous, width, height)
+                rows = to_rows(frame, width, height)
+                region_time, region = measure(
+                    lambda: encode_region(previous_rows, rows), args.frames
+                )
+                xor_time, xor = measure(
+                    lambda: encode_xor_runs(previous_rows, rows), args.frames
+                )
+                delta = compute_delta(previous, frame, width, height)
+                print(
+                    f"{algorithm:<16} {name:<10} {width}x{height:<4} {len(frame):>7} {len(region):>7} {len(xor):>7}"
+                    f" {region_time * 1000:>9.3f} {xor_time * 1000:>7.3f}"
+                    f" {delta[0] if delta else 'full':>8}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# Compares the per-frame cost of the dithering algorithms in app/dithering.py.
+#
+# Run from the src directory:
+#     python -m benchmarks.bench_dithering [--frames 20]
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.dithering import DITHERING_ALGORITHMS, to_grayscale
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "app" / "tests" / "assets" / "800.jpg"
+SIZES = [(800, 480), (960, 640)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20)
+    args = parser.parse_args()
+
+    image = TEST_IMAGE_PATH.read_bytes()
+    print(f"{'algorithm':<16} {'size':<8} {'ms/frame':>9} {'frames/s':>9} {'bytes':>7}")
+    for width, height in SIZES:
+        grayscale = to_grayscale(image, width, height)
+        for name, dither in DITHERING_ALGORITHMS.items():
+            dither(grayscale)  # warm up, e.g. the Floyd-Steinberg wavefront indices
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                bitmap = np.packbits(dither(grayscale), axis=1)
+            per_frame = (time.perf_counter() - start) / args.frames
+            print(
+                f"{name:<16} {width}x{height:<4} {per_frame * 1000:>9.2f}"
+                f" {1 / per_frame:>9.1f} {bitmap.nbytes:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Compares the payload size and encode time of the encodings in app/encoders.py,
+# next to the image as the image source sends it and the packed 1bpp bitmap.
+#
+# Run from the src directory:
+#     python -m benchmarks.bench_encoders [--frames 20] [--jpeg-quality 80] [--webp-quality 80]
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "image_gallery.settings")
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite://:memory:")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from app.dithering import render_bitmap  # noqa: E402
+from app.encoders import ENCODERS  # noqa: E402
+from app.variants import fit_image  # noqa: E402
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "app" / "tests" / "assets" / "800.jpg"
+SIZES = [(800, 480), (960, 640)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument(
+        "--jpeg-quality", type=int, default=settings.RENDER_JPEG_QUALITY
+    )
+    parser.add_argument(
+        "--webp-quality", type=int, default=settings.RENDER_WEBP_QUALITY
+    )
+    args = parser.parse_args()
+    settings.RENDER_JPEG_QUALITY = args.jpeg_quality
+    settings.RENDER_WEBP_QUALITY = args.webp_quality
+
+    print(f"{'encoding':<10} {'size':<8} {'ms/frame':>9} {'bytes':>8} {'vs source':>9}")
+    for width, height in SIZES:
+        # The image source sends a JPEG of the render size, like picsum does.
+        with Image.open(TEST_IMAGE_PATH) as image:
+            source = fit_image(image, width, height)
+        print(f"{'source':<10} {width}x{height:<4} {'':>9} {len(source):>8} {1:>9.2f}")
+        encoders = {
+            **{name: encoder.encode for name, encoder in ENCODERS.items()},
+            "1bpp": lambda image, width, height: render_bitmap(
+                image, width, height, settings.RENDER_DITHERING_ALGORITHM
+            ),
+        }
+        for name, encode in encoders.items():
+            encode(source, width, height)  # warm up
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                encoded = encode(source, width, height)
+            per_frame = (time.perf_counter() - start) / args.frames
+            print(
+                f"{name:<10} {width}x{height:<4} {per_frame * 1000:>9.2f}"
+                f" {len(encoded):>8} {len(encoded) / len(source):>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
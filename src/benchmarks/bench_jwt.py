@@ -0,0 +1,60 @@
+# Compares the cost of authenticate_jwt with and without the parsed key and verified token caches.
+#
+# Run from the src directory:
+#     python -m benchmarks.bench_jwt [--calls 1000]
+
+import argparse
+import os
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "image_gallery.settings")
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite://:memory:")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import RequestFactory  # noqa: E402
+
+from app.tests.signed_jwt import ENVIRONMENT, sign_jwt  # noqa: E402
+from app.views import (  # noqa: E402
+    authenticate_jwt,
+    get_jwt_public_key,
+    verified_tokens,
+)
+
+
+def measure(calls: int, request, reset) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        reset()
+        authenticate_jwt(request)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+    request = RequestFactory().get("/app/render/", HTTP_AUTHORIZATION=sign_jwt())
+
+    def cold():
+        get_jwt_public_key.cache_clear()
+        verified_tokens.clear()
+
+    scenarios = {
+        "cold (parse key + verify)": cold,
+        "cached key (verify only)": verified_tokens.clear,
+        "warm (verified token)": lambda: None,
+    }
+    print(f"{'scenario':<28} {'us/call':>10}")
+    for name, reset in scenarios.items():
+        per_call = measure(args.calls, request, reset)
+        print(f"{name:<28} {per_call * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Measures how the one-time login token lookup scales with the size of the OneTimeToken table.
+#
+# "indexed consume" is DatabaseLoginTokenStore.consume, a DELETE ... RETURNING on the unique token digest.
+# "full scan" looks a token up with a case-insensitive match, which cannot use the index. It stands in
+# for the lookup before the tokens were hashed and indexed. "cache consume" is CacheLoginTokenStore.consume.
+#
+# Run from the src directory:
+#     python -m benchmarks.bench_login_tokens [--sizes 1000 10000 100000] [--lookups 200]
+# By default, it uses a throwaway SQLite database. Pass --database-url for another database.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+parser.add_argument("--lookups", type=int, default=200)
+parser.add_argument("--database-url")
+args = parser.parse_args()
+
+directory = tempfile.TemporaryDirectory()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "image_gallery.settings")
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark")
+os.environ["DATABASE_URL"] = (
+    args.database_url or f"sqlite:///{directory.name}/db.sqlite3"
+)
+os.environ["LOGIN_TOKEN_CACHE_LOCATION"] = f"{directory.name}/login_tokens"
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.utils.timezone import now  # noqa: E402
+
+from app.login_tokens import (  # noqa: E402
+    LOGIN_TOKEN_LIFETIME,
+    CacheLoginTokenStore,
+    DatabaseLoginTokenStore,
+    create_token,
+    get_token_digest,
+)
+from app.models import OneTimeToken  # noqa: E402
+
+
+def fill_table(size: int):
+    missing = size - OneTimeToken.objects.count()
+    expiration_time = now() + LOGIN_TOKEN_LIFETIME
+    for start in range(0, missing, 10000):
+        OneTimeToken.objects.bulk_create(
+            OneTimeToken(
+                installation_id=uuid.uuid4(),
+                token_digest=get_token_digest(create_token()),
+                expiration_time=expiration_time,
+            )
+            for _ in range(min(10000, missing - start))
+        )
+
+
+def measure(store, lookups: int) -> float:
+    tokens = [store.create(uuid.uuid4()) for _ in range(lookups)]
+    start = time.perf_counter()
+    for token in tokens:
+        store.consume(token)
+    return (time.perf_counter() - start) / lookups
+
+
+def measure_full_scan(lookups: int) -> float:
+    digests = list(
+        OneTimeToken.objects.values_list("token_digest", flat=True)[:lookups]
+    )
+    start = time.perf_counter()
+    for digest in digests:
+        OneTimeToken.objects.filter(token_digest__iexact=digest).first()
+    return (time.perf_counter() - start) / len(digests)
+
+
+def main():
+    call_command("migrate", verbosity=0)
+    database_store = DatabaseLoginTokenStore()
+    cache_store = CacheLoginTokenStore("login_tokens")
+    print(
+        f"{'rows':>8} {'indexed consume ms':>19} {'full scan ms':>13} {'cache consume ms':>17}"
+    )
+    for size in sorted(args.sizes):
+        fill_table(size)
+        indexed = measure(database_store, args.lookups)
+        full_scan = measure_full_scan(min(args.lookups, 50))
+        cache = measure(cache_store, args.lookups)
+        print(
+            f"{size:>8} {indexed * 1000:>19.3f} {full_scan * 1000:>13.3f} {cache * 1000:>17.3f}"
+        )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Compares the cost of deriving every render size from one master image with app/variants.py
+# against the latency of fetching every size from the upstream image server.
+#
+# Run from the src directory:
+#     python -m benchmarks.bench_variants [--frames 20] [--fetches 5] [--upstream-url https://picsum.photos]
+# Without network access, point --upstream-url at a local server, or pass --upstream-url "" to skip fetching.
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "image_gallery.settings")
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite://:memory:")
+
+import django  # noqa: E402
+
+django.setup()
+
+import requests  # noqa: E402
+from django.conf import settings  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from app.devices import get_all_render_sizes, get_master_size  # noqa: E402
+from app.variants import fit_image, render_variant  # noqa: E402
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "app" / "tests" / "assets" / "800.jpg"
+
+
+def measure_fetch(url: str, width: int, height: int, fetches: int) -> float | None:
+    start = time.perf_counter()
+    try:
+        for _ in range(fetches):
+            response = requests.get(
+                f"{url}/{width}/{height}/", timeout=settings.IMAGE_UPSTREAM_TIMEOUT
+            )
+            response.raise_for_status()
+    except requests.RequestException as exception:
+        print(f"Fetching {width}x{height} failed: {exception}")
+        return None
+    return (time.perf_counter() - start) / fetches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--fetches", type=int, default=5)
+    parser.add_argument("--upstream-url", default=settings.IMAGE_UPSTREAM_URL)
+    args = parser.parse_args()
+
+    with Image.open(TEST_IMAGE_PATH) as image:
+        master = fit_image(image, *get_master_size())
+
+    print(f"{'size':<8} {'derive ms':>10} {'fetch ms':>10}")
+    total_derive = 0
+    total_fetch = 0
+    fetch_failed = not args.upstream_url
+    for width, height in get_all_render_sizes():
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            render_variant(master, width, height)
+        derive = (time.perf_counter() - start) / args.frames
+        total_derive += derive
+        fetch = None
+        if not fetch_failed:
+            fetch = measure_fetch(args.upstream_url, width, height, args.fetches)
+            fetch_failed = fetch is None
+            total_fetch += fetch or 0
+        print(
+            f"{width}x{height:<4} {derive * 1000:>10.2f}"
+            f" {fetch * 1000 if fetch is not None else float('nan'):>10.2f}"
+        )
+
+    print(
+        f"\nDeriving all {len(get_all_render_sizes())} sizes: {total_derive * 1000:.2f} ms"
+    )
+    if not fetch_failed:
+        master_fetch = measure_fetch(
+            args.upstream_url, *get_master_size(), args.fetches
+        )
+        if master_fetch is not None:
+            print(f"Fetching every size: {total_fetch * 1000:.2f} ms")
+            print(
+                "Fetching the master and deriving every size:"
+                f" {(master_fetch + total_derive) * 1000:.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
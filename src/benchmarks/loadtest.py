@@ -0,0 +1,423 @@
+# Load tests the device and settings endpoints under the uWSGI (WSGI) and uvicorn (ASGI) deployments.
+#
+# Both servers run with 2 worker processes, like in production, against a local fake upstream
+# image server with a configurable latency. Device JWTs are signed with a throwaway RSA key,
+# see app/tests/signed_jwt.py. The scenarios are:
+#   render-miss: Every request is for a new installation, so every request waits on the upstream server.
+#   render-hit: Requests cycle through --installations installations, so most requests are cache hits.
+#   login: The settings flow of the mobile app: /app/get-login-token/, /app/login/,
+#          then reading and saving /app/settings/ in the session that the login started.
+#
+# For every server, scenario and endpoint, the results report the throughput, the p50/p95/p99 latency,
+# the database queries per request, and for render scenarios the cache hit ratio. A render request is
+# a cache hit if it did not make the fake upstream server send an image.
+#
+# Run from the src directory:
+#     python -m benchmarks.loadtest [--servers wsgi asgi] [--scenarios render-miss render-hit login]
+#         [--requests 200] [--concurrency 20] [--output results.json] [--baseline previous.json]
+#
+# --output writes the results as JSON. --baseline compares them with the JSON of an earlier run.
+#
+# By default, the app uses a throwaway SQLite database. SQLite fails concurrent writes with
+# "database is locked", which shows up as errors under the ASGI server. For representative numbers,
+# pass --database-url with the Postgres database from docker-compose.yml.
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import requests
+
+from app.tests.fake_upstream import FakeUpstreamServer
+from app.tests.signed_jwt import ENVIRONMENT, sign_jwt
+
+SRC_DIR = Path(__file__).parent.parent
+DEVICE_TYPE = "BLACK_AND_WHITE_SCREEN_800X480"
+RENDER_PATH = f"/app/render/?device-type={DEVICE_TYPE}"
+SCENARIOS = ["render-miss", "render-hit", "login"]
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_server_command(server: str, port: int) -> tuple[list[str], dict]:
+    if server == "wsgi":
+        command = [
+            "uwsgi",
+            "--http-socket",
+            f"127.0.0.1:{port}",
+            "--module",
+            "image_gallery.wsgi",
+            "--master",
+            "--processes",
+            "2",
+            "--lazy-apps",
+            "--single-interpreter",
+            "--enable-threads",
+            "--disable-logging",
+            "--die-on-term",
+        ]
+        return command, {}
+    if server == "asgi":
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "image_gallery.asgi:application",
+            "--port",
+            str(port),
+            "--workers",
+            "2",
+            "--no-access-log",
+        ]
+        return command, {"ASYNC_VIEWS": "True"}
+    raise ValueError(f"Invalid server {server}")
+
+
+def get_storage_environment(directory: str) -> dict:
+    return {
+        "RENDER_CACHE_SHARED_LOCATION": f"{directory}/render_cache",
+        "INSTALLATION_CACHE_LOCATION": f"{directory}/installation_cache",
+        "LOGIN_TOKEN_CACHE_LOCATION": f"{directory}/login_tokens",
+        "RENDER_BLOB_DIR": f"{directory}/blobs",
+        "METRICS_DIR": f"{directory}/metrics",
+    }
+
+
+def start_server(server: str, environment: dict) -> tuple[subprocess.Popen, str]:
+    port = get_free_port()
+    command, server_environment = get_server_command(server, port)
+    process = subprocess.Popen(
+        command,
+        cwd=SRC_DIR,
+        env={**environment, **server_environment},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/app/render/", timeout=10)
+            return process, url
+        except (requests.ConnectionError, requests.Timeout):
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"The {server} server did not start")
+
+
+class Recorder:
+    # Collects (endpoint, expected status, response, latency) samples from the load threads.
+
+    def __init__(self):
+        self.samples = []
+
+    def request(
+        self, session: requests.Session, method: str, url: str, endpoint: str, **kwargs
+    ) -> requests.Response | None:
+        expected_status = kwargs.pop("expected_status", 200)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, allow_redirects=False, **kwargs)
+        except requests.RequestException:
+            response = None
+        latency = time.perf_counter() - start
+        # uWSGI's --http-socket does not keep connections alive, so the session must not reuse them.
+        # The session keeps its cookies.
+        session.close()
+        self.samples.append(
+            {
+                "endpoint": endpoint,
+                "ok": response is not None and response.status_code == expected_status,
+                "latency": latency,
+                "queries": (
+                    int(response.headers["X-Query-Count"])
+                    if response is not None and "X-Query-Count" in response.headers
+                    else None
+                ),
+            }
+        )
+        return response
+
+
+def summarize(samples: list[dict], duration: float) -> dict:
+    latencies = sorted(sample["latency"] for sample in samples)
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        percentiles = latencies * 99
+    queries = [sample["queries"] for sample in samples if sample["queries"] is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if not sample["ok"]),
+        "throughput": len(samples) / duration,
+        "p50": percentiles[49],
+        "p95": percentiles[94],
+        "p99": percentiles[98],
+        "mean_queries": statistics.mean(queries) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+
+
+def run_render(
+    url: str, installation_ids: list[uuid.UUID], requests_count: int, concurrency: int
+) -> tuple[list[dict], float]:
+    recorder = Recorder()
+    tokens = [sign_jwt(installation_id) for installation_id in installation_ids]
+
+    def send(index):
+        # Every request opens its own connection, like a fleet of devices does.
+        with requests.Session() as session:
+            recorder.request(
+                session,
+                "GET",
+                f"{url}{RENDER_PATH}",
+                "/app/render/",
+                headers={"Authorization": tokens[index % len(tokens)]},
+            )
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(send, range(requests_count)))
+    return recorder.samples, time.perf_counter() - start
+
+
+def run_login(url: str, flows: int, concurrency: int) -> tuple[list[dict], float]:
+    recorder = Recorder()
+
+    def flow(_):
+        # The session keeps the session and CSRF cookies across the steps, like a browser does.
+        with requests.Session() as session:
+            response = recorder.request(
+                session,
+                "GET",
+                f"{url}/app/get-login-token/",
+                "/app/get-login-token/",
+                headers={"Authorization": sign_jwt()},
+            )
+            if response is None or response.status_code != 200:
+                return
+            recorder.request(
+                session,
+                "GET",
+                f"{url}/app/login/",
+                "/app/login/",
+                params={
+                    "login-token": response.json()["login_token"],
+                    "device-type": DEVICE_TYPE,
+                },
+                expected_status=302,
+            )
+            response = recorder.request(
+                session, "GET", f"{url}/app/settings/", "/app/settings/ GET"
+            )
+            match = CSRF_TOKEN_PATTERN.search(response.text) if response else None
+            if match is None:
+                return
+            recorder.request(
+                session,
+                "POST",
+                f"{url}/app/settings/",
+                "/app/settings/ POST",
+                data={
+                    "csrfmiddlewaretoken": match.group(1),
+                    "orientation": "vertical",
+                },
+                headers={"Referer": f"{url}/app/settings/"},
+                expected_status=302,
+            )
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(flow, range(flows)))
+    return recorder.samples, time.perf_counter() - start
+
+
+def run_scenario(
+    scenario: str, url: str, upstream: FakeUpstreamServer, args
+) -> dict[str, dict]:
+    upstream_requests = upstream.request_count
+    if scenario == "render-miss":
+        installation_ids = [uuid.uuid4() for _ in range(args.requests)]
+        samples, duration = run_render(
+            url, installation_ids, args.requests, args.concurrency
+        )
+    elif scenario == "render-hit":
+        installation_ids = [uuid.uuid4() for _ in range(args.installations)]
+        # Warm up the render cache, so the measured requests are hits unless they get evicted.
+        run_render(url, installation_ids, len(installation_ids), args.concurrency)
+        upstream_requests = upstream.request_count
+        samples, duration = run_render(
+            url, installation_ids, args.requests, args.concurrency
+        )
+    elif scenario == "login":
+        samples, duration = run_login(url, args.requests, args.concurrency)
+    else:
+        raise ValueError(f"Invalid scenario {scenario}")
+
+    results = {}
+    for endpoint in dict.fromkeys(sample["endpoint"] for sample in samples):
+        results[endpoint] = summarize(
+            [sample for sample in samples if sample["endpoint"] == endpoint], duration
+        )
+    if scenario.startswith("render"):
+        fetches = upstream.request_count - upstream_requests
+        results["/app/render/"]["cache_hit_ratio"] = max(0, 1 - fetches / len(samples))
+    return results
+
+
+def format_number(value, scale: float = 1, digits: int = 0) -> str:
+    return "-" if value is None else f"{value * scale:.{digits}f}"
+
+
+def print_results(results: list[dict], baseline: dict | None):
+    baseline_results = {
+        (result["server"], result["scenario"], result["endpoint"]): result
+        for result in (baseline or {}).get("results", [])
+    }
+    print(
+        f"{'server':<6} {'scenario':<12} {'endpoint':<22} {'req/s':>8} {'p50 ms':>7} {'p95 ms':>7}"
+        f" {'p99 ms':>7} {'errors':>6} {'queries':>7} {'hit %':>5}"
+        + (f" {'req/s Δ':>8} {'p95 Δ':>7}" if baseline else "")
+    )
+    for result in results:
+        line = (
+            f"{result['server']:<6} {result['scenario']:<12} {result['endpoint']:<22}"
+            f" {result['throughput']:>8.1f} {result['p50'] * 1000:>7.0f}"
+            f" {result['p95'] * 1000:>7.0f} {result['p99'] * 1000:>7.0f}"
+            f" {result['errors']:>6} {format_number(result['mean_queries'], digits=1):>7}"
+            f" {format_number(result.get('cache_hit_ratio'), 100):>5}"
+        )
+        previous = baseline_results.get(
+            (result["server"], result["scenario"], result["endpoint"])
+        )
+        if previous:
+            # Relative changes, positive is more throughput or more latency.
+            line += (
+                f" {(result['throughput'] / previous['throughput'] - 1) * 100:>+7.0f}%"
+                f" {(result['p95'] / previous['p95'] - 1) * 100:>+6.0f}%"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", nargs="+", default=["wsgi", "asgi"])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="Requests per render scenario, and flows of the login scenario",
+    )
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--installations",
+        type=int,
+        default=20,
+        help="Installations the render-hit scenario cycles through",
+    )
+    parser.add_argument(
+        "--upstream-delay",
+        type=float,
+        default=0.2,
+        help="Seconds the fake upstream server takes per image",
+    )
+    parser.add_argument("--database-url")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory, FakeUpstreamServer(
+        delay=args.upstream_delay
+    ) as upstream:
+        environment = {
+            **os.environ,
+            **ENVIRONMENT,
+            "DJANGO_SETTINGS_MODULE": "image_gallery.settings",
+            "DJANGO_SECRET_KEY": "loadtest",
+            "LOCAL_DEV_MODE": "True",
+            "DATABASE_URL": args.database_url or f"sqlite:///{directory}/db.sqlite3",
+            "IMAGE_UPSTREAM_URL": upstream.url,
+            "IMAGE_PREFETCH_ENABLED": "False",
+            "REQUEST_STATS_HEADERS": "True",
+        }
+        for command in ["migrate", "createcachetable"]:
+            subprocess.run(
+                [sys.executable, "manage.py", command],
+                cwd=SRC_DIR,
+                env={**environment, **get_storage_environment(directory)},
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+
+        print(
+            f"{args.requests} requests per scenario, concurrency {args.concurrency},"
+            f" upstream latency {args.upstream_delay * 1000:.0f} ms"
+        )
+        for server in args.servers:
+            # Every server starts with empty caches, blob files and metrics of its own, and never uses the
+            # ones of a development server in /tmp.
+            process, url = start_server(
+                server,
+                {**environment, **get_storage_environment(f"{directory}/{server}")},
+            )
+            try:
+                for scenario in args.scenarios:
+                    for endpoint, result in run_scenario(
+                        scenario, url, upstream, args
+                    ).items():
+                        results.append(
+                            {
+                                "server": server,
+                                "scenario": scenario,
+                                "endpoint": endpoint,
+                                **result,
+                            }
+                        )
+            finally:
+                process.terminate()
+                process.wait()
+
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "created_at": datetime.datetime.now(
+                        datetime.timezone.utc
+                    ).isoformat(),
+                    "arguments": {
+                        key: value
+                        for key, value in vars(args).items()
+                        if key not in ("output", "baseline")
+                    },
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_gallery.settings')
 
 application = get_asgi_application()
+
+if settings.WARMUP_ENABLED:
+    # Before the worker accepts requests, see app/startup.py.
+    from app.startup import warm_up
+
+    warm_up()
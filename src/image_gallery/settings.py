@@ -60,6 +60,29 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Counters and latency histograms of all workers, served on /app/metrics/ for Prometheus, see app/metrics.py.
+# Every worker writes its values to a file in METRICS_DIR. Scrapes must send METRICS_TOKEN as
+# "Authorization: Bearer <token>". Without a token, the endpoint is only served in LOCAL_DEV_MODE.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True") == "True"
+METRICS_DIR = os.getenv("METRICS_DIR", "/tmp/image_gallery_metrics")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, "app.middleware.MetricsMiddleware")
+
+# Report the database queries of every request in a response header, for benchmarks/loadtest.py.
+REQUEST_STATS_HEADERS = os.getenv("REQUEST_STATS_HEADERS", "False") == "True"
+if REQUEST_STATS_HEADERS:
+    MIDDLEWARE.insert(0, "app.middleware.RequestStatsMiddleware")
+
+# Sessions only hold the installation id and settings, see Login in app/views.py.
+# With SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies, the login and settings page flow
+# does not query the database for sessions. But switching logs out every session stored in the database,
+# and the session data is then kept by the browser: signed, so it cannot be changed, but readable.
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "django.contrib.sessions.backends.db")
+
+# Views over their query budget raise instead of logging a warning, see app/query_budget.py
+QUERY_BUDGETS_STRICT = os.getenv("QUERY_BUDGETS_STRICT", str(LOCAL_DEV_MODE)) == "True"
+
 ROOT_URLCONF = "image_gallery.urls"
 
 TEMPLATES = [
@@ -85,8 +108,13 @@ WSGI_APPLICATION = "image_gallery.wsgi.application"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 
+# Serve the device facing endpoints with async views, see app/async_views.py.
+# Set this when running under an ASGI server (see boot.sh), not under uWSGI.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False") == "True"
+
 DATABASES = {
-    "default": dj_database_url.config(conn_max_age=600)
+    # Persistent connections are not safe with the thread pool that runs sync code under ASGI.
+    "default": dj_database_url.config(conn_max_age=0 if ASYNC_VIEWS else 600)
 }  # Gets the DB config from DATABASE_URL
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
@@ -140,9 +168,165 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.db.DatabaseCache",
         "LOCATION": "django_cache_table",
-    }
+    },
+    # Rendered images are looked up in a per-process memory cache first,
+    # then in a file cache shared by all uWSGI workers, and finally in the database cache.
+    "render": {
+        "BACKEND": "app.cache_backends.TieredCache",
+        "TIMEOUT": 30 * 60,
+        "OPTIONS": {
+            "TIERS": ["render_shared", "default"],
+            "MEMORY_MAX_BYTES": int(
+                os.getenv("RENDER_CACHE_MEMORY_MAX_BYTES", 32 * 1024 * 1024)
+            ),
+            "MEMORY_MAX_ITEM_BYTES": 2 * 1024 * 1024,
+            "PROMOTE_ON_HIT": True,
+            "WRITE_THROUGH": True,
+        },
+    },
+    "render_shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv(
+            "RENDER_CACHE_SHARED_LOCATION", "/tmp/image_gallery_render_cache"
+        ),
+        "TIMEOUT": 30 * 60,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("RENDER_CACHE_SHARED_MAX_ENTRIES", 2000)),
+        },
+    },
+    # Installation settings, read on every render, see app/installations.py.
+    # A file cache, so that all workers see the settings a user saved without asking the database.
+    "installations": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv(
+            "INSTALLATION_CACHE_LOCATION", "/tmp/image_gallery_installation_cache"
+        ),
+        "TIMEOUT": 24 * 60 * 60,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("INSTALLATION_CACHE_MAX_ENTRIES", 10000)),
+        },
+    },
+    # One-time login tokens, with LOGIN_TOKEN_STORE = "cache".
+    # Entries beyond MAX_ENTRIES are culled at random, which invalidates tokens before they expire.
+    "login_tokens": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv(
+            "LOGIN_TOKEN_CACHE_LOCATION", "/tmp/image_gallery_login_tokens"
+        ),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("LOGIN_TOKEN_CACHE_MAX_ENTRIES", 10000)),
+        },
+    },
 }
 
+# Where one-time login tokens are kept: "database" or "cache", see app/login_tokens.py
+LOGIN_TOKEN_STORE = os.getenv("LOGIN_TOKEN_STORE", "database")
+LOGIN_TOKEN_CACHE = os.getenv("LOGIN_TOKEN_CACHE", "login_tokens")
+
+# Verified device JWTs are cached per process until they expire, see app/token_cache.py
+JWT_VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("JWT_VERIFIED_TOKEN_CACHE_SIZE", "4096"))
+JWT_VERIFIED_TOKEN_CACHE_MAX_AGE = float(
+    os.getenv("JWT_VERIFIED_TOKEN_CACHE_MAX_AGE", "300")
+)
+
+# Upstream image server, and the background image prefetching in app/prefetch.py
+
+IMAGE_UPSTREAM_URL = os.getenv("IMAGE_UPSTREAM_URL", "https://picsum.photos")
+# IMAGE_UPSTREAM_TIMEOUT is the read timeout, the connect timeout is separate
+IMAGE_UPSTREAM_TIMEOUT = float(os.getenv("IMAGE_UPSTREAM_TIMEOUT", "10"))
+IMAGE_UPSTREAM_CONNECT_TIMEOUT = float(
+    os.getenv("IMAGE_UPSTREAM_CONNECT_TIMEOUT", "3.05")
+)
+IMAGE_UPSTREAM_MAX_CONNECTIONS = int(os.getenv("IMAGE_UPSTREAM_MAX_CONNECTIONS", "20"))
+IMAGE_UPSTREAM_RETRIES = int(os.getenv("IMAGE_UPSTREAM_RETRIES", "2"))
+IMAGE_UPSTREAM_RETRY_BACKOFF = float(os.getenv("IMAGE_UPSTREAM_RETRY_BACKOFF", "0.2"))
+IMAGE_UPSTREAM_BREAKER_THRESHOLD = int(
+    os.getenv("IMAGE_UPSTREAM_BREAKER_THRESHOLD", "5")
+)
+IMAGE_UPSTREAM_BREAKER_RESET_TIMEOUT = float(
+    os.getenv("IMAGE_UPSTREAM_BREAKER_RESET_TIMEOUT", "30")
+)
+# Prefetching is opt-in: every worker process keeps a background thread that fetches images ahead of time,
+# which costs upstream requests and memory even when the render cache serves most requests.
+IMAGE_PREFETCH_ENABLED = os.getenv("IMAGE_PREFETCH_ENABLED", "False") == "True"
+IMAGE_PREFETCH_POOL_SIZE = int(os.getenv("IMAGE_PREFETCH_POOL_SIZE", "8"))
+IMAGE_PREFETCH_LOW_WATER_MARK = int(os.getenv("IMAGE_PREFETCH_LOW_WATER_MARK", "3"))
+
+# Where render cache misses get their images: "upstream" (the server above) or "library" (see app/library.py)
+IMAGE_SOURCE = os.getenv("IMAGE_SOURCE", "upstream")
+IMAGE_LIBRARY_DIR = os.getenv(
+    "IMAGE_LIBRARY_DIR", os.path.join(BASE_DIR, "image_library")
+)
+IMAGE_LIBRARY_INDEX = os.getenv(
+    "IMAGE_LIBRARY_INDEX", os.path.join(IMAGE_LIBRARY_DIR, ".image_index.json")
+)
+IMAGE_LIBRARY_RESCAN_INTERVAL = float(os.getenv("IMAGE_LIBRARY_RESCAN_INTERVAL", "60"))
+
+# Default dithering algorithm for `?image-format=1bpp` renders, see app/dithering.py
+RENDER_DITHERING_ALGORITHM = os.getenv("RENDER_DITHERING_ALGORITHM", "floyd-steinberg")
+
+# Render cache misses are streamed to the device as the image arrives from the upstream server.
+# Streamed images larger than this are not cached, so they never take more memory than this per request.
+RENDER_STREAMING_ENABLED = os.getenv("RENDER_STREAMING_ENABLED", "True") == "True"
+RENDER_STREAM_MAX_BYTES = int(os.getenv("RENDER_STREAM_MAX_BYTES", 4 * 1024 * 1024))
+
+# Fetch one master image per installation, and derive every device size and orientation from it,
+# instead of fetching a separate image per size. See app/variants.py.
+RENDER_DERIVE_VARIANTS = os.getenv("RENDER_DERIVE_VARIANTS", "False") == "True"
+
+# Remember the last 1bpp frame served for every installation and size, and answer a device that sends the digest of
+# its current frame in `?last-frame=` with only the difference to the new frame. See app/deltas.py.
+# The last frame is remembered for this many seconds, which should be longer than the time between two polls.
+RENDER_DELTA_FRAMES = os.getenv("RENDER_DELTA_FRAMES", "False") == "True"
+RENDER_LAST_FRAME_TIMEOUT = int(os.getenv("RENDER_LAST_FRAME_TIMEOUT", 24 * 60 * 60))
+
+# Whether render responses contain the image, or redirect or point to its immutable url, see app/blob_urls.py.
+# RENDER_BLOB_URL is the base of those urls, like a CDN in front of /app/render/blob/. By default, this app.
+RENDER_RESPONSE_MODE = os.getenv("RENDER_RESPONSE_MODE", "content")
+RENDER_BLOB_URL = os.getenv("RENDER_BLOB_URL", "")
+
+# Warm up every worker before it accepts requests, see app/startup.py.
+# WARMUP_RENDER_KEYS is how many of the current renders are loaded into the in-memory render cache.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "True") == "True"
+WARMUP_RENDER_KEYS = int(os.getenv("WARMUP_RENDER_KEYS", 200))
+
+# Where the image blobs of the render cache live, see app/image_store.py:
+#   "files": Files in RENDER_BLOB_DIR, served with sendfile, evicted least recently used beyond RENDER_BLOB_MAX_BYTES.
+#   "cache": The render cache, next to the pointers.
+RENDER_BLOB_STORE = os.getenv("RENDER_BLOB_STORE", "files")
+RENDER_BLOB_DIR = os.getenv("RENDER_BLOB_DIR", "/tmp/image_gallery_blobs")
+RENDER_BLOB_MAX_BYTES = int(os.getenv("RENDER_BLOB_MAX_BYTES", 1024 * 1024 * 1024))
+
+# Stale-while-revalidate: after a render expires, it is still served for this many seconds, while it is refreshed
+# in the background by up to RENDER_REFRESH_CONCURRENCY threads per worker. See app/revalidation.py.
+# Only requests after that wait for a new image. 0 turns it off.
+RENDER_STALE_TIMEOUT = int(os.getenv("RENDER_STALE_TIMEOUT", 10 * 60))
+RENDER_REFRESH_CONCURRENCY = int(os.getenv("RENDER_REFRESH_CONCURRENCY", "4"))
+
+# Limits of the batch render endpoint: targets per request, and misses rendered in parallel
+RENDER_BATCH_MAX_TARGETS = int(os.getenv("RENDER_BATCH_MAX_TARGETS", "50"))
+RENDER_BATCH_CONCURRENCY = int(os.getenv("RENDER_BATCH_CONCURRENCY", "8"))
+
+# Encodings of renders, see app/encoders.py.
+# The default encoding per device type, as "DEVICE_TYPE=encoding,...". Device types without one get the image as it is.
+RENDER_DEVICE_ENCODINGS = dict(
+    item.split("=", 1)
+    for item in os.getenv("RENDER_DEVICE_ENCODINGS", "").split(",")
+    if item
+)
+RENDER_JPEG_QUALITY = int(os.getenv("RENDER_JPEG_QUALITY", "80"))
+RENDER_WEBP_QUALITY = int(os.getenv("RENDER_WEBP_QUALITY", "80"))
+
+# Render responses tell devices when to poll next, spread over up to this many seconds after the render expires,
+# see app/refresh_hints.py
+RENDER_REFRESH_JITTER = int(os.getenv("RENDER_REFRESH_JITTER", 5 * 60))
+
+# Concurrent render cache misses for the same key wait for one fetch, see app/single_flight.py.
+# Other workers wait on the fetching worker for at most this many seconds.
+RENDER_SINGLE_FLIGHT_LEASE_TIMEOUT = float(
+    os.getenv("RENDER_SINGLE_FLIGHT_LEASE_TIMEOUT", IMAGE_UPSTREAM_TIMEOUT + 5)
+)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
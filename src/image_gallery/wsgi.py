@@ -9,9 +9,16 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "image_gallery.settings")
 
 
 application = get_wsgi_application()
+
+if settings.WARMUP_ENABLED:
+    # Before the worker accepts requests, see app/startup.py.
+    from app.startup import warm_up
+
+    warm_up()